@@ -0,0 +1,65 @@
+"""
+Sync (gunicorn) vs async (uvicorn) throughput benchmark
+
+Starts the Flask app under gunicorn.conf.py and the ASGI app in
+service.asgi under uvicorn with the same number of worker processes, and
+drives both with many concurrent keep-alive clients on the read endpoint
+(GET a shopcart) and the write endpoint (POST an item).
+
+Usage:
+    python -m benchmarks.bench_asgi --workers 2 --concurrency 128
+"""
+import os
+import sys
+import argparse
+import subprocess
+from benchmarks.loadgen import wait_for_server, stop_server, run_read_write, print_table
+
+
+def start_server(mode: str, port: int, workers: int):
+    """Starts the sync or the async server"""
+    if mode == "sync":
+        env = dict(
+            os.environ,
+            GUNICORN_BIND=f"127.0.0.1:{port}",
+            GUNICORN_WORKERS=str(workers),
+            GUNICORN_LOG_LEVEL="warning",
+            GUNICORN_MAX_REQUESTS="0",
+        )
+        command = ["-m", "gunicorn", "--config", "gunicorn.conf.py", "service:app"]
+    else:
+        env = dict(os.environ)
+        command = [
+            "-m", "uvicorn", "service.asgi:app",
+            "--port", str(port), "--workers", str(workers), "--log-level", "warning",
+        ]
+    return subprocess.Popen([sys.executable, *command], env=env)  # pylint: disable=consider-using-with
+
+
+def bench_mode(args, mode: str) -> list:
+    """Runs the read and write scenarios against one server"""
+    process = start_server(mode, args.port, args.workers)
+    try:
+        wait_for_server(args.port)
+        rows = run_read_write(args.port, args.concurrency, args.duration, args.items)
+        return [{"server": mode, **row} for row in rows]
+    finally:
+        stop_server(process)
+
+
+def main():
+    """Parses the arguments and prints one row per server and endpoint"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=128)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--items", type=int, default=20)
+    parser.add_argument("--port", type=int, default=8098)
+    args = parser.parse_args()
+
+    rows = bench_mode(args, "sync") + bench_mode(args, "async")
+    print_table(rows, ["server", "endpoint", "requests", "errors", "rps", "p50_ms", "p99_ms"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+API docs startup and spec serving benchmark
+
+Imports the service in a fresh interpreter with API_DOCS_ENABLED on and
+off and reports the import time and resident memory of each, then times
+GET /api/swagger.json served from the cache against flask-restx's own
+view, which serializes the spec to JSON again on every request.
+
+Usage:
+    python -m benchmarks.bench_docs --requests 200
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from benchmarks.loadgen import print_table
+
+PROBE = """
+import json, time
+start = time.perf_counter()
+import service
+elapsed = time.perf_counter() - start
+from service.common import profiling
+print(json.dumps({"import_ms": elapsed * 1000, "rss_mb": profiling.rss_bytes() / 2**20}))
+"""
+
+
+def measure_startup(enabled: bool) -> dict:
+    """Imports the service in a subprocess and returns its import time and RSS"""
+    env = {"API_DOCS_ENABLED": "true" if enabled else "false"}
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE], env={**os.environ, **env},
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return {"docs": "enabled" if enabled else "disabled", **json.loads(output.strip().splitlines()[-1])}
+
+
+def _time_requests(client, requests: int, headers: dict) -> float:
+    """Returns the mean milliseconds of GET /api/swagger.json"""
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.get("/api/swagger.json", headers=headers)
+    return (time.perf_counter() - start) * 1000 / requests
+
+
+def measure_spec(requests: int) -> list:
+    """Times the cached spec view against the flask-restx view, plain and gzipped"""
+    from service import app, api  # pylint: disable=import-outside-toplevel
+
+    client = app.test_client()
+    cached_view = app.view_functions["specs"]
+    rows = []
+    for encoding in ("identity", "gzip"):
+        headers = {"Accept-Encoding": encoding}
+        etag = client.get("/api/swagger.json", headers=headers).headers["ETag"]
+        rows.append({"view": "cached", "encoding": encoding, "ms": _time_requests(client, requests, headers)})
+        rows.append({
+            "view": "cached, If-None-Match", "encoding": encoding,
+            "ms": _time_requests(client, requests, {**headers, "If-None-Match": etag}),
+        })
+        # what flask-restx's SwaggerView returns for every request
+        app.view_functions["specs"] = lambda: api.make_response(api.__schema__, 200)
+        rows.append({"view": "flask-restx", "encoding": encoding, "ms": _time_requests(client, requests, headers)})
+        app.view_functions["specs"] = cached_view
+    return rows
+
+
+def main():
+    """Parses the arguments and prints the startup and spec serving tables"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    print_table([measure_startup(True), measure_startup(False)], ["docs", "import_ms", "rss_mb"])
+    print()
+    print_table(measure_spec(args.requests), ["view", "encoding", "ms"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+JSON vs MessagePack payload benchmark
+
+Encodes and decodes shopcarts of growing size the way the API sends them
+(Shopcart.serialize() dictionaries) and reports the payload size, plain
+and gzipped, and the mean encode and decode time of each format. Runs in
+process, no database needed.
+
+Usage:
+    python -m benchmarks.bench_msgpack --rounds 200
+"""
+import json
+import time
+import gzip
+import random
+import argparse
+import msgpack
+from benchmarks.loadgen import print_table
+
+
+def make_shopcart(items: int) -> dict:
+    """Returns a serialized shopcart with a number of items"""
+    return {
+        "id": 1234,
+        "customer_id": 5678,
+        "items": [
+            {
+                "shopcart_id": 1234,
+                "product_id": 100000 + number,
+                "quantity": random.randint(1, 10),
+                "price": round(random.uniform(0.5, 500.0), 2),
+            }
+            for number in range(items)
+        ],
+    }
+
+
+def time_call(function, rounds: int) -> float:
+    """Returns the mean microseconds of a call"""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        function()
+    return (time.perf_counter() - start) * 1e6 / rounds
+
+
+def bench_format(name, encode, decode, shopcart, rounds: int) -> dict:
+    """Measures one format on one shopcart"""
+    payload = encode(shopcart)
+    return {
+        "items": len(shopcart["items"]),
+        "format": name,
+        "bytes": len(payload),
+        "gzip_bytes": len(gzip.compress(payload, 6)),
+        "encode_us": time_call(lambda: encode(shopcart), rounds),
+        "decode_us": time_call(lambda: decode(payload), rounds),
+    }
+
+
+def main():
+    """Parses the arguments and prints one row per cart size and format"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--sizes", default="10,100,1000,10000")
+    args = parser.parse_args()
+
+    rows = []
+    for size in map(int, args.sizes.split(",")):
+        shopcart = make_shopcart(size)
+        rows.append(bench_format(
+            "json", lambda data: json.dumps(data).encode(), json.loads, shopcart, args.rounds
+        ))
+        rows.append(bench_format(
+            "msgpack", msgpack.packb, lambda data: msgpack.unpackb(data, raw=False), shopcart, args.rounds
+        ))
+    print_table(rows, ["items", "format", "bytes", "gzip_bytes", "encode_us", "decode_us"])
+
+
+if __name__ == "__main__":
+    main()
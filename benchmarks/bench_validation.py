@@ -0,0 +1,60 @@
+"""
+Request validation microbenchmark
+
+Times the per-request cost of checking the query string and the JSON body
+of the item endpoints: flask-restx reqparse against the compiled
+QueryValidator, and flask-restx's jsonschema model validation (what
+@api.expect(model, validate=True) runs) against the compiled BodyValidator.
+Runs in process, no database needed.
+
+Usage:
+    python -m benchmarks.bench_validation --rounds 20000
+"""
+import time
+import argparse
+from benchmarks.loadgen import print_table
+
+QUERY = "product_ids=1,2,3&min_price=1.5&max_quantity=10&sort=-price&limit=50"
+ITEM = {"shopcart_id": 1, "product_id": 7, "quantity": 2, "price": 9.99}
+SHOPCART = {"customer_id": 1, "items": [dict(ITEM, product_id=n) for n in range(20)]}
+
+
+def time_call(function, rounds: int) -> float:
+    """Returns the mean microseconds of a call"""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        function()
+    return (time.perf_counter() - start) * 1e6 / rounds
+
+
+def main():
+    """Parses the arguments and prints one row per check"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--rounds", type=int, default=20000)
+    args = parser.parse_args()
+
+    # pylint: disable=import-outside-toplevel
+    from service import app, api
+    from service.routes import (
+        cartItem_args, cartItem_query, cartItem_model, cartItem_body, create_shopcart_model, shopcart_body
+    )
+
+    rows = []
+    with app.test_request_context(f"/api/shopcarts/1/items?{QUERY}"):
+        rows.append({"check": "item query", "validator": "reqparse",
+                     "us": time_call(cartItem_args.parse_args, args.rounds)})
+        rows.append({"check": "item query", "validator": "compiled",
+                     "us": time_call(cartItem_query.parse, args.rounds)})
+        for name, model, body, compiled in (
+            ("item body", cartItem_model, ITEM, cartItem_body),
+            ("shopcart body, 20 items", create_shopcart_model, SHOPCART, shopcart_body),
+        ):
+            rows.append({"check": name, "validator": "jsonschema",
+                         "us": time_call(lambda model=model, body=body: model.validate(body, api.refresolver), args.rounds)})
+            rows.append({"check": name, "validator": "compiled",
+                         "us": time_call(lambda compiled=compiled, body=body: compiled.validate(body), args.rounds)})
+    print_table(rows, ["check", "validator", "us"])
+
+
+if __name__ == "__main__":
+    main()
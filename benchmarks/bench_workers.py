@@ -0,0 +1,68 @@
+"""
+Gunicorn worker class benchmark
+
+Starts the service under gunicorn.conf.py once per worker class and drives
+the read endpoint (GET a shopcart) and the write endpoint (POST an item)
+with concurrent keep-alive clients.
+
+Usage:
+    python -m benchmarks.bench_workers --classes sync,gthread --threads 4
+"""
+import os
+import sys
+import argparse
+import subprocess
+from benchmarks.loadgen import wait_for_server, stop_server, run_read_write, print_table
+
+
+def start_gunicorn(port: int, worker_class: str, workers: int, threads: int):
+    """Starts gunicorn with the project config and the given worker settings"""
+    env = dict(
+        os.environ,
+        GUNICORN_BIND=f"127.0.0.1:{port}",
+        GUNICORN_WORKER_CLASS=worker_class,
+        GUNICORN_WORKERS=str(workers),
+        GUNICORN_THREADS=str(threads),
+        GUNICORN_LOG_LEVEL="warning",
+        # recycling a worker drops its keep-alive connections mid-run
+        GUNICORN_MAX_REQUESTS=os.getenv("GUNICORN_MAX_REQUESTS", "0"),
+    )
+    return subprocess.Popen(  # pylint: disable=consider-using-with
+        [sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py", "service:app"],
+        env=env,
+    )
+
+
+def bench_worker_class(args, worker_class: str) -> list:
+    """Runs the read and write scenarios against one worker class"""
+    process = start_gunicorn(args.port, worker_class, args.workers, args.threads)
+    try:
+        wait_for_server(args.port)
+        rows = run_read_write(args.port, args.concurrency, args.duration, args.items)
+        return [{"worker_class": worker_class, **row} for row in rows]
+    finally:
+        stop_server(process)
+
+
+def main():
+    """Parses the arguments and prints one row per worker class and endpoint"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--classes", default="sync,gthread")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--items", type=int, default=20)
+    parser.add_argument("--port", type=int, default=8099)
+    args = parser.parse_args()
+
+    rows = []
+    for worker_class in args.classes.split(","):
+        rows.extend(bench_worker_class(args, worker_class))
+    print_table(
+        rows, ["worker_class", "endpoint", "requests", "errors", "rps", "p50_ms", "p99_ms"]
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Load generator shared by the HTTP benchmarks
+
+Runs a fixed number of client threads against a server for a fixed time,
+each thread keeping one HTTP/1.1 connection open, and reports throughput
+and latency percentiles.
+"""
+import json
+import time
+import random
+import statistics
+import threading
+import subprocess
+import http.client
+from urllib.error import URLError
+from urllib.request import urlopen
+
+
+def wait_for_server(port: int, path: str = "/health", timeout: float = 30.0) -> None:
+    """Blocks until the server answers on the given port"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urlopen(f"http://127.0.0.1:{port}{path}", timeout=1):
+                return
+        except (URLError, ConnectionError, OSError):
+            time.sleep(0.2)
+    raise RuntimeError(f"Server on port {port} did not start within {timeout}s")
+
+
+def stop_server(process: subprocess.Popen) -> None:
+    """Terminates a server process and waits for it to exit"""
+    process.terminate()
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def request(conn, method: str, path: str, body=None):
+    """Sends one JSON request on a persistent connection and returns (status, data)"""
+    headers = {"Content-Type": "application/json"} if body is not None else {}
+    payload = json.dumps(body) if body is not None else None
+    conn.request(method, path, body=payload, headers=headers)
+    resp = conn.getresponse()
+    data = resp.read()
+    return resp.status, data
+
+
+def create_shopcart(port: int, items: int = 0) -> int:
+    """Creates a shopcart with `items` items and returns its id"""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    body = {
+        "customer_id": random.randint(1, 2**31 - 1),
+        "items": [
+            {"shopcart_id": 0, "product_id": n, "quantity": 1, "price": 9.99}
+            for n in range(items)
+        ],
+    }
+    code, data = request(conn, "POST", "/api/shopcarts", body)
+    conn.close()
+    if code != 201:
+        raise RuntimeError(f"Could not create shopcart: {code} {data[:200]!r}")
+    return json.loads(data)["id"]
+
+
+def run_load(port: int, make_request, concurrency: int, duration: float) -> dict:
+    """
+    Calls make_request(conn, thread_number) in `concurrency` threads
+
+    Returns the request count, errors, throughput and latency percentiles.
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(number):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        local, failed = [], 0
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                code, _ = make_request(conn, number)
+                if code >= 400:
+                    failed += 1
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            local.append(time.perf_counter() - started)
+        conn.close()
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+    if not latencies:
+        return {"requests": 0, "errors": errors[0], "rps": 0.0, "p50_ms": 0.0, "p99_ms": 0.0}
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "rps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+def run_read_write(port: int, concurrency: int, duration: float, items: int) -> list:
+    """
+    Runs the read scenario (GET a shopcart with `items` items) and the write
+    scenario (POST an item to a per-client shopcart) and returns one result each
+    """
+    shopcart_id = create_shopcart(port, items=items)
+    carts = [create_shopcart(port) for _ in range(concurrency)]
+
+    def read(conn, _):
+        return request(conn, "GET", f"/api/shopcarts/{shopcart_id}")
+
+    def write(conn, number):
+        item = {"product_id": 1, "quantity": 1, "price": 1.0}
+        return request(conn, "POST", f"/api/shopcarts/{carts[number]}/items", item)
+
+    return [
+        {"endpoint": name, **run_load(port, scenario, concurrency, duration)}
+        for name, scenario in (("read", read), ("write", write))
+    ]
+
+
+def print_table(rows: list, columns: list) -> None:
+    """Prints a list of result dictionaries as an aligned table"""
+    widths = {col: max(len(col), *(len(_fmt(row[col])) for row in rows)) for col in columns}
+    print("  ".join(col.ljust(widths[col]) for col in columns))
+    print("  ".join("-" * widths[col] for col in columns))
+    for row in rows:
+        print("  ".join(_fmt(row[col]).ljust(widths[col]) for col in columns))
+
+
+def _fmt(value) -> str:
+    """Formats a table cell"""
+    return f"{value:.1f}" if isinstance(value, float) else str(value)
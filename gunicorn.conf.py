@@ -0,0 +1,126 @@
+"""
+Gunicorn configuration for the Shopcart service
+
+Worker count and class are sized from the container CPU and memory limits
+and can be overridden with GUNICORN_* environment variables. The app is
+preloaded in the master so workers share its memory copy-on-write.
+"""
+# pylint: disable=invalid-name
+import gc
+import os
+import math
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+
+def _read_cgroup(*paths):
+    """Returns the first readable cgroup file contents or None"""
+    for path in paths:
+        try:
+            with open(os.path.join(CGROUP_ROOT, path), encoding="ascii") as cgroup:
+                return cgroup.read().strip()
+        except OSError:
+            continue
+    return None
+
+
+def cpu_limit() -> float:
+    """Returns the number of CPUs this container may use"""
+    cpus = float(len(os.sched_getaffinity(0)))
+    quota = _read_cgroup("cpu.max")  # cgroup v2: "<quota> <period>"
+    if quota:
+        quota, period = quota.split()
+        if quota != "max":
+            cpus = min(cpus, int(quota) / int(period))
+        return cpus
+    quota = _read_cgroup("cpu/cpu.cfs_quota_us", "cpu,cpuacct/cpu.cfs_quota_us")
+    period = _read_cgroup("cpu/cpu.cfs_period_us", "cpu,cpuacct/cpu.cfs_period_us")
+    if quota and period and int(quota) > 0:
+        cpus = min(cpus, int(quota) / int(period))
+    return cpus
+
+
+def memory_limit():
+    """Returns the memory limit of this container in bytes or None"""
+    limit = _read_cgroup("memory.max", "memory/memory.limit_in_bytes")
+    if not limit or limit == "max" or int(limit) >= 2**60:
+        return None
+    return int(limit)
+
+
+def default_workers() -> int:
+    """2 x CPUs + 1 workers, but no more than fit in the memory limit"""
+    count = 2 * math.ceil(cpu_limit()) + 1
+    limit = memory_limit()
+    if limit:
+        per_worker = int(os.getenv("GUNICORN_WORKER_MEMORY_MB", "40")) * 1024 * 1024
+        # keep one worker's worth of headroom for the master process
+        count = min(count, limit // per_worker - 1)
+    return max(1, count)
+
+
+######################################################################
+# Server settings
+######################################################################
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '8080')}")
+workers = int(os.getenv("GUNICORN_WORKERS", "0")) or default_workers()
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "100"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+# Objects created while preloading the app are never collected again, so
+# keep the collector from touching (and un-sharing) their pages in the master
+if preload_app:
+    gc.disable()
+
+
+######################################################################
+# Server hooks
+######################################################################
+def when_ready(server):
+    """Logs the sizing that was chosen"""
+    server.log.info(
+        "Gunicorn ready: %d x %s workers, %d threads, preload=%s",
+        workers,
+        worker_class,
+        threads,
+        preload_app,
+    )
+
+
+def pre_fork(server, worker):  # pylint: disable=unused-argument
+    """Moves everything the preloaded app allocated into the permanent generation"""
+    if server.cfg.preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    """Re-enables gc and replaces the database pools inherited from the master"""
+    gc.enable()
+    if not server.cfg.preload_app:
+        return
+
+    # pylint: disable=import-outside-toplevel
+    from service import app
+    from service.models import db
+
+    with app.app_context():
+        for engine in db.engines.values():
+            # the master's connections must not be shared: drop them
+            # without closing the sockets that the master still owns
+            engine.dispose(close=False)
+            try:
+                connections = [
+                    engine.connect() for _ in range(min(threads, engine.pool.size()))
+                ]
+                for connection in connections:
+                    connection.close()
+            except Exception as error:  # pylint: disable=broad-except
+                worker.log.warning("Could not warm database pool: %s", error)
+    worker.log.info("Worker %s: database pool reset", worker.pid)
@@ -8,7 +8,7 @@ import sys
 from flask import Flask
 from flask_restx import Api
 from service import config
-from service.common import log_handlers
+from service.common import log_handlers, tracing, routing, compression, docs
 
 # Create Flask application
 app = Flask(__name__)
@@ -22,7 +22,7 @@ api = Api(
     description="This REST API service provides endpoints for managing shopcarts.",
     default="shopcarts",
     default_label="shopcart operations",
-    doc="/apidocs",
+    doc="/apidocs" if config.API_DOCS_ENABLED else False,
     prefix="/api",
 )
 
@@ -31,11 +31,26 @@ api = Api(
 from service import routes, models  # noqa: E402, E261
 
 # pylint: disable=wrong-import-position
-from service.common import error_handlers, cli_commands  # noqa: F401, E402
+from service.common import error_handlers, cli_commands, messagepack  # noqa: F401, E402
 
 # Set up logging for production
 log_handlers.init_logging(app, "gunicorn.error")
 
+# Set up request tracing
+tracing.init_tracing(app)
+
+# Send the reads of GET requests to the read replicas
+routing.init_routing(app)
+
+# Compress responses and serve precompressed static files
+compression.init_compression(app)
+
+# Serve the Swagger spec from a cache
+docs.init_docs(app, api)
+
+# Accept and serve MessagePack next to JSON
+messagepack.init_messagepack(app, api)
+
 app.logger.info(70 * "*")
 app.logger.info("  S H O P C A R T   S E R V I C E   R U N N I N G  ".center(70, "*"))
 app.logger.info(70 * "*")
@@ -0,0 +1,457 @@
+"""
+Async Shopcart API Service
+
+An asyncio serving mode with the same routes and JSON contract as the
+Flask API in routes.py. It runs on an ASGI server (uvicorn) and talks to
+Postgres through SQLAlchemy's asyncio extension and asyncpg, so a request
+waiting on the database does not pin a worker.
+
+The models, deserialize(), the item queries of CartItem.page_statement
+and the compiled request validators of routes.py (including
+apply_item_changes) are shared with the Flask app, so a bad request gets
+the same 400 body from both.
+
+It serves a single database: with DATABASE_SHARD_URIS set it refuses to
+start, since it does not route carts to their shards.
+
+Usage:
+    uvicorn service.asgi:app --host 0.0.0.0 --port 8080 --workers 2
+"""
+from contextlib import asynccontextmanager
+from psycopg2 import errorcodes
+from sqlalchemy import select, delete, exists, inspect
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError, DataError
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+from werkzeug.exceptions import HTTPException, abort
+from service import app as flask_app
+from service.models import CartItem, Shopcart, DataValidationError, DataConflictError
+from service.routes import (
+    api,
+    shopcart_model,
+    shopcart_fields_query,
+    requested_fields,
+    apply_item_changes,
+    shopcart_body,
+    shopcart_query,
+    cartItem_body,
+    cartItem_query,
+    delete_items_query,
+    product_ids_to_delete,
+    lookup_args,
+    lookup_keys,
+    lookup_results,
+    item_filters,
+    check_item_found,
+    encode_cursor,
+)
+from service.common import status
+
+
+######################################################################
+#  D A T A B A S E
+######################################################################
+def async_database_uri(uri: str):
+    """Returns the DATABASE_URI with the asyncpg driver"""
+    return make_url(uri).set(drivername="postgresql+asyncpg")
+
+
+@asynccontextmanager
+async def lifespan(asgi_app):
+    """Creates the async engine and pool on startup and disposes it on shutdown"""
+    shards = flask_app.extensions["shard_map"].count
+    if shards > 1:  # carts would land on shard 0 whatever their customer
+        raise RuntimeError(
+            f"The ASGI app serves a single database but {shards} shards are configured: "
+            "unset DATABASE_SHARD_URIS or serve the Flask app"
+        )
+    config = flask_app.config
+    engine = create_async_engine(
+        async_database_uri(config["SQLALCHEMY_DATABASE_URI"]),
+        pool_size=config["ASYNC_DATABASE_POOL_SIZE"],
+        max_overflow=config["ASYNC_DATABASE_MAX_OVERFLOW"],
+        pool_pre_ping=True,
+    )
+    asgi_app.state.sessionmaker = async_sessionmaker(engine, expire_on_commit=False)
+    yield
+    await engine.dispose()
+
+
+def session_for(request):
+    """Returns a new AsyncSession for the request"""
+    return request.app.state.sessionmaker()
+
+
+async def find_shopcart(session, shopcart_id, with_items=True):
+    """Finds a Shopcart by id, loading its items unless told otherwise"""
+    query = select(Shopcart).where(Shopcart.id == shopcart_id).options(Shopcart.items_loader(with_items))
+    return (await session.execute(query)).scalar_one_or_none()
+
+
+async def find_cart_item(session, shopcart_id, product_id):
+    """Finds a CartItem in a shopcart"""
+    query = select(CartItem).where(
+        CartItem.shopcart_id == shopcart_id, CartItem.product_id == product_id
+    )
+    return (await session.execute(query)).scalar_one_or_none()
+
+
+async def commit(session):
+    """Commits the session, translating integrity errors like PersistentBase"""
+    try:
+        await session.commit()
+    except (IntegrityError, DataError) as error:
+        await session.rollback()
+        if getattr(error.orig, "pgcode", None) == errorcodes.UNIQUE_VIOLATION:
+            raise DataConflictError(
+                "Duplicate Shopcart: Shopcart for customer already exists"
+            ) from error
+        raise DataValidationError("Invalid Shopcart: " + error.args[0]) from error
+
+
+######################################################################
+#  U T I L I T Y   F U N C T I O N S
+######################################################################
+def check_content_type(request, media_type):
+    """Checks that the media type is correct"""
+    content_type = request.headers.get("Content-Type")
+    if content_type and content_type == media_type:
+        return
+    flask_app.logger.error("Invalid Content-Type: %s", content_type)
+    abort(status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, f"Content-Type must be {media_type}")
+
+
+async def get_payload(request):
+    """Returns the JSON body of the request"""
+    try:
+        return await request.json()
+    except (ValueError, UnicodeDecodeError):
+        abort(status.HTTP_400_BAD_REQUEST, "The request body is not valid JSON.")
+    return None  # never reached, abort() raises
+
+
+def shopcart_not_found(shopcart_id):
+    """Aborts with the same 404 message as the Flask routes"""
+    abort(
+        status.HTTP_404_NOT_FOUND,
+        f"Shopcart with id '{shopcart_id}' could not be found.",
+    )
+
+
+######################################################################
+#  PATH: /api/shopcarts
+######################################################################
+async def list_shopcarts(request):
+    """Returns all shopcarts, optionally filtered by customer_id or product_id or fetched by ids or customer_ids"""
+    args = shopcart_query.parse(request.query_params)
+    mask, with_items = requested_fields(args)
+    lookup = lookup_args(args)
+    if lookup:
+        return await lookup_shopcarts(request, *lookup, with_items, mask)
+
+    customer_id, product_id = args["customer_id"], args["product_id"]
+    query = select(Shopcart).options(Shopcart.items_loader(with_items))
+    if customer_id:
+        query = query.where(Shopcart.customer_id == customer_id)
+    elif product_id:
+        query = query.where(
+            exists().where(
+                CartItem.shopcart_id == Shopcart.id, CartItem.product_id == product_id
+            )
+        )
+    async with session_for(request) as session:
+        shopcarts = (await session.execute(query)).scalars().all()
+        results = [shopcart.serialize() for shopcart in shopcarts]
+    return JSONResponse(api.marshal(results, shopcart_model, mask=mask), status.HTTP_200_OK)
+
+
+async def lookup_shopcarts(request, keys, by_customer, with_items, mask):
+    """Returns the shopcarts of many ids or customer ids with one IN (...) query, like the Flask route"""
+    keys = lookup_keys(keys)
+    column = Shopcart.customer_id if by_customer else Shopcart.id
+    query = select(Shopcart).where(column.in_(keys)).options(Shopcart.items_loader(with_items))
+    async with session_for(request) as session:
+        shopcarts = (await session.execute(query)).scalars().all()
+        results, missing = lookup_results(keys, {getattr(cart, column.key): cart for cart in shopcarts})
+    return JSONResponse(
+        api.marshal(results, shopcart_model, mask=mask),
+        status.HTTP_200_OK,
+        {"X-Missing-Ids": ",".join(map(str, missing))},
+    )
+
+
+async def create_shopcart(request):
+    """Creates a shopcart for a customer"""
+    check_content_type(request, "application/json")
+    shopcart = Shopcart()
+    shopcart.deserialize(shopcart_body.validate(await get_payload(request)))
+    if "items" in inspect(shopcart).unloaded:
+        # a new cart without items: mark it empty so serialize() never lazy loads
+        set_committed_value(shopcart, "items", [])
+    async with session_for(request) as session:
+        session.add(shopcart)
+        await commit(session)
+        message = shopcart.serialize()
+    location_url = str(request.url_for("get_shopcart", shopcart_id=shopcart.id))
+    return JSONResponse(
+        message, status.HTTP_201_CREATED, headers={"Location": location_url}
+    )
+
+
+######################################################################
+#  PATH: /api/shopcarts/{shopcart_id}
+######################################################################
+async def get_shopcart(request):
+    """Retrieves a shopcart given a shopcart id"""
+    shopcart_id = request.path_params["shopcart_id"]
+    mask, with_items = requested_fields(shopcart_fields_query.parse(request.query_params))
+    async with session_for(request) as session:
+        shopcart = await find_shopcart(session, shopcart_id, with_items)
+        if not shopcart:
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                f"404 Not Found. Shopcart with id '{shopcart_id}' could not be found.",
+            )
+        return JSONResponse(api.marshal(shopcart.serialize(), shopcart_model, mask=mask), status.HTTP_200_OK)
+
+
+async def update_shopcart(request):
+    """Replaces a shopcart and its items with the request JSON"""
+    check_content_type(request, "application/json")
+    shopcart_id = request.path_params["shopcart_id"]
+    data = shopcart_body.validate(await get_payload(request))
+    async with session_for(request) as session:
+        shopcart = await find_shopcart(session, shopcart_id)
+        if not shopcart:
+            shopcart_not_found(shopcart_id)
+        await session.execute(delete(CartItem).where(CartItem.shopcart_id == shopcart_id))
+        set_committed_value(shopcart, "items", [])
+        shopcart.deserialize(data)
+        await commit(session)
+        return JSONResponse(shopcart.serialize(), status.HTTP_200_OK)
+
+
+async def delete_shopcart(request):
+    """Deletes a shopcart given a shopcart id"""
+    shopcart_id = request.path_params["shopcart_id"]
+    async with session_for(request) as session:
+        # items are removed by the ON DELETE CASCADE foreign key
+        await session.execute(delete(Shopcart).where(Shopcart.id == shopcart_id))
+        await session.commit()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+######################################################################
+#  PATH: /api/shopcarts/{shopcart_id}/items
+######################################################################
+async def create_cart_item(request):
+    """Adds an item to a shopcart, incrementing its quantity if it is there"""
+    check_content_type(request, "application/json")
+    shopcart_id = request.path_params["shopcart_id"]
+    data = cartItem_body.validate(await get_payload(request))
+    data["shopcart_id"] = shopcart_id
+    cart_item = CartItem().deserialize(data)
+
+    async with session_for(request) as session:
+        if not await find_shopcart(session, shopcart_id, with_items=False):
+            shopcart_not_found(shopcart_id)
+        # one round trip, and concurrent adds of the same product cannot lose updates
+        upsert = insert(CartItem).values(**cart_item.serialize())
+        upsert = upsert.on_conflict_do_update(
+            index_elements=[CartItem.shopcart_id, CartItem.product_id],
+            set_={"quantity": CartItem.quantity + upsert.excluded.quantity},
+        ).returning(CartItem)
+        saved = (await session.execute(upsert)).scalar_one()
+        message = saved.serialize()
+        await commit(session)
+
+    location_url = str(request.url_for("get_shopcart", shopcart_id=shopcart_id))
+    return JSONResponse(
+        message, status.HTTP_201_CREATED, headers={"Location": location_url}
+    )
+
+
+async def list_cart_items(request):
+    """Returns the items of a shopcart, filtered, sorted and paginated in the database"""
+    shopcart_id = request.path_params["shopcart_id"]
+    async with session_for(request) as session:
+        shopcart = await find_shopcart(session, shopcart_id, with_items=False)
+        if not shopcart:
+            shopcart_not_found(shopcart_id)
+        args = cartItem_query.parse(request.query_params)
+        filters, after = item_filters(args)
+        statement, keys = CartItem.page_statement(shopcart_id, filters, args["sort"], args["limit"], after)
+        items, next_after = CartItem.page((await session.scalars(statement)).all(), args["limit"], keys)
+        check_item_found(shopcart_id, args, items)
+        results = [item.serialize() for item in items]
+    headers = {"X-Next-Cursor": encode_cursor(next_after)} if next_after else {}
+    return JSONResponse(results, status.HTTP_200_OK, headers)
+
+
+async def delete_cart_items(request):
+    """Deletes multiple products from a shopcart with one statement"""
+    shopcart_id = request.path_params["shopcart_id"]
+    payload = None
+    if int(request.headers.get("Content-Length") or 0):
+        check_content_type(request, "application/json")
+        payload = await get_payload(request)
+    product_ids = product_ids_to_delete(delete_items_query.parse(request.query_params), payload)
+
+    deleted = set()
+    if product_ids:
+        async with session_for(request) as session:
+            result = await session.execute(CartItem.delete_many_statement(shopcart_id, product_ids))
+            deleted = set(result.scalars().all())
+            await session.commit()
+    missing = [product_id for product_id in product_ids if product_id not in deleted]
+    return Response(
+        status_code=status.HTTP_204_NO_CONTENT,
+        headers={"X-Missing-Ids": ",".join(map(str, missing))},
+    )
+
+
+######################################################################
+#  PATH: /api/shopcarts/{shopcart_id}/items/{product_id}
+######################################################################
+async def get_cart_item(request):
+    """Retrieves an item from a shopcart by product id"""
+    shopcart_id = request.path_params["shopcart_id"]
+    product_id = request.path_params["product_id"]
+    async with session_for(request) as session:
+        if not await find_shopcart(session, shopcart_id, with_items=False):
+            shopcart_not_found(shopcart_id)
+        cart_item = await find_cart_item(session, shopcart_id, product_id)
+        if not cart_item:
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                f"Product with id '{product_id}' not found in shopcart {shopcart_id}",
+            )
+        return JSONResponse(cart_item.serialize(), status.HTTP_200_OK)
+
+
+async def update_cart_item(request):
+    """Updates the quantity and/or the price of an item in a shopcart"""
+    check_content_type(request, "application/json")
+    shopcart_id = request.path_params["shopcart_id"]
+    product_id = request.path_params["product_id"]
+    data = await get_payload(request)
+    async with session_for(request) as session:
+        cart_item = await find_cart_item(session, shopcart_id, product_id)
+        if not cart_item:
+            # a missing shopcart or item is a 204, like ItemResource.put
+            return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+        apply_item_changes(cart_item, data)
+        await commit(session)
+        return JSONResponse(cart_item.serialize(), status.HTTP_200_OK)
+
+
+async def delete_cart_item(request):
+    """Deletes an item from a shopcart"""
+    shopcart_id = request.path_params["shopcart_id"]
+    product_id = request.path_params["product_id"]
+    async with session_for(request) as session:
+        await session.execute(
+            delete(CartItem).where(
+                CartItem.shopcart_id == shopcart_id, CartItem.product_id == product_id
+            )
+        )
+        await session.commit()
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
+######################################################################
+#  PATH: /api/shopcarts/{shopcart_id}/clear
+######################################################################
+async def clear_cart_items(request):
+    """Removes all items from a shopcart"""
+    shopcart_id = request.path_params["shopcart_id"]
+    async with session_for(request) as session:
+        shopcart = await find_shopcart(session, shopcart_id, with_items=False)
+        if not shopcart:
+            shopcart_not_found(shopcart_id)
+        await session.execute(delete(CartItem).where(CartItem.shopcart_id == shopcart_id))
+        await session.commit()
+        set_committed_value(shopcart, "items", [])
+        return JSONResponse(shopcart.serialize(), status.HTTP_200_OK)
+
+
+async def health(request):  # pylint: disable=unused-argument
+    """Health Status"""
+    return JSONResponse({"status": "OK"}, status.HTTP_200_OK)
+
+
+######################################################################
+#  E R R O R   H A N D L E R S
+######################################################################
+def error_response(code, error, message):
+    """Returns the error body used by service.common.error_handlers"""
+    flask_app.logger.warning(message)
+    return JSONResponse({"status": code, "error": error, "message": message}, code)
+
+
+async def request_validation_error(request, error):  # pylint: disable=unused-argument
+    """Handles Value Errors from bad data"""
+    return error_response(status.HTTP_400_BAD_REQUEST, "Bad Request", str(error))
+
+
+async def data_conflict_error(request, error):  # pylint: disable=unused-argument
+    """Handles conflict errors from create requests"""
+    return error_response(status.HTTP_409_CONFLICT, "Conflict", str(error))
+
+
+async def http_error(request, error):  # pylint: disable=unused-argument
+    """Handles abort() from the shared validators like flask-restx does"""
+    flask_app.logger.warning(error.description)
+    return JSONResponse({"message": error.description}, error.code)
+
+
+async def routing_error(request, error):  # pylint: disable=unused-argument
+    """Handles unknown URLs and unsupported methods"""
+    return error_response(error.status_code, error.detail, error.detail)
+
+
+routes = [
+    Route("/health", health),
+    Route("/api/shopcarts", list_shopcarts, methods=["GET"]),
+    Route("/api/shopcarts", create_shopcart, methods=["POST"]),
+    Route("/api/shopcarts/{shopcart_id:int}", get_shopcart, methods=["GET"]),
+    Route("/api/shopcarts/{shopcart_id:int}", update_shopcart, methods=["PUT"]),
+    Route("/api/shopcarts/{shopcart_id:int}", delete_shopcart, methods=["DELETE"]),
+    Route("/api/shopcarts/{shopcart_id:int}/items", list_cart_items, methods=["GET"]),
+    Route("/api/shopcarts/{shopcart_id:int}/items", create_cart_item, methods=["POST"]),
+    Route("/api/shopcarts/{shopcart_id:int}/items", delete_cart_items, methods=["DELETE"]),
+    Route(
+        "/api/shopcarts/{shopcart_id:int}/items/{product_id:int}",
+        get_cart_item,
+        methods=["GET"],
+    ),
+    Route(
+        "/api/shopcarts/{shopcart_id:int}/items/{product_id:int}",
+        update_cart_item,
+        methods=["PUT"],
+    ),
+    Route(
+        "/api/shopcarts/{shopcart_id:int}/items/{product_id:int}",
+        delete_cart_item,
+        methods=["DELETE"],
+    ),
+    Route("/api/shopcarts/{shopcart_id:int}/clear", clear_cart_items, methods=["PUT"]),
+]
+
+app = Starlette(
+    routes=routes,
+    lifespan=lifespan,
+    exception_handlers={
+        DataValidationError: request_validation_error,
+        DataConflictError: data_conflict_error,
+        HTTPException: http_error,
+        StarletteHTTPException: routing_error,
+    },
+)
@@ -0,0 +1,349 @@
+"""
+Bulk Import and Export
+
+Loads carts from CSV or NDJSON files far faster than POSTing them one at
+a time. Rows are validated as they are read, grouped by shard, and copied
+into a TEMP staging table on each shard with COPY, batch_size rows at a
+time, so memory stays bounded whatever the size of the file. Each shard
+then merges its staging table into shopcart and cart_item with one
+set-based statement, in the same transaction as the COPYs. The shards
+commit one after the other once every merge has succeeded.
+
+Carts are never overwritten: like DataConflictError does for POST, a
+customer that already has a cart keeps it and the imported cart is
+skipped and reported, or, when strict, the whole import is rolled back.
+Two NDJSON lines of the same customer are rejected like a second POST,
+while the CSV rows of a customer make up one cart. Carts get their ids in
+file order. Items repeated within a cart are added up, with the price of
+the last one.
+
+Rows are checked with the body validators of the API, which the caller
+passes in as (cart, item) so this module does not depend on the routes.
+
+Exports stream every cart out of each shard in turn, inside a read-only
+REPEATABLE READ snapshot, without building ORM objects: CSV with COPY TO,
+NDJSON rendered by Postgres and read through a server-side cursor. The
+output can be split into numbered files and gzipped; an exported file
+imports back as it is.
+
+File formats:
+    NDJSON  one cart per line, shaped like the body of POST /api/shopcarts
+            (exports are shaped like GET /api/shopcarts/<id>)
+    CSV     one item per row under a customer_id,product_id,quantity,price
+            header; a row without a product_id makes an empty cart
+            (exports add a leading shopcart_id column)
+"""
+import io
+import os
+import sys
+import csv
+import gzip
+import json
+from service.models import db, DataValidationError, DataConflictError
+from service.common import sharding
+
+STAGING_COLUMNS = ("seq", "customer_id", "product_id", "quantity", "price")
+
+CREATE_STAGING = """
+CREATE TEMP TABLE staging_cart_item (
+    seq bigint NOT NULL,
+    customer_id integer NOT NULL,
+    product_id integer,
+    quantity integer,
+    price double precision
+) ON COMMIT DROP
+"""
+
+COPY_STAGING = f"COPY staging_cart_item ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+
+# The number of customers that already have a cart, and the first few of them
+FIND_CONFLICTS = """
+SELECT staged.customer_id, COUNT(*) OVER ()
+FROM (SELECT DISTINCT customer_id FROM staging_cart_item) AS staged
+WHERE EXISTS (SELECT 1 FROM shopcart WHERE shopcart.customer_id = staged.customer_id)
+ORDER BY staged.customer_id
+LIMIT %s
+"""
+CONFLICTS_REPORTED = 20
+
+MERGE_STAGING = """
+WITH new_carts AS (
+    INSERT INTO shopcart (customer_id)
+    SELECT customer_id FROM staging_cart_item GROUP BY customer_id ORDER BY MIN(seq)
+    ON CONFLICT (customer_id) DO NOTHING
+    RETURNING id, customer_id
+), new_items AS (
+    INSERT INTO cart_item (shopcart_id, product_id, quantity, price)
+    SELECT new_carts.id, staged.product_id, SUM(staged.quantity),
+           (ARRAY_AGG(staged.price ORDER BY staged.seq DESC))[1]
+    FROM staging_cart_item AS staged JOIN new_carts USING (customer_id)
+    WHERE staged.product_id IS NOT NULL
+    GROUP BY new_carts.id, staged.product_id
+    RETURNING 1
+)
+SELECT (SELECT COUNT(*) FROM new_carts), (SELECT COUNT(*) FROM new_items)
+"""
+
+
+######################################################################
+#  R E A D E R S
+######################################################################
+def read_ndjson(file, checks):
+    """Yields (line, customer_id, product_id, quantity, price) from a file of JSON carts"""
+    cart_fields, item_fields = checks
+    lines_of = {}  # customer_id -> the line of its cart
+    for line, text in enumerate(file, 1):
+        if not text.strip():
+            continue
+        try:
+            cart = json.loads(text)
+            if not isinstance(cart, dict):
+                raise DataValidationError("A cart must be a JSON object.")
+            customer_id = cart_fields.validate({"customer_id": cart.get("customer_id")})["customer_id"]
+            items = cart.get("items") or []
+            if not isinstance(items, list):
+                raise DataValidationError("Invalid field 'items': must be a list.")
+            staged = [item_fields.validate(item) for item in items]
+        except (ValueError, DataValidationError) as error:
+            raise DataValidationError(f"Line {line}: {error}") from error
+        if customer_id in lines_of:
+            raise DataConflictError(
+                f"Line {line}: Duplicate Shopcart: customer {customer_id} already has the cart of line {lines_of[customer_id]}"
+            )
+        lines_of[customer_id] = line
+        if not staged:
+            yield line, customer_id, None, None, None
+        for item in staged:
+            yield line, customer_id, item["product_id"], item["quantity"], item["price"]
+
+
+def read_csv(file, checks):
+    """Yields (line, customer_id, product_id, quantity, price) from a CSV file of items"""
+    cart_fields, item_fields = checks
+    reader = csv.DictReader(file)
+    if "customer_id" not in (reader.fieldnames or []):
+        raise DataValidationError("The CSV header must name a customer_id column.")
+    for row in reader:
+        line = reader.line_num
+        try:
+            customer_id = cart_fields.validate({"customer_id": row["customer_id"]})["customer_id"]
+            if not row.get("product_id"):
+                yield line, customer_id, None, None, None
+                continue
+            item = item_fields.validate(row)
+        except DataValidationError as error:
+            raise DataValidationError(f"Line {line}: {error}") from error
+        yield line, customer_id, item["product_id"], item["quantity"], item["price"]
+
+
+READERS = {"ndjson": read_ndjson, "csv": read_csv}
+
+
+######################################################################
+#  I M P O R T
+######################################################################
+class ShardLoader:
+    """A staging table on one shard and the rows waiting to be copied into it"""
+
+    def __init__(self, engine):
+        self.connection = engine.raw_connection()
+        self.cursor = self.connection.cursor()
+        self.cursor.execute(CREATE_STAGING)
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.pending = 0
+
+    def add(self, row) -> None:
+        """Queues a staging row"""
+        self.writer.writerow(row)
+        self.pending += 1
+
+    def flush(self) -> None:
+        """Copies the queued rows into the staging table"""
+        if self.pending:
+            self.buffer.seek(0)
+            self.cursor.copy_expert(COPY_STAGING, self.buffer)
+            self.buffer.seek(0)
+            self.buffer.truncate()
+            self.pending = 0
+
+    def merge(self) -> tuple:
+        """Merges the staging table, returns (carts, items, conflicts, some conflicting customers)"""
+        self.flush()
+        self.cursor.execute("ANALYZE staging_cart_item")
+        self.cursor.execute(FIND_CONFLICTS, (CONFLICTS_REPORTED,))
+        found = self.cursor.fetchall()
+        self.cursor.execute(MERGE_STAGING)
+        carts, items = self.cursor.fetchone()
+        return carts, items, found[0][1] if found else 0, [row[0] for row in found]
+
+    def close(self, commit: bool) -> None:
+        """Commits or rolls back, then returns the connection to the pool"""
+        try:
+            if commit:
+                self.connection.commit()
+            else:
+                self.connection.rollback()
+        finally:
+            self.connection.close()
+
+
+def import_carts(  # pylint: disable=too-many-arguments
+    file, file_format, checks, batch_size=50000, strict=False, progress=None
+) -> dict:
+    """Imports the carts of an open file, checking its rows with the (cart, item) validators of checks
+
+    Returns the counts of what was done
+    """
+    shards = sharding.shard_map()
+    loaders = {}
+    rows = 0
+    succeeded = False
+    try:
+        for row in READERS[file_format](file, checks):
+            shard = row[1] % shards.count
+            if shard not in loaders:
+                loaders[shard] = ShardLoader(db.engines[shards.keys[shard]])
+            loader = loaders[shard]
+            rows += 1
+            loader.add((rows, *row[1:]))  # rows in file order, for the last price
+            if loader.pending >= batch_size:
+                loader.flush()
+                if progress:
+                    progress(rows)
+        result = {"rows": rows, "carts": 0, "items": 0, "conflicts": 0, "conflicting_customers": []}
+        for loader in loaders.values():
+            carts, items, conflicts, customers = loader.merge()
+            result["carts"] += carts
+            result["items"] += items
+            result["conflicts"] += conflicts
+            result["conflicting_customers"] += customers
+        if strict and result["conflicts"]:
+            raise DataConflictError(
+                f"Duplicate Shopcart: {result['conflicts']} customers already have a shopcart"
+            )
+        succeeded = True
+    finally:
+        for loader in loaders.values():
+            loader.close(succeeded)
+    result["conflicting_customers"] = sorted(result["conflicting_customers"])[:CONFLICTS_REPORTED]
+    return result
+
+
+######################################################################
+#  E X P O R T
+######################################################################
+EXPORT_HEADERS = {"csv": "shopcart_id,customer_id,product_id,quantity,price\n", "ndjson": ""}
+
+BEGIN_SNAPSHOT = "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY"
+
+COPY_CART_ITEMS = """
+COPY (
+    SELECT shopcart.id, shopcart.customer_id, cart_item.product_id, cart_item.quantity, cart_item.price
+    FROM shopcart LEFT JOIN cart_item ON cart_item.shopcart_id = shopcart.id
+    ORDER BY shopcart.id, cart_item.product_id
+) TO STDOUT WITH (FORMAT csv)
+"""
+
+SELECT_CART_JSON = """
+SELECT row_to_json(cart)::text FROM (
+    SELECT shopcart.id, shopcart.customer_id, COALESCE((
+        SELECT array_to_json(array_agg(item ORDER BY item.product_id)) FROM (
+            SELECT cart_item.shopcart_id, cart_item.product_id, cart_item.quantity, cart_item.price
+            FROM cart_item WHERE cart_item.shopcart_id = shopcart.id
+        ) AS item
+    ), '[]'::json) AS items
+    FROM shopcart ORDER BY shopcart.id
+) AS cart
+"""
+
+
+class ExportWriter:
+    """Writes export lines to a file, or to numbered files of split_rows lines each"""
+
+    def __init__(self, path, file_format, split_rows=None, progress=None, progress_rows=100000):
+        self.path = path
+        self.header = EXPORT_HEADERS[file_format]
+        self.split_rows = split_rows
+        self.progress = progress
+        self.progress_rows = progress_rows
+        self.file = None
+        self.files = []
+        self.rows = 0
+        self.file_rows = 0
+
+    def file_name(self) -> str:
+        """Returns the name of the next file: carts.csv.gz becomes carts-00001.csv.gz"""
+        if not self.split_rows:
+            return self.path
+        folder, name = os.path.split(self.path)
+        stem, dot, extension = name.partition(".")
+        return os.path.join(folder, f"{stem}-{len(self.files):05d}{dot}{extension}")
+
+    def open(self) -> None:
+        """Starts the next file"""
+        self.close()
+        name = self.file_name()
+        if name == "-":
+            self.file = sys.stdout
+        elif name.endswith(".gz"):
+            self.file = gzip.open(name, "wt", encoding="utf-8", compresslevel=3)
+        else:
+            self.file = open(name, "w", encoding="utf-8")  # pylint: disable=consider-using-with
+        self.files.append(name)
+        self.file_rows = 0
+        self.file.write(self.header)
+
+    def write(self, data) -> None:
+        """Writes one or more whole lines"""
+        if isinstance(data, bytes):  # from COPY
+            data = data.decode()
+        if self.file is None or (self.split_rows and self.file_rows >= self.split_rows):
+            self.open()
+        self.file.write(data)
+        lines = data.count("\n")
+        self.file_rows += lines
+        if self.progress and (self.rows + lines) // self.progress_rows > self.rows // self.progress_rows:
+            self.progress(self.rows + lines)
+        self.rows += lines
+
+    def close(self) -> None:
+        """Closes the current file"""
+        if self.file is sys.stdout:
+            self.file.flush()
+        elif self.file is not None:
+            self.file.close()
+        self.file = None
+
+
+def export_shard(engine, file_format, writer, chunk_size) -> None:
+    """Streams the carts of one shard into the writer"""
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(BEGIN_SNAPSHOT)
+        if file_format == "csv":
+            # COPY sends one row per message, so the writer only sees whole lines
+            cursor.copy_expert(COPY_CART_ITEMS, writer)
+        else:
+            cursor = connection.cursor(name="export_carts")  # server-side, chunk_size rows per fetch
+            cursor.itersize = chunk_size
+            cursor.execute(SELECT_CART_JSON)
+            for (line,) in cursor:
+                writer.write(line + "\n")
+        connection.rollback()
+    finally:
+        connection.close()
+
+
+def export_carts(path, file_format, split_rows=None, chunk_size=10000, progress=None) -> dict:
+    """Exports every cart of every shard, returns the number of rows and the files written"""
+    shards = sharding.shard_map()
+    writer = ExportWriter(path, file_format, split_rows, progress)
+    try:
+        writer.open()
+        for key in shards.keys:
+            export_shard(db.engines[key], file_format, writer, chunk_size)
+    finally:
+        writer.close()
+    return {"rows": writer.rows, "files": writer.files}
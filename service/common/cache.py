@@ -0,0 +1,76 @@
+"""
+In-process Caches
+
+Small thread-safe caches kept by each worker. They are not shared between
+workers, so only cache what can be checked or expires quickly.
+"""
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """A bounded mapping that evicts the least recently used key"""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        """Returns the value of a key and marks it as recently used"""
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value) -> None:
+        """Stores a value, evicting the least recently used key when full"""
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def discard(self, key) -> None:
+        """Removes a key if it is cached"""
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self) -> None:
+        """Removes every key"""
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        """Returns the size and hit counts of the cache"""
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+class NegativeCache(LRUCache):
+    """A bounded set of keys known to be missing, each remembered for ttl seconds"""
+
+    def __init__(self, maxsize=10000, ttl=5.0):
+        super().__init__(maxsize)
+        self.ttl = ttl
+
+    def __contains__(self, key):
+        expires = self.get(key)
+        if expires is None:
+            return False
+        if expires < time.monotonic():
+            self.discard(key)
+            return False
+        return True
+
+    def add(self, key) -> None:
+        """Remembers that a key is missing"""
+        self.put(key, time.monotonic() + self.ttl)
@@ -1,8 +1,14 @@
 """
 Flask CLI Command Extensions
 """
+import os
+import time
+from datetime import timedelta
+import click
 from service import app
-from service.models import db
+from service.models import db, CartItem, Shopcart, DataValidationError, DataConflictError
+from service.routes import import_cart_row, import_item_row
+from service.common import compression, bulk, outbox
 
 
 ######################################################################
@@ -19,3 +25,222 @@ def db_create():
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+######################################################################
+# Command to import carts in bulk
+# Usage:
+#   flask import-carts carts.ndjson [--strict]
+#   flask import-carts items.csv --batch-size 100000
+######################################################################
+@app.cli.command("import-carts")
+@click.argument("file", type=click.File("r", encoding="utf-8"))
+@click.option(
+    "--format", "file_format", type=click.Choice(sorted(bulk.READERS)),
+    help="Format of the file, by default from its extension",
+)
+@click.option("--batch-size", default=50000, show_default=True, help="Rows per COPY")
+@click.option("--strict", is_flag=True, help="Import nothing if a customer already has a shopcart")
+def import_carts(file, file_format, batch_size, strict):
+    """
+    Loads carts from a CSV or NDJSON file with COPY and set-based merges
+    """
+    file_format = file_format or ("csv" if file.name.endswith(".csv") else "ndjson")
+    start = time.monotonic()
+
+    def progress(rows):
+        click.echo(f"{rows} rows staged ({rows / (time.monotonic() - start):.0f} rows/s)", err=True)
+
+    try:
+        result = bulk.import_carts(file, file_format, (import_cart_row, import_item_row), batch_size, strict, progress)
+    except (DataValidationError, DataConflictError) as error:
+        raise click.ClickException(str(error)) from error
+    click.echo(
+        f"Imported {result['carts']} shopcarts with {result['items']} items "
+        f"from {result['rows']} rows in {time.monotonic() - start:.1f}s"
+    )
+    if result["conflicts"]:
+        customers = ", ".join(map(str, result["conflicting_customers"]))
+        click.echo(f"Skipped {result['conflicts']} customers that already have a shopcart: {customers}")
+
+
+######################################################################
+# Command to export every cart
+# Usage:
+#   flask export-carts carts.ndjson
+#   flask export-carts items.csv.gz --split-rows 10000000
+######################################################################
+@app.cli.command("export-carts")
+@click.argument("path")
+@click.option(
+    "--format", "file_format", type=click.Choice(sorted(bulk.READERS)),
+    help="Format of the output, by default from its extension",
+)
+@click.option("--split-rows", type=int, help="Start a new numbered file every this many rows")
+@click.option("--chunk-size", default=10000, show_default=True, help="Carts fetched at a time for NDJSON")
+def export_carts(path, file_format, split_rows, chunk_size):
+    """
+    Writes every cart and its items to NDJSON or CSV (- for stdout)
+    """
+    file_format = file_format or ("csv" if ".csv" in os.path.basename(path) else "ndjson")
+    if path == "-" and split_rows:
+        raise click.BadParameter("cannot split the output when writing to stdout")
+    start = time.monotonic()
+
+    def progress(rows):
+        click.echo(f"{rows} rows exported ({rows / (time.monotonic() - start):.0f} rows/s)", err=True)
+
+    result = bulk.export_carts(path, file_format, split_rows, chunk_size, progress)
+    click.echo(
+        f"Exported {result['rows']} rows to {len(result['files'])} files "
+        f"in {time.monotonic() - start:.1f}s",
+        err=path == "-",
+    )
+
+
+######################################################################
+# Command to reprice a product in every cart
+# Usage:
+#   flask set-price 42 19.99
+######################################################################
+@app.cli.command("set-price")
+@click.argument("product_id", type=int)
+@click.argument("price", type=click.FloatRange(min=0))
+@click.option(
+    "--batch-size", type=click.IntRange(min=1),
+    help="Carts updated per transaction  [default: PRICE_UPDATE_BATCH_SIZE]",
+)
+def set_price(product_id, price, batch_size):
+    """
+    Sets the price of a product in every shopcart that holds it
+    """
+    start = time.monotonic()
+    shopcarts = CartItem.set_price(product_id, price, batch_size or app.config["PRICE_UPDATE_BATCH_SIZE"])
+    click.echo(f"Set the price of product {product_id} to {price} in {shopcarts} shopcarts in {time.monotonic() - start:.1f}s")
+
+
+######################################################################
+# Command to delete abandoned carts
+# Usage:
+#   flask purge-carts [--ttl-days 30]
+#   flask purge-carts --every 600   (keeps sweeping, see the Procfile)
+######################################################################
+@app.cli.command("purge-carts")
+@click.option(
+    "--ttl-days", type=click.FloatRange(min=0, min_open=True),
+    help="Delete carts unchanged for this many days  [default: CART_TTL_DAYS]",
+)
+@click.option(
+    "--batch-size", type=click.IntRange(min=1),
+    help="Carts deleted per transaction  [default: CART_PURGE_BATCH_SIZE]",
+)
+@click.option(
+    "--pause", type=click.FloatRange(min=0),
+    help="Seconds to wait between batches  [default: CART_PURGE_PAUSE]",
+)
+@click.option(
+    "--tombstone-days", type=click.FloatRange(min=0, min_open=True),
+    help="Forget deleted carts in the change feed after this many days  [default: CHANGE_TOMBSTONE_DAYS]",
+)
+@click.option("--every", type=click.FloatRange(min=0, min_open=True), help="Sweep again every this many seconds")
+def purge_carts(ttl_days, batch_size, pause, tombstone_days, every):  # pylint: disable=too-many-arguments
+    """
+    Deletes the carts that did not change for the TTL, a small batch at a time
+    """
+    ttl = timedelta(days=ttl_days or app.config["CART_TTL_DAYS"])
+    tombstone_ttl = timedelta(days=tombstone_days or app.config["CHANGE_TOMBSTONE_DAYS"])
+    batch_size = batch_size or app.config["CART_PURGE_BATCH_SIZE"]
+    pause = app.config["CART_PURGE_PAUSE"] if pause is None else pause
+    while True:
+        start = time.monotonic()
+        purged = 0
+
+        def progress(carts):
+            nonlocal purged
+            purged += carts
+            click.echo(f"{purged} carts purged ({purged / (time.monotonic() - start):.0f} carts/s)", err=True)
+
+        result = Shopcart.purge_expired(ttl, batch_size, pause, progress, tombstone_ttl)
+        rate = result["carts"] / result["seconds"] if result["seconds"] else 0
+        click.echo(
+            f"Purged {result['carts']} shopcarts unchanged for {ttl_days or app.config['CART_TTL_DAYS']:g} days "
+            f"in {result['seconds']:.1f}s ({rate:.0f} carts/s), lag {result['lag']:.0f}s, "
+            f"{result['tombstones']} old tombstones"
+        )
+        if not every:
+            return
+        time.sleep(every)
+
+
+######################################################################
+# Command to send the cart events of the outbox
+# Usage:
+#   flask dispatch-events [--sink file:cart-events.jsonl]
+#   flask dispatch-events --every 1   (keeps polling, see the Procfile)
+######################################################################
+@app.cli.command("dispatch-events")
+@click.option("--sink", help="file:PATH or http(s)://URL to send the events to  [default: EVENT_SINK]")
+@click.option(
+    "--batch-size", type=click.IntRange(min=1),
+    help="Events sent and deleted per transaction  [default: EVENT_BATCH_SIZE]",
+)
+@click.option("--every", type=click.FloatRange(min=0, min_open=True), help="Look for new events every this many seconds")
+def dispatch_events(sink, batch_size, every):
+    """
+    Sends the cart events of the outbox to a sink, at least once and in order per cart
+    """
+    try:
+        target = outbox.make_sink(sink or app.config["EVENT_SINK"])
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint="--sink") from error
+    batch_size = batch_size or app.config["EVENT_BATCH_SIZE"]
+    while True:
+        try:
+            result = outbox.dispatch(target, batch_size)
+        except OSError as error:  # the batch stays in the outbox and goes out on the next try
+            if not every:
+                raise click.ClickException(f"The event sink failed: {error}") from error
+            click.echo(f"The event sink failed, retrying in {every:g}s: {error}", err=True)
+        else:
+            if result["events"] or not every:
+                rate = result["events"] / result["seconds"] if result["seconds"] else 0
+                click.echo(f"Dispatched {result['events']} events in {result['seconds']:.1f}s ({rate:.0f} events/s)")
+        if not every:
+            return
+        time.sleep(every)
+
+
+######################################################################
+# Command to run a local stand-in for the HTTP endpoint of an event bus
+# Usage:
+#   flask receive-events --port 9100 --sink file:received-events.jsonl
+######################################################################
+@app.cli.command("receive-events")
+@click.option("--host", default="127.0.0.1", show_default=True, help="The address to listen on")
+@click.option("--port", default=9100, show_default=True, help="The port to listen on")
+@click.option("--sink", default="file:received-events.jsonl", show_default=True, help="Where to write the events")
+def receive_events(host, port, sink):
+    """
+    Takes the batches POSTed by dispatch-events --sink http://HOST:PORT/
+    """
+    receiver = outbox.EventReceiver((host, port), outbox.make_sink(sink))
+    click.echo(f"Receiving events on http://{host}:{port}/")
+    try:
+        receiver.serve_forever()
+    finally:
+        receiver.server_close()
+
+
+######################################################################
+# Command to precompress the static files
+# Usage:
+#   flask compress-static
+######################################################################
+@app.cli.command("compress-static")
+@click.option("--min-size", default=0, help="Skip files smaller than this many bytes")
+def compress_static(min_size):
+    """
+    Writes brotli and gzip copies of the static files for send_static
+    """
+    for path in compression.compress_directory(app.static_folder, min_size):
+        click.echo(path)
@@ -0,0 +1,230 @@
+"""
+Response Compression
+
+Compresses API responses with brotli or gzip when the client accepts it
+and the body is at least COMPRESS_MIN_SIZE bytes; streamed responses are
+compressed chunk by chunk. Static files are not compressed per request:
+``flask compress-static`` (or ``python service/common/compression.py``,
+which does not need the database) writes .br and .gz copies next to them
+at build time, and ``send_static`` serves those with long-lived cache
+headers and content-hash ETags.
+
+Brotli is optional; without the brotli package only gzip is used.
+"""
+import os
+import sys
+import gzip
+import zlib
+import hashlib
+import mimetypes
+from flask import abort, current_app, request, send_file
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is an optional dependency
+    brotli = None
+
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/javascript",
+    "application/msgpack",
+    "application/xml",
+    "image/svg+xml",
+    "text/",
+)
+STATIC_SUFFIXES = (".js", ".css", ".html", ".json", ".svg", ".txt", ".map")
+# Precompressed file suffix of each encoding, most preferred first
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+# Level of each encoding when none is given (brotli quality 0-11, gzip level 1-9), and the setting of responses
+DEFAULT_LEVELS = {"br": 4, "gzip": 6}
+LEVEL_SETTINGS = {"br": "BROTLI_QUALITY", "gzip": "GZIP_LEVEL"}
+
+
+######################################################################
+#  C O N T E N T   N E G O T I A T I O N
+######################################################################
+def available_encodings() -> tuple:
+    """Returns the encodings this worker can produce, most preferred first"""
+    return ("br", "gzip") if brotli else ("gzip",)
+
+
+def choose_encoding(accept_encoding, encodings=None):
+    """Returns the preferred encoding the client accepts, or None for identity"""
+    encodings = encodings or available_encodings()
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    candidates = [
+        encoding for encoding in encodings
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0
+    ]
+    if not candidates:
+        return None
+    # highest quality wins; the order of encodings breaks ties
+    return max(candidates, key=lambda encoding: accepted.get(encoding, accepted.get("*", 0.0)))
+
+
+def is_compressible(mimetype) -> bool:
+    """True for text-like content types that shrink when compressed"""
+    return bool(mimetype) and mimetype.startswith(COMPRESSIBLE_TYPES)
+
+
+######################################################################
+#  C O M P R E S S O R S
+######################################################################
+def compress(data: bytes, encoding: str, level: int = None) -> bytes:
+    """Compresses a whole body; the default levels are cheap enough for every request"""
+    level = DEFAULT_LEVELS[encoding] if level is None else level
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def compress_stream(chunks, encoding: str, level: int = None):
+    """Compresses an iterable of chunks as they are produced"""
+    level = DEFAULT_LEVELS[encoding] if level is None else level
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=level)
+        for chunk in chunks:
+            data = compressor.process(chunk.encode() if isinstance(chunk, str) else chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+        return
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode() if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _compress_response(response):
+    """Compresses the body of a response when the client and the response allow it"""
+    response.vary.add("Accept-Encoding")
+    if (
+        response.direct_passthrough  # files are served as they are
+        or not 200 <= response.status_code < 300
+        or response.status_code == 204
+        or "Content-Encoding" in response.headers
+        or not is_compressible(response.mimetype)
+    ):
+        return response
+    encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+    if encoding is None:
+        return response
+
+    level = current_app.config[LEVEL_SETTINGS[encoding]]
+    if response.is_streamed:
+        response.direct_passthrough = False
+        response.response = compress_stream(response.response, encoding, level)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < current_app.config["COMPRESS_MIN_SIZE"]:
+            return response
+        response.set_data(compress(data, encoding, level))
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak)
+    return response
+
+
+######################################################################
+#  P R E C O M P R E S S E D   S T A T I C   F I L E S
+######################################################################
+def compress_directory(path, min_size=0, encodings=None) -> list:
+    """Writes .br/.gz copies of the static files in a directory, returns the files written"""
+    written = []
+    for folder, _, files in os.walk(path):
+        for name in files:
+            source = os.path.join(folder, name)
+            if not name.endswith(STATIC_SUFFIXES) or os.path.getsize(source) < min_size:
+                continue
+            with open(source, "rb") as file:
+                data = file.read()
+            for encoding in encodings or available_encodings():
+                target = source + ENCODINGS[encoding]
+                with open(target, "wb") as file:
+                    file.write(compress(data, encoding, 11 if encoding == "br" else 9))
+                written.append(target)
+    return written
+
+
+class StaticFiles:
+    """Serves static files, preferring precompressed copies, with content-hash ETags"""
+
+    def __init__(self, folder, max_age):
+        self.folder = folder
+        self.max_age = max_age
+        self.hashes = {}
+
+    def content_hash(self, path) -> str:
+        """Returns the sha256 prefix of a file, remembered until it changes"""
+        mtime = os.stat(path).st_mtime_ns
+        cached = self.hashes.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        digest = hashlib.sha256()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(65536), b""):
+                digest.update(block)
+        self.hashes[path] = (mtime, digest.hexdigest()[:32])
+        return self.hashes[path][1]
+
+    def send(self, filename):
+        """Returns the response for a static file"""
+        path = safe_join(self.folder, filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        etag = self.content_hash(path)
+        mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        encodings = [
+            encoding for encoding in available_encodings()
+            if os.path.isfile(path + ENCODINGS[encoding])
+            and os.path.getmtime(path + ENCODINGS[encoding]) >= os.path.getmtime(path)
+        ]
+        encoding = choose_encoding(request.headers.get("Accept-Encoding"), encodings) if encodings else None
+        if encoding:
+            response = send_file(
+                path + ENCODINGS[encoding], mimetype=mimetype,
+                etag=f"{etag}-{encoding}", max_age=self.max_age,
+            )
+            response.headers["Content-Encoding"] = encoding
+        else:
+            response = send_file(path, mimetype=mimetype, etag=etag, max_age=self.max_age)
+        if encodings:
+            response.vary.add("Accept-Encoding")
+        response.cache_control.public = True
+        return response
+
+
+def send_static(filename):
+    """View that serves a file of the static folder"""
+    return current_app.extensions["static_files"].send(filename)
+
+
+def init_compression(app):
+    """Compresses responses and serves precompressed static files"""
+    app.extensions["static_files"] = StaticFiles(app.static_folder, app.config["STATIC_MAX_AGE"])
+    app.view_functions["static"] = send_static
+    app.after_request(_compress_response)
+    app.logger.info("Response compression: %s", ", ".join(available_encodings()))
+
+
+if __name__ == "__main__":  # pragma: no cover
+    # Usage: python service/common/compression.py [folder] [min_size]
+    folder = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), "..", "static")
+    minimum = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    for written_file in compress_directory(folder, minimum):
+        print(written_file)
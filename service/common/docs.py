@@ -0,0 +1,76 @@
+"""
+API Documentation
+
+flask-restx builds /api/swagger.json from the api.model definitions. This
+module renders the spec once, at startup when the docs are enabled, and
+serves the stored bytes, precompressed, with an ETag so clients get 304s.
+With API_DOCS_ENABLED=false the Swagger UI is not registered at all and
+the spec is only built if somebody asks for it.
+"""
+import json
+import hashlib
+import threading
+from flask import Response, current_app, request
+from service.common import compression
+
+SPEC_ENDPOINT = "specs"
+
+
+class SpecCache:
+    """The rendered Swagger spec and its ETag"""
+
+    def __init__(self, api):
+        self.api = api
+        self.body = None
+        self.etag = None
+        self.status = 200
+        self.encoded = {}
+        self.lock = threading.Lock()
+
+    def build(self) -> None:
+        """Renders the spec; needs a request context for the base path"""
+        schema = self.api.__schema__
+        body = json.dumps(schema, separators=(",", ":"), sort_keys=True).encode()
+        self.status = 500 if "error" in schema else 200
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.encoded = {
+            encoding: compression.compress(body, encoding, 9)
+            for encoding in compression.available_encodings()
+        }
+        self.body = body
+
+    def response(self):
+        """Returns the spec, or 304 when the client has the current version"""
+        if self.body is None:
+            with self.lock:
+                if self.body is None:
+                    self.build()
+        encoding = compression.choose_encoding(request.headers.get("Accept-Encoding"))
+        if encoding:
+            response = Response(self.encoded[encoding], self.status, mimetype="application/json")
+            response.headers["Content-Encoding"] = encoding
+            response.set_etag(f"{self.etag}-{encoding}")
+        else:
+            response = Response(self.body, self.status, mimetype="application/json")
+            response.set_etag(self.etag)
+        response.cache_control.public = True
+        response.cache_control.no_cache = True  # always revalidate, the ETag makes it cheap
+        return response.make_conditional(request)
+
+
+def serve_spec():
+    """View that serves the cached Swagger spec"""
+    return current_app.extensions["spec_cache"].response()
+
+
+def init_docs(app, api):
+    """Serves the Swagger spec from a cache built at startup when the docs are enabled"""
+    cache = SpecCache(api)
+    app.extensions["spec_cache"] = cache
+    app.view_functions[SPEC_ENDPOINT] = serve_spec
+    if app.config["API_DOCS_ENABLED"]:
+        with app.test_request_context():
+            cache.build()
+        app.logger.info("Swagger spec cached: %d bytes", len(cache.body))
+    else:
+        app.logger.info("API docs UI disabled")
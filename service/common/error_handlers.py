@@ -19,7 +19,7 @@ Module: error_handlers
 """
 from flask import jsonify
 from service.models import DataValidationError, DataConflictError
-from service import app
+from service import app, api
 from . import status
 
 
@@ -38,6 +38,32 @@ def data_conflict_error(error):
     return resource_conflict(error)
 
 
+######################################################################
+# flask-restx only passes exceptions on to the handlers above while
+# PROPAGATE_EXCEPTIONS is set (as in testing), so the API needs its own
+######################################################################
+@api.errorhandler(DataValidationError)
+def api_validation_error(error):
+    """Handles Value Errors from bad data in the API resources"""
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        {"status": status.HTTP_400_BAD_REQUEST, "error": "Bad Request", "message": message},
+        status.HTTP_400_BAD_REQUEST,
+    )
+
+
+@api.errorhandler(DataConflictError)
+def api_conflict_error(error):
+    """Handles conflict errors in the API resources"""
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        {"status": status.HTTP_409_CONFLICT, "error": "Conflict", "message": message},
+        status.HTTP_409_CONFLICT,
+    )
+
+
 @app.errorhandler(status.HTTP_400_BAD_REQUEST)
 def bad_request(error):
     """Handles bad requests with 400_BAD_REQUEST"""
@@ -0,0 +1,54 @@
+"""
+MessagePack Support
+
+Lets service-to-service callers trade JSON for MessagePack, which is
+smaller and cheaper to encode and decode. Responses of the API resources
+are packed when the Accept header prefers application/msgpack, and request
+bodies sent as application/msgpack are read by ``request_payload``
+wherever the routes accept JSON. JSON stays the default for everybody else.
+
+MessagePack is optional; without the msgpack package only JSON is served.
+"""
+from flask import make_response, request
+from service.models import DataValidationError
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - msgpack is an optional dependency
+    msgpack = None
+
+MEDIA_TYPE = "application/msgpack"
+
+
+def body_types(media_type) -> tuple:
+    """Returns the request Content-Types accepted where media_type is expected"""
+    if msgpack and media_type == "application/json":
+        return (media_type, MEDIA_TYPE)
+    return (media_type,)
+
+
+def request_payload():
+    """Returns the decoded request body, sent as JSON or as MessagePack"""
+    if msgpack and request.mimetype == MEDIA_TYPE:
+        try:
+            return msgpack.unpackb(request.get_data(), raw=False)
+        except (ValueError, msgpack.UnpackException) as error:
+            raise DataValidationError("The request body is not valid MessagePack.") from error
+    return request.get_json()
+
+
+def output_msgpack(data, code, headers=None):
+    """Makes a MessagePack response, the flask-restx representation of MEDIA_TYPE"""
+    response = make_response(msgpack.packb(data, use_bin_type=True), code)
+    response.headers.extend(headers or {})
+    response.mimetype = MEDIA_TYPE
+    return response
+
+
+def init_messagepack(app, api):
+    """Serves the API resources as MessagePack to clients that ask for it"""
+    if msgpack is None:
+        app.logger.info("MessagePack disabled: msgpack is not installed")
+        return
+    api.representations[MEDIA_TYPE] = output_msgpack
+    app.logger.info("MessagePack enabled for %s", MEDIA_TYPE)
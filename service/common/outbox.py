@@ -0,0 +1,171 @@
+"""
+Cart Events
+
+Every change to a cart writes an event to the cart_event outbox table, in
+the transaction of the change itself, so an event exists exactly when its
+change was committed. Triggers record ``shopcart.created``,
+``shopcart.updated`` (once per transaction, item changes included) and
+``shopcart.deleted``, whichever way the change was made. Events are thin:
+consumers read the cart, or follow the change feed, for its state.
+
+``dispatch`` drains the outbox of every shard to a sink, oldest event
+first, batch_size events at a time. A batch is deleted from the outbox
+only after the sink took it, so a crash or a failing sink means the batch
+is sent again: delivery is at least once and consumers dedupe by event id.
+One dispatcher at a time drains a shard, holding an advisory lock, so the
+events of a cart go out in the order they were made.
+
+Sinks are picked by URL: ``file:events.jsonl`` appends JSON lines and
+``http://host/path`` POSTs each batch as a JSON array. ``EventReceiver``
+is a local stand-in for the HTTP endpoint of an event bus.
+"""
+import os
+import json
+import time
+import threading
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from sqlalchemy import delete, select
+from service.models import db, cart_event
+from service.common import sharding
+
+# The advisory lock a dispatcher holds on a shard while it drains it
+DISPATCH_LOCK = 0x63617274
+
+
+######################################################################
+#  S I N K S
+######################################################################
+class FileSink:
+    """Appends the events to a file, one JSON object per line"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def send(self, events) -> None:
+        """Writes a batch of events and syncs it to disk"""
+        lines = "".join(json.dumps(event, separators=(",", ":")) + "\n" for event in events)
+        with self.lock, open(self.path, "a", encoding="utf-8") as file:
+            file.write(lines)
+            file.flush()
+            os.fsync(file.fileno())
+
+
+class HttpSink:
+    """POSTs each batch of events as a JSON array; any answer but 2xx fails the batch"""
+
+    def __init__(self, url, timeout=10.0):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, events) -> None:
+        """Posts a batch of events, raising OSError when it was not taken"""
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(events, separators=(",", ":")).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+# URL scheme -> a function that makes the sink of a URL
+SINKS = {
+    "file": lambda parts: FileSink(parts.netloc + parts.path),
+    "http": lambda parts: HttpSink(parts.geturl()),
+    "https": lambda parts: HttpSink(parts.geturl()),
+}
+
+
+def make_sink(url):
+    """Returns the sink of a URL, or raises ValueError for an unknown scheme"""
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in SINKS:
+        raise ValueError(f"Unknown event sink '{url}': use one of {', '.join(f'{s}:' for s in SINKS)}")
+    return SINKS[parts.scheme](parts)
+
+
+######################################################################
+#  D I S P A T C H E R
+######################################################################
+def event_message(row) -> dict:
+    """Returns the message sent for an outbox row; the id is unique across the shards"""
+    return {
+        "id": f"{sharding.shard_for_shopcart(row.shopcart_id)}-{row.id}",
+        "type": row.type,
+        "shopcart_id": row.shopcart_id,
+        "customer_id": row.customer_id,
+        "occurred_at": row.occurred_at.isoformat(),
+    }
+
+
+def drain_shard(sink, batch_size) -> int:
+    """Sends the events of the pinned shard in batches until none are left
+
+    Returns how many were sent, 0 when another dispatcher holds the shard.
+    A batch is read without locking its rows and deleted once the sink took
+    it, so the transaction only gets an id, and holds back the change feed,
+    for the moment of the DELETE.
+    """
+    sent = 0
+    try:
+        while True:
+            if not db.session.execute(select(db.func.pg_try_advisory_xact_lock(DISPATCH_LOCK))).scalar():
+                return sent
+            rows = db.session.execute(select(cart_event).order_by(cart_event.c.id).limit(batch_size)).all()
+            if rows:
+                sink.send([event_message(row) for row in rows])
+                db.session.execute(delete(cart_event).where(cart_event.c.id.in_([row.id for row in rows])))
+            db.session.commit()
+            sent += len(rows)
+            if len(rows) < batch_size:
+                return sent
+    finally:
+        db.session.rollback()
+
+
+def dispatch(sink, batch_size=500) -> dict:
+    """Drains the outbox of every shard to a sink
+
+    Returns the number of events sent and the seconds it took. Raises the
+    error of a sink that failed; its batch stays in the outbox.
+    """
+    start = time.monotonic()
+    sent = sharding.fan_out(lambda: [drain_shard(sink, batch_size)])
+    return {"events": sum(sent), "seconds": time.monotonic() - start}
+
+
+######################################################################
+#  L O C A L   S T A N D - I N
+######################################################################
+class EventReceiver(ThreadingHTTPServer):
+    """A local stand-in for an event bus: takes POSTed batches and passes them to a sink"""
+
+    daemon_threads = True
+
+    def __init__(self, address, sink):
+        self.sink = sink
+        super().__init__(address, EventHandler)
+
+
+class EventHandler(BaseHTTPRequestHandler):
+    """Answers 204 to a POSTed JSON array of events, 400 to anything else"""
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Takes a batch of events"""
+        try:
+            events = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)))
+        except ValueError:
+            events = None
+        if not isinstance(events, list):
+            self.send_error(400, "The body must be a JSON array of events")
+            return
+        self.server.sink.send(events)
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Keeps the requests out of the output"""
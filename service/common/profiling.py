@@ -0,0 +1,121 @@
+"""
+Memory Profiling
+
+This module wraps tracemalloc so allocation sites can be inspected on a
+running worker, and collects the per-worker RSS and garbage collector
+statistics that are reported as metrics.
+"""
+import gc
+import os
+import resource
+import threading
+import tracemalloc
+
+KEY_TYPES = ("lineno", "filename", "traceback")
+IGNORED_FILES = (tracemalloc.__file__, "<frozen importlib._bootstrap>", "<unknown>")
+
+_lock = threading.Lock()
+_last_snapshot = None
+
+
+def start(frames: int = 1) -> None:
+    """Starts tracing allocations, keeping `frames` frames per traceback"""
+    global _last_snapshot  # pylint: disable=global-statement
+    with _lock:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        tracemalloc.start(max(1, frames))
+        _last_snapshot = None
+
+
+def stop() -> None:
+    """Stops tracing allocations and drops the stored snapshot"""
+    global _last_snapshot  # pylint: disable=global-statement
+    with _lock:
+        tracemalloc.stop()
+        _last_snapshot = None
+
+
+def is_tracing() -> bool:
+    """Returns True while allocations are being traced"""
+    return tracemalloc.is_tracing()
+
+
+def _serialize_stat(stat) -> dict:
+    """Converts a tracemalloc Statistic or StatisticDiff into a dictionary"""
+    result = {
+        "trace": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+        "size": stat.size,
+        "count": stat.count,
+    }
+    if hasattr(stat, "size_diff"):
+        result["size_diff"] = stat.size_diff
+        result["count_diff"] = stat.count_diff
+    return result
+
+
+def take_snapshot(limit: int = 20, key_type: str = "lineno") -> dict:
+    """
+    Takes a snapshot and returns the top allocation sites
+
+    The diff against the previous snapshot of this worker is included,
+    so calling this before and after a request shows what it allocated.
+    """
+    global _last_snapshot  # pylint: disable=global-statement
+    if key_type not in KEY_TYPES:
+        raise ValueError(f"key_type must be one of {', '.join(KEY_TYPES)}")
+    with _lock:
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not running")
+        filters = [tracemalloc.Filter(False, name) for name in IGNORED_FILES]
+        snapshot = tracemalloc.take_snapshot().filter_traces(filters)
+        previous, _last_snapshot = _last_snapshot, snapshot
+
+    current, peak = tracemalloc.get_traced_memory()
+    result = {
+        "pid": os.getpid(),
+        "traced_bytes": current,
+        "peak_traced_bytes": peak,
+        "top": [_serialize_stat(stat) for stat in snapshot.statistics(key_type)[:limit]],
+        "diff": [],
+    }
+    if previous is not None:
+        diff = snapshot.compare_to(previous, key_type)
+        result["diff"] = [_serialize_stat(stat) for stat in diff[:limit]]
+    return result
+
+
+def rss_bytes() -> int:
+    """Returns the resident set size of this process"""
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # not Linux: fall back to the high-water mark
+        return max_rss_bytes()
+
+
+def max_rss_bytes() -> int:
+    """Returns the peak resident set size of this process"""
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def worker_stats() -> dict:
+    """Returns the memory and garbage collector statistics of this worker"""
+    stats = {
+        "pid": os.getpid(),
+        "rss_bytes": rss_bytes(),
+        "max_rss_bytes": max_rss_bytes(),
+        "gc": {
+            "counts": gc.get_count(),
+            "thresholds": gc.get_threshold(),
+            "frozen": gc.get_freeze_count(),
+            "generations": gc.get_stats(),
+        },
+        "tracemalloc": None,
+    }
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        stats["tracemalloc"] = {"traced_bytes": current, "peak_traced_bytes": peak}
+    return stats
@@ -0,0 +1,155 @@
+"""
+Database Routing
+
+This module contains the session class used by ``db.session``. A session
+pinned to a shard (see service.common.sharding) uses that shard's engine.
+On the default shard, safe reads made while serving GET/HEAD requests go
+to one of the read replicas listed in DATABASE_REPLICA_URIS, picked
+round-robin for each request (skipping replicas that fail their health
+check) and used for all of its reads; everything else goes to the primary.
+
+After a client mutates a cart it gets a short-lived cookie, and its reads
+go to the primary until the cookie expires, so it always reads its writes.
+"""
+import time
+import threading
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql import Select
+
+REPLICA_BIND_PREFIX = "replica_"
+STICKY_COOKIE = "shopcart_primary_until"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+######################################################################
+#  R E P L I C A   R O U T E R
+######################################################################
+class ReplicaRouter:
+    """Picks replica engines round-robin and tracks their health"""
+
+    def __init__(self, keys=(), check_interval=10.0, retry_after=30.0):
+        self.keys = list(keys)
+        self.check_interval = check_interval
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.next = 0
+        self.checked_at = {}
+        self.down_until = {}
+        self.reads = {}
+
+    @property
+    def enabled(self) -> bool:
+        """True when at least one replica is configured"""
+        return bool(self.keys)
+
+    def set_replicas(self, keys) -> None:
+        """Replaces the replica bind keys and forgets their health"""
+        with self.lock:
+            self.keys = list(keys)
+            self.next = 0
+            self.checked_at.clear()
+            self.down_until.clear()
+
+    def choose(self, engines):
+        """Returns the next healthy replica engine or None to use the primary"""
+        for _ in range(len(self.keys)):
+            with self.lock:
+                key = self.keys[self.next % len(self.keys)]
+                self.next += 1
+            if self.is_healthy(key, engines[key]):
+                self.reads[key] = self.reads.get(key, 0) + 1
+                return engines[key]
+        return None
+
+    def is_healthy(self, key, engine) -> bool:
+        """Checks a replica with SELECT 1 at most every check_interval seconds"""
+        now = time.monotonic()
+        if self.down_until.get(key, 0) > now:
+            return False
+        if now - self.checked_at.get(key, float("-inf")) < self.check_interval:
+            return True
+        self.checked_at[key] = now
+        try:
+            with engine.connect() as connection:
+                connection.exec_driver_sql("SELECT 1")
+        except SQLAlchemyError as error:
+            current_app.logger.warning("Replica %s is unhealthy: %s", key, error)
+            self.down_until[key] = now + self.retry_after
+            return False
+        return True
+
+    def stats(self) -> dict:
+        """Returns the reads served by and the health of each replica"""
+        now = time.monotonic()
+        return {
+            key: {"reads": self.reads.get(key, 0), "healthy": self.down_until.get(key, 0) <= now}
+            for key in self.keys
+        }
+
+
+######################################################################
+#  R O U T I N G   S E S S I O N
+######################################################################
+class RoutingSession(Session):
+    """A session that uses its pinned shard and sends safe reads to a replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        """Returns the engine of the pinned shard, a replica or the primary"""
+        shard = self.info.get("shard", 0)
+        if bind is None and shard:
+            return self._db.engines[current_app.extensions["shard_map"].keys[shard]]
+        if bind is None and not self._flushing and isinstance(clause, Select) and reads_from_replica():
+            return g.replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def reads_from_replica() -> bool:
+    """True while serving a request whose reads go to a replica"""
+    return has_request_context() and g.get("read_from_replica", False) and g.get("replica") is not None
+
+
+def use_primary() -> None:
+    """Sends the remaining reads of this request to the primary, for reads that must not mix replicas"""
+    if has_request_context():
+        g.read_from_replica = False
+
+
+######################################################################
+#  F L A S K   H O O K S
+######################################################################
+def _before_request():
+    """Decides whether this request may read from a replica"""
+    router = current_app.extensions["replica_router"]
+    if not router.enabled or request.method not in SAFE_METHODS:
+        return
+    primary_until = request.cookies.get(STICKY_COOKIE, type=float) or 0.0
+    g.read_from_replica = primary_until < time.time()
+    if g.read_from_replica:
+        # one replica serves every read of the request, so they all see the same data
+        g.replica = router.choose(current_app.extensions["sqlalchemy"].engines)
+
+
+def _after_request(response):
+    """Pins the client to the primary for a while after it changed something"""
+    router = current_app.extensions["replica_router"]
+    if router.enabled and request.method not in SAFE_METHODS and response.status_code < 400:
+        window = current_app.config["REPLICA_STICKY_SECONDS"]
+        response.set_cookie(
+            STICKY_COOKIE, f"{time.time() + window:.3f}", max_age=window, httponly=True
+        )
+    return response
+
+
+def init_routing(app):
+    """Creates the replica router from the app config and installs the hooks"""
+    keys = [key for key in app.config.get("SQLALCHEMY_BINDS", {}) if key.startswith(REPLICA_BIND_PREFIX)]
+    app.extensions["replica_router"] = ReplicaRouter(
+        keys,
+        app.config["REPLICA_HEALTH_CHECK_SECONDS"],
+        app.config["REPLICA_RETRY_SECONDS"],
+    )
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.logger.info("Read replicas: %d", len(keys))
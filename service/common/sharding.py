@@ -0,0 +1,183 @@
+"""
+Database Sharding
+
+Shopcarts are spread over N databases: DATABASE_URI is shard 0 and the
+URIs in DATABASE_SHARD_URIS are shards 1 to N-1. A customer's cart lives
+on shard ``customer_id % N`` and every shard hands out cart ids with
+``id % N`` equal to its own number, so a cart id alone names its shard.
+
+Single-cart operations pin the session to one shard with ``use_shard``.
+Collection queries run on every shard in parallel with ``fan_out``.
+"""
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from sqlalchemy import text, inspect
+from sqlalchemy.schema import CreateColumn
+
+SHARD_BIND_PREFIX = "shard_"
+
+
+######################################################################
+#  S H A R D   M A P
+######################################################################
+class ShardMap:
+    """The bind keys of the shards; None is the default engine (shard 0)"""
+
+    def __init__(self, keys=(None,)):
+        self.keys = list(keys)
+        self.executor = None
+
+    @property
+    def count(self) -> int:
+        """Returns the number of shards"""
+        return len(self.keys)
+
+    def set_shards(self, keys) -> None:
+        """Replaces the shard bind keys"""
+        self.keys = list(keys)
+        if self.executor:
+            self.executor.shutdown()
+            self.executor = None
+
+    def pool(self) -> ThreadPoolExecutor:
+        """Returns the thread pool that runs fan-out queries"""
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.count, thread_name_prefix="shard")
+        return self.executor
+
+
+def shard_map() -> ShardMap:
+    """Returns the shard map of the current app"""
+    return current_app.extensions["shard_map"]
+
+
+def shard_for_customer(customer_id) -> int:
+    """Returns the shard that holds the cart of a customer"""
+    return customer_id % shard_map().count if isinstance(customer_id, int) else 0
+
+
+def shard_for_shopcart(shopcart_id) -> int:
+    """Returns the shard that created a shopcart id"""
+    return shopcart_id % shard_map().count if isinstance(shopcart_id, int) else 0
+
+
+def bind_key(shard: int):
+    """Returns the bind key of a shard"""
+    return shard_map().keys[shard]
+
+
+def use_shard(shard: int) -> None:
+    """Pins the session of the current app context to a shard"""
+    current_app.extensions["sqlalchemy"].session().info["shard"] = shard
+
+
+def fan_out(query, *args) -> list:
+    """Runs query(*args) on every shard in parallel and merges the results"""
+    return run_on_shards(query, {shard: args for shard in range(shard_map().count)})
+
+
+def fan_out_by(keys, shard_of, query) -> list:
+    """Runs query(keys) on each shard that holds some of the keys, with those keys"""
+    groups = {}
+    for key in keys:
+        groups.setdefault(shard_of(key), []).append(key)
+    return run_on_shards(query, {shard: (group,) for shard, group in groups.items()})
+
+
+def run_on_shards(query, calls: dict) -> list:
+    """Runs query(*args) for each shard -> args in calls and merges the results"""
+    if len(calls) <= 1:  # no need for threads, use the session of this context
+        rows = []
+        for shard, args in calls.items():
+            use_shard(shard)
+            rows = query(*args)
+        return rows
+    app = current_app._get_current_object()  # pylint: disable=protected-access
+    # each thread runs in a copy of this context, so its spans stay in the trace
+    contexts = {shard: contextvars.copy_context() for shard in calls}
+
+    def run_on(shard):
+        with app.app_context():
+            use_shard(shard)
+            return query(*calls[shard])
+
+    results = shard_map().pool().map(lambda shard: contexts[shard].run(run_on, shard), calls)
+    return [row for rows in results for row in rows]
+
+
+######################################################################
+#  S E T U P
+######################################################################
+def prepare_shard(engine, metadata, shard: int, count: int) -> None:
+    """Creates the tables, columns, indexes and triggers of a shard and makes it hand out ids of its own"""
+    metadata.create_all(engine)
+    add_missing_columns(engine, metadata)
+    for table in metadata.sorted_tables:  # create_all skips indexes of existing tables
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    create_triggers(engine, metadata)
+    if count == 1:
+        default = "nextval('shopcart_id_seq'::regclass)"
+    else:
+        default = f"((nextval('shopcart_id_seq'::regclass) * {count}) + {shard})"
+    with engine.begin() as connection:
+        current = connection.execute(
+            text(
+                "SELECT column_default FROM information_schema.columns"
+                " WHERE table_schema = current_schema()"
+                " AND table_name = 'shopcart' AND column_name = 'id'"
+            )
+        ).scalar()
+        if current != default:  # altering takes an exclusive lock, so only when needed
+            connection.execute(text(f"ALTER TABLE shopcart ALTER COLUMN id SET DEFAULT {default}"))
+
+
+def add_missing_columns(engine, metadata) -> None:
+    """Adds the columns that were added to the models after their tables were created
+
+    New columns need a server_default (or to be nullable) to fill the existing rows.
+    """
+    with engine.begin() as connection:
+        schema = inspect(connection)
+        for table in metadata.sorted_tables:
+            present = {column["name"] for column in schema.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in present:
+                    ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                    connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+
+
+def create_triggers(engine, metadata) -> None:
+    """Creates the trigger functions and triggers of metadata.info, replacing changed functions
+
+    metadata.info["trigger_functions"] maps function names to PL/pgSQL bodies
+    and metadata.info["triggers"] maps trigger names to CREATE TRIGGER statements.
+    """
+    with engine.begin() as connection:
+        for name, body in metadata.info.get("trigger_functions", {}).items():
+            current = connection.execute(
+                text("SELECT prosrc FROM pg_proc WHERE proname = :name"), {"name": name}
+            ).scalar()
+            if current != body:  # replacing concurrently fails, so only when needed
+                connection.execute(
+                    text(f"CREATE OR REPLACE FUNCTION {name}() RETURNS trigger LANGUAGE plpgsql AS $${body}$$")
+                )
+        present = set(connection.execute(text("SELECT tgname FROM pg_trigger")).scalars())
+        for name, statement in metadata.info.get("triggers", {}).items():
+            if name not in present:
+                connection.execute(text(statement))
+
+
+def init_sharding(app, db) -> None:
+    """Creates the shard map from the app config and prepares every shard"""
+    binds = app.config.get("SQLALCHEMY_BINDS", {})
+    keys = [None] + sorted(
+        (key for key in binds if key.startswith(SHARD_BIND_PREFIX)),
+        key=lambda key: int(key[len(SHARD_BIND_PREFIX):]),
+    )
+    app.extensions["shard_map"] = ShardMap(keys)
+    with app.app_context():
+        for shard, key in enumerate(keys):
+            prepare_shard(db.engines[key], db.metadata, shard, len(keys))
+    app.logger.info("Database shards: %d", len(keys))
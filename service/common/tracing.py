@@ -0,0 +1,364 @@
+"""
+Request Tracing
+
+This module contains a lightweight tracer that records a span for every
+HTTP request, child spans for model calls and for every SQL statement.
+Trace ids are propagated from incoming W3C ``traceparent`` headers and
+finished spans are exported to an in-memory ring buffer or a JSONL file.
+"""
+import os
+import json
+import atexit
+import re
+import time
+import secrets
+import threading
+import functools
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+TRACEPARENT_HEADER = "traceparent"
+TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+MAX_STATEMENT_LENGTH = 500
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_exporter = None
+
+
+######################################################################
+#  S P A N S
+######################################################################
+class Span:
+    """A single timed operation inside a trace"""
+
+    # pylint: disable=too-many-instance-attributes
+    __slots__ = (
+        "name",
+        "kind",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "start",
+        "duration_ms",
+        "attributes",
+        "error",
+        "_started",
+        "_token",
+    )
+
+    def __init__(self, name, kind, trace_id, parent_id=None, attributes=None):
+        # pylint: disable=too-many-arguments
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.duration_ms = None
+        self.attributes = attributes or {}
+        self.error = None
+        self._started = time.perf_counter()
+        self._token = None
+
+    def __repr__(self):
+        return f"<Span {self.name} trace=[{self.trace_id}] span=[{self.span_id}]>"
+
+    @property
+    def traceparent(self) -> str:
+        """Returns the W3C traceparent header value for this span"""
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def finish(self, error=None):
+        """Ends the span and hands it to the exporter"""
+        self.duration_ms = round((time.perf_counter() - self._started) * 1000, 3)
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        if self._token is not None:
+            try:
+                _current_span.reset(self._token)
+            except ValueError:  # finished from a different context
+                pass
+            self._token = None
+        if _exporter is not None:
+            _exporter.export(self)
+
+    def serialize(self) -> dict:
+        """Converts a Span into a dictionary"""
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration_ms": self.duration_ms,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+######################################################################
+#  E X P O R T E R S
+######################################################################
+class MemoryExporter:
+    """Keeps the most recent finished spans in a bounded ring buffer"""
+
+    def __init__(self, size=1000):
+        self.spans = deque(maxlen=size)
+
+    def export(self, span):
+        """Stores a finished span"""
+        self.spans.append(span.serialize())
+
+    def find(self, trace_id=None, limit=None) -> list:
+        """Returns the buffered spans, newest last, optionally for one trace"""
+        spans = list(self.spans)
+        if trace_id:
+            spans = [item for item in spans if item["trace_id"] == trace_id]
+        if limit:
+            spans = spans[-limit:]
+        return spans
+
+    def clear(self):
+        """Drops all buffered spans"""
+        self.spans.clear()
+
+
+class FileExporter:
+    """Appends finished spans to a local file as JSON lines, in batches
+
+    The file stays open and spans are buffered: they are written every
+    flush_size spans or flush_interval seconds, and at exit, so that a span
+    costs no system call on the hot path. Each batch goes out with a single
+    write() on an O_APPEND descriptor, so the workers of a server can share
+    the file without their lines interleaving.
+    """
+
+    def __init__(self, path, flush_size=100, flush_interval=1.0):
+        self.path = path
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.lines = []
+        self.flushed = time.monotonic()
+        self.fd = None
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        atexit.register(self.close)
+
+    def export(self, span):
+        """Buffers a finished span as one line of JSON"""
+        line = json.dumps(span.serialize()) + "\n"
+        with self.lock:
+            self._after_fork()
+            self.lines.append(line)
+            if len(self.lines) >= self.flush_size or time.monotonic() - self.flushed >= self.flush_interval:
+                self._write()
+
+    def flush(self):
+        """Writes the buffered spans to the file"""
+        with self.lock:
+            self._write()
+
+    def close(self):
+        """Writes the buffered spans and closes the file"""
+        with self.lock:
+            self._write()
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+
+    def _after_fork(self):
+        """Drops the spans a forked worker inherited, which its parent writes; the caller holds the lock"""
+        if os.getpid() != self.pid:
+            self.pid = os.getpid()
+            self.lines.clear()
+            self.flushed = time.monotonic()
+
+    def _write(self):
+        """Writes the buffered spans; the caller holds the lock"""
+        self._after_fork()
+        if self.lines:
+            if self.fd is None:
+                self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            data = "".join(self.lines).encode()
+            self.lines.clear()
+            while data:  # a short write only happens on a full disk or a signal
+                data = data[os.write(self.fd, data):]
+        self.flushed = time.monotonic()
+
+
+def get_exporter():
+    """Returns the active exporter or None if tracing is disabled"""
+    return _exporter
+
+
+def set_exporter(exporter):
+    """Replaces the active exporter; None disables tracing"""
+    global _exporter  # pylint: disable=global-statement
+    _exporter = exporter
+
+
+def create_exporter(name: str, path: str = None, size: int = 1000):
+    """Creates an exporter from its configured name"""
+    name = (name or "none").lower()
+    if name == "memory":
+        return MemoryExporter(size)
+    if name == "file":
+        return FileExporter(path or f"traces-{os.getpid()}.jsonl")
+    return None
+
+
+######################################################################
+#  S P A N   H E L P E R S
+######################################################################
+def current_span():
+    """Returns the span that is active in this context, if any"""
+    return _current_span.get()
+
+
+def parse_traceparent(header):
+    """Returns (trace_id, parent_id) from a traceparent header or None"""
+    if not header:
+        return None
+    match = TRACEPARENT_RE.match(header.strip().lower())
+    if not match:
+        return None
+    trace_id, parent_id, _ = match.groups()
+    if trace_id == "0" * 32 or parent_id == "0" * 16:
+        return None
+    return trace_id, parent_id
+
+
+def start_span(name, kind="internal", trace_id=None, parent_id=None, **attributes):
+    """
+    Starts a span and makes it the current span
+
+    The span becomes a child of the current span unless an explicit
+    trace_id / parent_id (from a remote caller) is given.
+    """
+    parent = _current_span.get()
+    if trace_id is None:
+        if parent is not None:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        else:
+            trace_id = secrets.token_hex(16)
+    new_span = Span(name, kind, trace_id, parent_id, attributes)
+    new_span._token = _current_span.set(new_span)  # pylint: disable=protected-access
+    return new_span
+
+
+@contextmanager
+def span(name, kind="internal", **attributes):
+    """Context manager that records a child span of the current span"""
+    if _exporter is None or _current_span.get() is None:
+        yield None
+        return
+    child = start_span(name, kind, **attributes)
+    try:
+        yield child
+    except Exception as error:
+        child.finish(error)
+        raise
+    child.finish()
+
+
+def traced(func):
+    """
+    Decorator that records a child span for a model call
+
+    The span is named after the class and method, e.g. ``Shopcart.find``,
+    and is only recorded while a request is being traced.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _exporter is None or _current_span.get() is None:
+            return func(*args, **kwargs)
+        owner = args[0] if args else None
+        owner = owner if isinstance(owner, type) else type(owner)
+        with span(f"{owner.__name__}.{func.__name__}", "model"):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+######################################################################
+#  F L A S K   A N D   S Q L A L C H E M Y   H O O K S
+######################################################################
+def _before_request():
+    """Starts a server span for the incoming request"""
+    if _exporter is None:
+        return
+    remote = parse_traceparent(request.headers.get(TRACEPARENT_HEADER))
+    trace_id, parent_id = remote if remote else (None, None)
+    g.trace_span = start_span(
+        f"{request.method} {request.path}",
+        "server",
+        trace_id=trace_id,
+        parent_id=parent_id,
+        method=request.method,
+        path=request.path,
+    )
+
+
+def _after_request(response):
+    """Records the status code and echoes the traceparent to the caller"""
+    request_span = g.get("trace_span")
+    if request_span is not None:
+        request_span.attributes["status_code"] = response.status_code
+        response.headers[TRACEPARENT_HEADER] = request_span.traceparent
+    return response
+
+
+def _teardown_request(error=None):
+    """Finishes the server span for the request"""
+    request_span = g.pop("trace_span", None)
+    if request_span is not None:
+        request_span.finish(error)
+
+
+def _before_cursor_execute(conn, cursor, statement, *args):
+    """Starts a span for a SQL statement"""
+    # pylint: disable=unused-argument
+    if _exporter is None or _current_span.get() is None:
+        return
+    sql_span = start_span("sql", "client", statement=statement[:MAX_STATEMENT_LENGTH])
+    conn.info.setdefault("trace_spans", []).append(sql_span)
+
+
+def _after_cursor_execute(conn, cursor, *args):
+    """Finishes the span for a SQL statement"""
+    # pylint: disable=unused-argument
+    spans = conn.info.get("trace_spans")
+    if spans:
+        spans.pop().finish()
+
+
+def _handle_error(context):
+    """Finishes the span for a failed SQL statement"""
+    spans = context.connection.info.get("trace_spans") if context.connection else None
+    if spans:
+        spans.pop().finish(context.original_exception)
+
+
+def init_tracing(app):
+    """Configures the exporter and installs the request and SQL hooks"""
+    set_exporter(
+        create_exporter(
+            app.config.get("TRACING_EXPORTER"),
+            app.config.get("TRACING_FILE"),
+            app.config.get("TRACING_BUFFER_SIZE", 1000),
+        )
+    )
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Engine, "handle_error", _handle_error)
+    app.logger.info("Request tracing exporter: %s", type(_exporter).__name__)
@@ -0,0 +1,185 @@
+"""
+Request Validation
+
+flask-restx's reqparse rebuilds its Argument objects and walks every
+location on each call, and model validation goes through jsonschema. The
+validators here are compiled once, at import, from the same RequestParser
+and api.model definitions that document the API, so Swagger and the
+checks cannot drift apart. A request is then checked with a flat loop over
+precomputed tuples. Every failure raises DataValidationError, which both
+the Flask and the ASGI app turn into the usual 400 body, with a message of
+the form "Invalid <kind> '<name>': <reason>."
+"""
+from flask import request
+from flask_restx import fields, inputs
+from service.models import DataValidationError
+
+MISSING = object()
+
+# Field class -> (accepted Python types, the reason given when it does not match)
+FIELD_TYPES = (
+    (fields.Boolean, (bool,), "must be true or false"),
+    (fields.Integer, (int,), "must be an integer"),
+    (fields.Float, (int, float), "must be a number"),
+    (fields.String, (str,), "must be a string"),
+)
+# Query argument type -> the reason given when a value does not convert
+TYPE_REASONS = {int: "must be an integer", float: "must be a number", inputs.boolean: "must be true or false"}
+
+
+def is_instance(value, types) -> bool:
+    """isinstance() that does not let booleans pass for numbers"""
+    return isinstance(value, types) and (bool in types or not isinstance(value, bool))
+
+
+def fail(kind, name, reason):
+    """Rejects the request with a validation error"""
+    raise DataValidationError(f"Invalid {kind} '{name}': {reason}.")
+
+
+######################################################################
+#  Q U E R Y   S T R I N G S
+######################################################################
+class QueryValidator:
+    """Parses the query string with the arguments of a RequestParser"""
+
+    def __init__(self, parser):
+        self.arguments = tuple(
+            (
+                argument.name,
+                argument.type,
+                argument.default,
+                frozenset(argument.choices) if argument.choices else None,
+                argument.required,
+                self._reason(argument.type),
+            )
+            for argument in parser.args
+        )
+
+    @staticmethod
+    def _reason(convert):
+        """Returns the reason given when a value does not convert, None to use the error's"""
+        if isinstance(convert, inputs.int_range):
+            return f"must be an integer from {convert.low} to {convert.high}"
+        return TYPE_REASONS.get(convert)
+
+    def parse(self, args=None) -> dict:
+        """Returns the converted arguments, or raises DataValidationError"""
+        args = request.args if args is None else args
+        result = {}
+        for name, convert, default, choices, required, reason in self.arguments:
+            value = args.get(name)
+            if value is None:
+                if required:
+                    fail("query parameter", name, "is required")
+                result[name] = default
+                continue
+            try:
+                value = convert(value)
+            except (TypeError, ValueError) as error:
+                fail("query parameter", name, reason or str(error).rstrip("."))
+            if choices is not None and value not in choices:
+                fail("query parameter", name, "must be one of " + ", ".join(sorted(choices)))
+            result[name] = value
+        return result
+
+
+######################################################################
+#  J S O N   B O D I E S
+######################################################################
+class BodyValidator:
+    """Checks a JSON body against the fields of an api.model
+
+    required and defaults override what the model declares, messages
+    replace the whole error message of a field, and coerce accepts numbers
+    sent as strings, treating "" as not sent.
+    """
+
+    def __init__(self, model, required=None, defaults=None, messages=None, coerce=False):
+        defaults = defaults or {}
+        messages = messages or {}
+        self.coerce = coerce
+        self.checks = tuple(
+            self._compile(name, field, required, defaults, messages)
+            for name, field in model.resolved.items()
+            if not getattr(field, "readonly", False)
+        )
+
+    @staticmethod
+    def _compile(name, field, required, defaults, messages):
+        """Returns the check tuple of one field"""
+        nested = None
+        if isinstance(field, fields.List):
+            types, reason = (list,), "must be a list"
+            item = field.container
+            if isinstance(item, fields.Nested):
+                nested = BodyValidator(item.model)
+            else:
+                nested = next((entry for entry in FIELD_TYPES if isinstance(item, entry[0])), None)
+        elif isinstance(field, fields.Nested):
+            types, reason = (dict,), "must be an object"
+            nested = BodyValidator(field.model)
+        else:
+            types, reason = next(
+                (entry[1:] for entry in FIELD_TYPES if isinstance(field, entry[0])), ((object,), "")
+            )
+        minimum = getattr(field, "minimum", None)
+        if minimum is not None:
+            reason += f" of at least {minimum}"
+        return (
+            name,
+            types,
+            minimum,
+            nested,
+            field.required if required is None else name in required,
+            defaults.get(name, MISSING),
+            reason,
+            messages.get(name),
+        )
+
+    def validate(self, data, path="") -> dict:
+        """Returns the known fields of a body with defaults applied, or raises DataValidationError"""
+        if not isinstance(data, dict):
+            fail("field", path.rstrip(".") or "body", "must be a JSON object")
+        result = {}
+        for check in self.checks:
+            name, required, default = check[0], check[4], check[5]
+            value = data.get(name)
+            if self.coerce and value == "":
+                value = None
+            if value is not None:
+                result[name] = self._check_value(value, check, path)
+            elif required:
+                fail("field", path + name, "is required")
+            elif default is not MISSING:
+                result[name] = default
+        return result
+
+    def _check_value(self, value, check, path):
+        """Returns a field value once it has the type and range of its check"""
+        name, types, minimum, nested, _, _, reason, message = check
+        if self.coerce and isinstance(value, str) and types[0] in (int, float):
+            try:
+                value = types[-1](value)
+            except ValueError:
+                value = None
+        if not is_instance(value, types) or (minimum is not None and value < minimum):
+            if message:
+                raise DataValidationError(message)
+            fail("field", path + name, reason)
+        if nested is None:
+            return value
+        if types == (list,):
+            return self._validate_list(value, nested, path + name)
+        return nested.validate(value, f"{path}{name}.")
+
+    @staticmethod
+    def _validate_list(values, nested, path):
+        """Validates the entries of a list field"""
+        if isinstance(nested, BodyValidator):
+            return [nested.validate(value, f"{path}[{index}].") for index, value in enumerate(values)]
+        _, types, reason = nested
+        for index, value in enumerate(values):
+            if not is_instance(value, types):
+                fail("field", f"{path}[{index}]", reason)
+        return values
@@ -11,6 +11,81 @@ DATABASE_URI = os.getenv(
 # Configure SQLAlchemy
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+# Each worker thread checks out its own connection, so size the pool for them
+SQLALCHEMY_ENGINE_OPTIONS = {
+    "pool_size": int(os.getenv("DATABASE_POOL_SIZE", "5")),
+    "max_overflow": int(os.getenv("DATABASE_MAX_OVERFLOW", "5")),
+    "pool_pre_ping": True,
+}
+
+# Optional read replicas (comma separated URIs); GET requests read from them
+DATABASE_REPLICA_URIS = os.getenv("DATABASE_REPLICA_URIS", "")
+# Optional extra shards (comma separated URIs); DATABASE_URI is shard 0
+DATABASE_SHARD_URIS = os.getenv("DATABASE_SHARD_URIS", "")
+SQLALCHEMY_BINDS = {
+    **{
+        f"replica_{number}": uri.strip()
+        for number, uri in enumerate(filter(str.strip, DATABASE_REPLICA_URIS.split(",")))
+    },
+    **{
+        f"shard_{number}": uri.strip()
+        for number, uri in enumerate(filter(str.strip, DATABASE_SHARD_URIS.split(",")), start=1)
+    },
+}
+# Seconds a client reads from the primary after it changed something
+REPLICA_STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+REPLICA_HEALTH_CHECK_SECONDS = float(os.getenv("REPLICA_HEALTH_CHECK_SECONDS", "10"))
+REPLICA_RETRY_SECONDS = float(os.getenv("REPLICA_RETRY_SECONDS", "30"))
+
+# Pool of the asyncio engine used by the ASGI app (service.asgi)
+ASYNC_DATABASE_POOL_SIZE = int(os.getenv("ASYNC_DATABASE_POOL_SIZE", "10"))
+ASYNC_DATABASE_MAX_OVERFLOW = int(os.getenv("ASYNC_DATABASE_MAX_OVERFLOW", "10"))
+
+# Per worker cache of customer_id -> shopcart id, and how long a miss is remembered
+CUSTOMER_CACHE_SIZE = int(os.getenv("CUSTOMER_CACHE_SIZE", "10000"))
+CUSTOMER_CACHE_MISS_SECONDS = float(os.getenv("CUSTOMER_CACHE_MISS_SECONDS", "5"))
+
+# Most shopcarts fetched by one ?ids= / ?customer_ids= or lookup request
+LOOKUP_MAX_IDS = int(os.getenv("LOOKUP_MAX_IDS", "1000"))
+# Most shopcarts created by one POST /api/shopcarts/bulk request
+BULK_MAX_SHOPCARTS = int(os.getenv("BULK_MAX_SHOPCARTS", "10000"))
+# Most item operations applied by one POST /api/shopcarts/<id>/operations request
+BATCH_MAX_OPERATIONS = int(os.getenv("BATCH_MAX_OPERATIONS", "100"))
+
+# Responses smaller than this are not compressed; gzip level 1-9 and brotli quality 0-11
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "500"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+# Cache-Control max-age of static files, which are revalidated with their content hash ETag
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", str(7 * 24 * 3600)))
+
+# Set to false in production to skip the Swagger UI; /api/swagger.json stays available
+API_DOCS_ENABLED = os.getenv("API_DOCS_ENABLED", "true").lower() == "true"
 
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
+
+# Carts unchanged for CART_TTL_DAYS are deleted by flask purge-carts, in batches
+# of CART_PURGE_BATCH_SIZE carts with CART_PURGE_PAUSE seconds between them
+CART_TTL_DAYS = float(os.getenv("CART_TTL_DAYS", "30"))
+CART_PURGE_BATCH_SIZE = int(os.getenv("CART_PURGE_BATCH_SIZE", "500"))
+CART_PURGE_PAUSE = float(os.getenv("CART_PURGE_PAUSE", "0.1"))
+# The change feed forgets deleted carts after CHANGE_TOMBSTONE_DAYS, when carts are purged
+CHANGE_TOMBSTONE_DAYS = float(os.getenv("CHANGE_TOMBSTONE_DAYS", "7"))
+
+# flask dispatch-events sends the cart events to EVENT_SINK (file:path or an http:// URL),
+# EVENT_BATCH_SIZE events per batch
+EVENT_SINK = os.getenv("EVENT_SINK", "file:cart-events.jsonl")
+EVENT_BATCH_SIZE = int(os.getenv("EVENT_BATCH_SIZE", "500"))
+
+# Enables the /api/admin endpoints, and the carts updated per transaction by a repricing
+ADMIN_ENDPOINTS = os.getenv("ADMIN_ENDPOINTS", "false").lower() == "true"
+PRICE_UPDATE_BATCH_SIZE = int(os.getenv("PRICE_UPDATE_BATCH_SIZE", "1000"))
+
+# Enables the /debug endpoints (never turn this on in production)
+DEBUG_ENDPOINTS = os.getenv("DEBUG_ENDPOINTS", "false").lower() == "true"
+
+# Request tracing: "none", "memory" (ring buffer) or "file" (JSON lines)
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none")
+TRACING_FILE = os.getenv("TRACING_FILE", "traces.jsonl")
+TRACING_BUFFER_SIZE = int(os.getenv("TRACING_BUFFER_SIZE", "1000"))
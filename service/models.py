@@ -3,22 +3,36 @@ Models for YourResourceModel
 
 All of the models are stored in this module
 """
+# pylint: disable=too-many-lines
+import time
 import logging
+from itertools import zip_longest
 from abc import abstractmethod
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.exc import IntegrityError, DataError
+from sqlalchemy import (
+    inspect, tuple_, delete, update, select, literal, literal_column, any_, bindparam, union_all, Integer, false, true
+)
+from sqlalchemy.dialects.postgresql import insert, ARRAY
+from sqlalchemy.orm import selectinload, noload
 from psycopg2.errors import UniqueViolation
+from service.common.tracing import traced
+from service.common.routing import RoutingSession
+from service.common import sharding, cache
 
 logger = logging.getLogger("flask.app")
 
 # Create the SQLAlchemy object to be initialized later in init_db()
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 
 # Function to initialize the database
 def init_db(app):
     """Initializes the SQLAlchemy app"""
     Shopcart.init_db(app)
+    Shopcart.customer_cart_ids.maxsize = app.config["CUSTOMER_CACHE_SIZE"]
+    Shopcart.customers_without_cart.maxsize = app.config["CUSTOMER_CACHE_SIZE"]
+    Shopcart.customers_without_cart.ttl = app.config["CUSTOMER_CACHE_MISS_SECONDS"]
 
 
 class DataValidationError(Exception):
@@ -46,6 +60,7 @@ class PersistentBase:
     def deserialize(self, data: dict) -> None:
         """Convert a dictionary into an object"""
 
+    @traced
     def create(self):
         """
         Creates a Shopcart to the database
@@ -65,6 +80,7 @@ class PersistentBase:
 
             raise DataValidationError("Invalid Shopcart: " + error.args[0]) from error
 
+    @traced
     def update(self):
         """
         Updates a Shopcart to the database
@@ -72,6 +88,7 @@ class PersistentBase:
         logger.info("Updating %s", self.id)
         db.session.commit()
 
+    @traced
     def delete(self):
         """Removes a Shopcart from the data store"""
         logger.info("Deleting %s", self.id)
@@ -84,17 +101,23 @@ class PersistentBase:
         logger.info("Initializing database")
         cls.app = app
         # This is where we initialize SQLAlchemy from the Flask app
-        db.init_app(app)
-        app.app_context().push()
-        db.create_all()  # make our sqlalchemy tables
+        if "sqlalchemy" not in app.extensions:
+            db.init_app(app)
+        # Sessions are scoped to the app context, which Flask pushes per
+        # request, so only borrow a context here instead of leaving one pushed
+        with app.app_context():
+            db.create_all()  # make our sqlalchemy tables
+        sharding.init_sharding(app, db)
 
     @classmethod
+    @traced
     def all(cls):
         """Returns all of the records in the database"""
         logger.info("Processing all records")
         return cls.query.all()  # pylint: disable=no-member
 
     @classmethod
+    @traced
     def find(cls, by_id):
         """Finds a record by it's ID"""
         logger.info("Processing lookup for id %s ...", by_id)
@@ -117,6 +140,16 @@ class CartItem(db.Model, PersistentBase):
     product_id = db.Column(db.Integer, primary_key=True)
     quantity = db.Column(db.Integer, nullable=False)
     price = db.Column(db.Float(), nullable=False)
+    # The primary key serves sorting by product_id; these serve the other sorts
+    __table_args__ = (
+        db.Index("ix_cart_item_shopcart_price", "shopcart_id", "price", "product_id"),
+        db.Index("ix_cart_item_shopcart_quantity", "shopcart_id", "quantity", "product_id"),
+        # finds the carts holding a product, in shopcart_id order
+        db.Index("ix_cart_item_product", "product_id", "shopcart_id"),
+    )
+
+    # The filters supported by find_by_shopcart_id
+    FILTERS = ("product_ids", "min_price", "max_price", "min_quantity", "max_quantity")
 
     def __repr__(self):
         return f"<CartItem id=[{self.product_id}] shopcart[{self.shopcart_id}]>"
@@ -124,12 +157,14 @@ class CartItem(db.Model, PersistentBase):
     def __str__(self):
         return f"{self.product_id}: Price={self.price}, Quantity={self.quantity}"
 
+    @traced
     def create(self):
         """
         Creates a CartItem in the database
         """
         try:
             logger.info("Creating %s", self.product_id)
+            sharding.use_shard(sharding.shard_for_shopcart(self.shopcart_id))
 
             # Add extra check to ensure primary keys (product_id & shopcart_id) are present
             if self.product_id is None or self.shopcart_id is None:
@@ -141,6 +176,7 @@ class CartItem(db.Model, PersistentBase):
         except IntegrityError as error:
             raise DataValidationError("Invalid CartItem: " + error.args[0]) from error
 
+    @traced
     def update(self):
         """
         Updates a CartItem in the database
@@ -148,6 +184,7 @@ class CartItem(db.Model, PersistentBase):
         logger.info("Updating %s", self.product_id)
         db.session.commit()
 
+    @traced
     def delete(self):
         """Removes a CartItem from the database"""
         logger.info("Deleting %s", self.product_id)
@@ -186,7 +223,88 @@ class CartItem(db.Model, PersistentBase):
             ) from error
         return self
 
+    @staticmethod
+    def merge_lines(shopcart_id, items) -> list:
+        """Returns the serialized items of a shopcart, one per product sorted by product_id
+
+        Lines of the same product add up their quantities and keep the last price
+        """
+        lines = {}
+        for item in items:
+            line = lines.get(item["product_id"])
+            lines[item["product_id"]] = {
+                "shopcart_id": shopcart_id,
+                "product_id": item["product_id"],
+                "quantity": item["quantity"] + (line["quantity"] if line else 0),
+                "price": item["price"],
+            }
+        return [lines[product_id] for product_id in sorted(lines)]
+
+    @classmethod
+    def delete_many_statement(cls, shopcart_id, product_ids):
+        """Returns the DELETE of products from a shopcart, returning the deleted product ids"""
+        return (
+            delete(cls.__table__)
+            .where(
+                cls.shopcart_id == shopcart_id,
+                cls.product_id == any_(bindparam("product_ids", product_ids, type_=ARRAY(Integer))),
+            )
+            .returning(cls.product_id)
+        )
+
+    @classmethod
+    @traced
+    def delete_many(cls, shopcart_id, product_ids) -> list:
+        """Deletes products from a shopcart with one statement
+
+        Args:
+            shopcart_id (Integer): the id of the shopcart to delete from
+            product_ids (list): the ids of the products to delete
+        Returns the product ids that were in the shopcart
+        """
+        logger.info("Deleting %d products from shopcart %s ...", len(product_ids), shopcart_id)
+        sharding.use_shard(sharding.shard_for_shopcart(shopcart_id))
+        deleted = db.session.execute(cls.delete_many_statement(shopcart_id, product_ids)).scalars().all()
+        db.session.commit()
+        return deleted
+
+    @classmethod
+    @traced
+    def set_price(cls, product_id, price, batch_size=1000) -> int:
+        """Sets the price of a product in every shopcart, on every shard
+
+        Args:
+            product_id (Integer): the id of the product to reprice
+            price (Float): the new price
+            batch_size (Integer): the most carts updated by one short transaction
+        Returns how many shopcarts had their price changed
+        """
+        logger.info("Setting the price of product %s to %s ...", product_id, price)
+        return sum(sharding.fan_out(lambda: [cls._set_price_on_shard(product_id, price, batch_size)]))
+
     @classmethod
+    def _set_price_on_shard(cls, product_id, price, batch_size) -> int:
+        """Updates the price on one shard in batches of carts, walking up the shopcart ids"""
+        updated, after = 0, None
+        while True:
+            batch = select(cls.shopcart_id).where(cls.product_id == product_id, cls.price != price)
+            if after is not None:
+                batch = batch.where(cls.shopcart_id > after)
+            batch = batch.order_by(cls.shopcart_id).limit(batch_size).cte("batch")
+            shopcart_ids = db.session.execute(
+                update(cls.__table__)
+                .where(cls.shopcart_id == batch.c.shopcart_id, cls.product_id == product_id)
+                .values(price=price)
+                .returning(cls.shopcart_id)
+            ).scalars().all()
+            db.session.commit()  # release the row locks of the batch
+            updated += len(shopcart_ids)
+            if len(shopcart_ids) < batch_size:
+                return updated
+            after = max(shopcart_ids)
+
+    @classmethod
+    @traced
     def find_by_shopcart_id_and_product_id(cls, shopcart_id, product_id):
         """Returns cart_item in a given shopcart
 
@@ -199,25 +317,208 @@ class CartItem(db.Model, PersistentBase):
             shopcart_id,
             product_id,
         )
+        sharding.use_shard(sharding.shard_for_shopcart(shopcart_id))
         return cls.query.filter_by(
             shopcart_id=shopcart_id, product_id=product_id
         ).first()
 
+    @classmethod
+    @traced
+    def find_by_shopcart_id(  # pylint: disable=too-many-arguments
+        cls, shopcart_id, filters=None, sort="product_id", limit=None, after=None
+    ):
+        """Returns a page of the items in a shopcart and the sort keys to continue after
+
+        Args:
+            shopcart_id (Integer): the id of the shopcart you want to match
+            filters (dict): product_ids, min_price, max_price, min_quantity, max_quantity
+            sort (str): product_id, price or quantity, prefixed with - for descending
+            limit (Integer): the most items to return, or None for all of them
+            after (list): the sort keys of the last item of the previous page
+        """
+        logger.info("Processing items query for shopcart %s ...", shopcart_id)
+        sharding.use_shard(sharding.shard_for_shopcart(shopcart_id))
+        statement, keys = cls.page_statement(shopcart_id, filters, sort, limit, after)
+        return cls.page(db.session.scalars(statement).all(), limit, keys)
+
+    @classmethod
+    def page_statement(  # pylint: disable=too-many-arguments
+        cls, shopcart_id, filters=None, sort="product_id", limit=None, after=None
+    ):
+        """Returns the SELECT of a page of items, shared with the ASGI app, and its sort keys"""
+        filters = filters or {}
+        statement = select(cls).where(cls.shopcart_id == shopcart_id)
+        if "product_ids" in filters:
+            statement = statement.where(cls.product_id.in_(filters["product_ids"]))
+        for column in (cls.price, cls.quantity):
+            if f"min_{column.key}" in filters:
+                statement = statement.where(column >= filters[f"min_{column.key}"])
+            if f"max_{column.key}" in filters:
+                statement = statement.where(column <= filters[f"max_{column.key}"])
+
+        # Keyset pagination on (sort column, product_id), which the indexes cover
+        descending = sort.startswith("-")
+        column = getattr(cls, sort.lstrip("-"))
+        keys = (cls.product_id,) if column is cls.product_id else (column, cls.product_id)
+        if after is not None:
+            if len(after) != len(keys):
+                raise DataValidationError("Invalid cursor for this sort order")
+            position = tuple_(*keys)
+            statement = statement.where(position < tuple_(*after) if descending else position > tuple_(*after))
+        statement = statement.order_by(*(key.desc() if descending else key for key in keys))
+        if limit is not None:
+            statement = statement.limit(limit + 1)
+        return statement, keys
+
+    @staticmethod
+    def page(items, limit, keys):
+        """Returns the items of a page_statement and the sort keys to continue after, if there are more"""
+        if limit is None or len(items) <= limit:
+            return items, None
+        items = items[:limit]
+        return items, [getattr(items[-1], key.key) for key in keys]
+
+
+######################################################################
+#  T R I G G E R S
+######################################################################
+# Item changes touch their shopcart however they are made: through the ORM,
+# set-based statements, COPY or the ASGI app. One UPDATE per statement.
+db.metadata.info["trigger_functions"] = {
+    "touch_shopcart": """
+BEGIN
+    UPDATE shopcart SET updated_at = now()
+    WHERE id IN (SELECT DISTINCT shopcart_id FROM changed_items) AND updated_at <> now();
+    RETURN NULL;
+END
+""",
+}
+db.metadata.info["triggers"] = {
+    f"cart_item_touch_{event.lower()}": (
+        f"CREATE TRIGGER cart_item_touch_{event.lower()} AFTER {event} ON cart_item"
+        f" REFERENCING {'OLD' if event == 'DELETE' else 'NEW'} TABLE AS changed_items"
+        " FOR EACH STATEMENT EXECUTE FUNCTION touch_shopcart()"
+    )
+    for event in ("INSERT", "UPDATE", "DELETE")
+}
+
+# The change feed orders the changes of a shard by the id of the transaction
+# that made them. Every change of a cart, including the touches above, gets
+# the current one, and deleted carts leave a tombstone behind.
+CURRENT_XACT_ID = db.text("pg_current_xact_id()::text::bigint")
+# Transactions below this id have all ended, later ones may still commit
+VISIBLE_XACT_ID = literal_column("pg_snapshot_xmin(pg_current_snapshot())::text::bigint")
+
+db.metadata.info["trigger_functions"]["bump_change_seq"] = """
+BEGIN
+    NEW.change_seq := pg_current_xact_id()::text::bigint;
+    RETURN NEW;
+END
+"""
+db.metadata.info["trigger_functions"]["bury_shopcarts"] = """
+BEGIN
+    INSERT INTO shopcart_tombstone (shopcart_id, customer_id)
+    SELECT id, customer_id FROM deleted_carts
+    ON CONFLICT (shopcart_id) DO UPDATE
+    SET customer_id = EXCLUDED.customer_id, change_seq = EXCLUDED.change_seq, deleted_at = EXCLUDED.deleted_at;
+    RETURN NULL;
+END
+"""
+db.metadata.info["triggers"]["shopcart_bump_change_seq"] = (
+    "CREATE TRIGGER shopcart_bump_change_seq BEFORE UPDATE ON shopcart"
+    " FOR EACH ROW EXECUTE FUNCTION bump_change_seq()"
+)
+db.metadata.info["triggers"]["shopcart_bury"] = (
+    "CREATE TRIGGER shopcart_bury AFTER DELETE ON shopcart REFERENCING OLD TABLE AS deleted_carts"
+    " FOR EACH STATEMENT EXECUTE FUNCTION bury_shopcarts()"
+)
+
+# The outbox of cart events, written in the transaction of the change and
+# sent by flask dispatch-events. A cart that changes many times in one
+# transaction is updated once: when its change_seq moves to the transaction.
+db.metadata.info["trigger_functions"]["record_cart_events"] = """
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO cart_event (shopcart_id, customer_id, type)
+        SELECT id, customer_id, 'shopcart.created' FROM new_carts ORDER BY id;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO cart_event (shopcart_id, customer_id, type)
+        SELECT new_carts.id, new_carts.customer_id, 'shopcart.updated'
+        FROM new_carts JOIN old_carts ON old_carts.id = new_carts.id
+        WHERE old_carts.change_seq <> new_carts.change_seq ORDER BY new_carts.id;
+    ELSE
+        INSERT INTO cart_event (shopcart_id, customer_id, type)
+        SELECT id, customer_id, 'shopcart.deleted' FROM old_carts ORDER BY id;
+    END IF;
+    RETURN NULL;
+END
+"""
+db.metadata.info["triggers"].update({
+    "shopcart_events_insert": (
+        "CREATE TRIGGER shopcart_events_insert AFTER INSERT ON shopcart REFERENCING NEW TABLE AS new_carts"
+        " FOR EACH STATEMENT EXECUTE FUNCTION record_cart_events()"
+    ),
+    "shopcart_events_update": (
+        "CREATE TRIGGER shopcart_events_update AFTER UPDATE ON shopcart"
+        " REFERENCING OLD TABLE AS old_carts NEW TABLE AS new_carts"
+        " FOR EACH STATEMENT EXECUTE FUNCTION record_cart_events()"
+    ),
+    "shopcart_events_delete": (
+        "CREATE TRIGGER shopcart_events_delete AFTER DELETE ON shopcart REFERENCING OLD TABLE AS old_carts"
+        " FOR EACH STATEMENT EXECUTE FUNCTION record_cart_events()"
+    ),
+})
+
+cart_event = db.Table(
+    "cart_event",
+    db.Column("id", db.BigInteger, primary_key=True),
+    db.Column("shopcart_id", db.Integer, nullable=False),
+    db.Column("customer_id", db.Integer, nullable=False),
+    db.Column("type", db.String(32), nullable=False),
+    db.Column("occurred_at", db.DateTime(timezone=True), nullable=False, server_default=db.func.now()),
+)
+
+shopcart_tombstone = db.Table(
+    "shopcart_tombstone",
+    db.Column("shopcart_id", db.Integer, primary_key=True),
+    db.Column("customer_id", db.Integer, nullable=False),
+    db.Column("change_seq", db.BigInteger, nullable=False, server_default=CURRENT_XACT_ID),
+    db.Column("deleted_at", db.DateTime(timezone=True), nullable=False, server_default=db.func.now()),
+    db.Index("ix_shopcart_tombstone_change_seq", "change_seq", "shopcart_id"),
+)
+
 
 ######################################################################
 #  S H O P C A R T   M O D E L
 ######################################################################
-class Shopcart(db.Model, PersistentBase):
+class Shopcart(db.Model, PersistentBase):  # pylint: disable=too-many-public-methods
     """
     Class that represents an ShopCart
     """
 
     app = None
+    # customer_id -> id of their shopcart, and customers recently seen without one
+    customer_cart_ids = cache.LRUCache()
+    customers_without_cart = cache.NegativeCache()
 
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
     customer_id = db.Column(db.Integer, unique=True, nullable=False)
-    items = db.relationship("CartItem", backref="shopcart", passive_deletes=True)
+    # updated_at is also bumped by the touch_shopcart trigger whenever its items change
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.now())
+    updated_at = db.Column(
+        db.DateTime(timezone=True), nullable=False, server_default=db.func.now(), onupdate=db.func.now()
+    )
+    # the id of the transaction that last changed the cart or its items, for the change feed
+    change_seq = db.Column(db.BigInteger, nullable=False, server_default=CURRENT_XACT_ID)
+    items = db.relationship(
+        "CartItem", backref="shopcart", passive_deletes=True, order_by="CartItem.product_id"
+    )
+    # walk the carts from the least recently changed, for the expiry sweeps and the change feed
+    __table_args__ = (
+        db.Index("ix_shopcart_updated_at", "updated_at", "id"),
+        db.Index("ix_shopcart_change_seq", "change_seq", "id"),
+    )
 
     def __repr__(self):
         return f"<ShopCart id=[{self.id}] customer_id=[{self.customer_id}]>"
@@ -259,6 +560,285 @@ class Shopcart(db.Model, PersistentBase):
             ) from error
         return self
 
+    def create(self):
+        """
+        Creates a Shopcart on the shard of its customer
+        """
+        sharding.use_shard(sharding.shard_for_customer(self.customer_id))
+        super().create()
+        self.forget_customer(self.customer_id)
+
+    @classmethod
+    @traced
+    def create_many(cls, carts):
+        """Creates many Shopcarts with multi-row inserts, one transaction per shard
+
+        Args:
+            carts (list): dictionaries with a customer_id and a list of items
+        Returns the serialized Shopcart created for each entry of carts, or None
+        where the customer already has a shopcart, or an earlier entry is theirs
+        """
+        logger.info("Creating %d shopcarts in bulk ...", len(carts))
+        first = {}
+        for index, cart in enumerate(carts):
+            first.setdefault(cart["customer_id"], index)
+        created = dict(
+            sharding.fan_out_by(
+                first,
+                sharding.shard_for_customer,
+                lambda customer_ids: cls._insert_many([carts[first[key]] for key in customer_ids]),
+            )
+        )
+        for customer_id in created:
+            cls.forget_customer(customer_id)
+        return [
+            created.get(cart["customer_id"]) if first[cart["customer_id"]] == index else None
+            for index, cart in enumerate(carts)
+        ]
+
+    @classmethod
+    def _insert_many(cls, carts):
+        """Inserts the carts of one shard and their items, skipping customers that have one
+
+        Returns (customer_id, serialized Shopcart) of the created carts
+        """
+        try:
+            rows = db.session.execute(
+                insert(cls.__table__)
+                .on_conflict_do_nothing(index_elements=[cls.customer_id])
+                .returning(cls.id, cls.customer_id),
+                [{"customer_id": cart["customer_id"]} for cart in carts],
+            ).all()
+            shopcart_ids = {customer_id: shopcart_id for shopcart_id, customer_id in rows}
+            shopcarts = [
+                {"id": shopcart_ids[cart["customer_id"]], "customer_id": cart["customer_id"],
+                 "items": CartItem.merge_lines(shopcart_ids[cart["customer_id"]], cart["items"])}
+                for cart in carts
+                if cart["customer_id"] in shopcart_ids
+            ]
+            items = [item for shopcart in shopcarts for item in shopcart["items"]]
+            if items:
+                db.session.execute(insert(CartItem.__table__), items)
+            db.session.commit()
+        except (IntegrityError, DataError) as error:
+            db.session.rollback()
+            raise DataValidationError("Invalid Shopcart: " + error.args[0]) from error
+        return [(shopcart["customer_id"], shopcart) for shopcart in shopcarts]
+
+    def update(self):
+        """
+        Updates a Shopcart, forgetting the cached cart of a replaced customer
+        """
+        replaced = inspect(self).attrs.customer_id.history.deleted
+        if replaced:
+            try:
+                self.check_customer(self.customer_id)
+            except DataConflictError:
+                db.session.rollback()
+                raise
+        super().update()
+        for customer_id in (*replaced, self.customer_id):
+            self.forget_customer(customer_id)
+
+    def check_customer(self, customer_id) -> None:
+        """Raises DataConflictError when the cart cannot be given to a customer
+
+        A cart stays on the shard that created it, since its id names that
+        shard, so it can only change hands within the shard.
+        """
+        if sharding.shard_for_customer(customer_id) != sharding.shard_for_shopcart(self.id):
+            raise DataConflictError(
+                f"Shopcart '{self.id}' cannot move to customer '{customer_id}', whose carts live on another shard."
+            )
+
+    def delete(self):
+        """Removes a Shopcart and forgets its customer"""
+        super().delete()
+        self.forget_customer(self.customer_id)
+
+    @traced
+    def merge(self, source) -> None:
+        """Moves the items of another Shopcart into this one and deletes it
+
+        Items of a product in both carts add up their quantities and keep the
+        price of this cart, like adding the item again. On a shared shard the
+        items move with one INSERT ... SELECT whatever their number, in one
+        transaction. Across shards the target commits first, while the source
+        stays locked, and the source is deleted after: a failure in between
+        leaves the items in both carts rather than in neither.
+        """
+        logger.info("Merging shopcart %s into %s", source.id, self.id)
+        source_id, customer_id = source.id, source.customer_id
+        target_shard = sharding.shard_for_shopcart(self.id)
+        source_shard = sharding.shard_for_shopcart(source_id)
+        items = CartItem.__table__
+        columns = [items.c.product_id, items.c.quantity, items.c.price]
+        upsert = insert(items)
+        try:
+            sharding.use_shard(source_shard)
+            # locking the source keeps items from being added to it until it is gone
+            db.session.execute(select(Shopcart.id).where(Shopcart.id == source_id).with_for_update())
+            if source_shard == target_shard:
+                moved = select(literal(self.id), *columns).where(items.c.shopcart_id == source_id)
+                db.session.execute(self.merge_statement(upsert.from_select(
+                    ["shopcart_id", *(column.key for column in columns)], moved
+                )))
+            else:  # the items travel through here and the target commits on its own
+                rows = db.session.execute(select(*columns).where(items.c.shopcart_id == source_id)).mappings()
+                moved = [dict(row, shopcart_id=self.id) for row in rows]
+                if moved:
+                    with db.engines[sharding.bind_key(target_shard)].begin() as connection:
+                        connection.execute(self.merge_statement(upsert.values(moved)))
+            db.session.execute(delete(Shopcart.__table__).where(Shopcart.id == source_id))
+            db.session.commit()
+        except (IntegrityError, DataError) as error:
+            db.session.rollback()
+            raise DataValidationError("Invalid Shopcart: " + error.args[0]) from error
+        finally:
+            sharding.use_shard(target_shard)
+        self.forget_customer(customer_id)
+
+    @staticmethod
+    def merge_statement(upsert):
+        """Returns an INSERT of items that adds to the quantity of the products already in the cart"""
+        items = CartItem.__table__
+        return upsert.on_conflict_do_update(
+            index_elements=[items.c.shopcart_id, items.c.product_id],
+            set_={"quantity": items.c.quantity + upsert.excluded.quantity},
+        )
+
+    @classmethod
+    @traced
+    def purge_expired(  # pylint: disable=too-many-arguments
+        cls, ttl, batch_size=500, pause=0.0, progress=None, tombstone_ttl=None
+    ) -> dict:
+        """Deletes the Shopcarts that did not change for ttl, on every shard
+
+        Args:
+            ttl (timedelta): how long a cart lives after its last change
+            batch_size (Integer): the most carts deleted by one short transaction
+            pause (Float): the seconds to wait between two batches of a shard
+            progress (callable): called with the number of carts of each batch
+            tombstone_ttl (timedelta): how long the change feed keeps deleted carts
+        Returns the number of carts and tombstones deleted, the seconds it took, and the lag:
+        how many seconds past its expiry the oldest cart was when the sweep began
+        """
+        logger.info("Purging the shopcarts unchanged for %s ...", ttl)
+        start = time.monotonic()
+        results = sharding.fan_out(lambda: [cls._purge_on_shard(ttl, batch_size, pause, progress, tombstone_ttl)])
+        return {
+            "carts": sum(carts for carts, _, _ in results),
+            "tombstones": sum(tombstones for _, _, tombstones in results),
+            "seconds": time.monotonic() - start,
+            "lag": max(lag for _, lag, _ in results),
+        }
+
+    @classmethod
+    def _purge_on_shard(cls, ttl, batch_size, pause, progress, tombstone_ttl):  # pylint: disable=too-many-arguments
+        """Deletes the expired carts of one shard in batches, oldest first; their items go by CASCADE"""
+        tombstones = 0
+        if tombstone_ttl is not None:
+            tombstones = db.session.execute(
+                delete(shopcart_tombstone).where(shopcart_tombstone.c.deleted_at < db.func.now() - literal(tombstone_ttl))
+            ).rowcount
+            db.session.commit()
+        cutoff, oldest = db.session.execute(
+            select(db.func.now() - literal(ttl), select(db.func.min(cls.updated_at)).scalar_subquery())
+        ).one()
+        lag = max((cutoff - oldest).total_seconds(), 0.0) if oldest else 0.0
+        deleted, after = 0, None
+        while True:
+            expired = select(cls.id).where(cls.updated_at < cutoff)
+            if after is not None:
+                expired = expired.where(tuple_(cls.updated_at, cls.id) > after)
+            # carts locked by a request are left for the next sweep
+            expired = expired.order_by(cls.updated_at, cls.id).limit(batch_size).with_for_update(skip_locked=True)
+            rows = db.session.execute(
+                delete(cls.__table__)
+                .where(cls.id.in_(expired.scalar_subquery()))
+                .returning(cls.id, cls.customer_id, cls.updated_at)
+            ).all()
+            db.session.commit()
+            for row in rows:
+                cls.forget_customer(row.customer_id)
+            deleted += len(rows)
+            if progress and rows:
+                progress(len(rows))
+            if len(rows) < batch_size:
+                return deleted, lag, tombstones
+            after = max((row.updated_at, row.id) for row in rows)
+            time.sleep(pause)
+
+    @classmethod
+    @traced
+    def changes_since(cls, after, limit, with_items=True):
+        """Returns the changes made to the Shopcarts after a cursor, on every shard
+
+        A change is the current state of a cart, or a tombstone once it was
+        deleted; a cart changed many times shows up once, with its last change.
+
+        Args:
+            after (list): the (change_seq, id) of the last change seen on each shard
+            limit (Integer): the most changes returned
+            with_items (bool): whether the carts come with their items
+        Returns the changes, the cursor after them and whether there are more
+        """
+        logger.info("Processing changes since %s ...", after)
+        calls = {shard: (tuple(keys), limit, with_items) for shard, keys in enumerate(after)}
+        results = sharding.run_on_shards(cls._changes_on_shard, calls)
+        changes = [change for changes_of_shard, _ in results for change in changes_of_shard]
+        by_shard = {}
+        for change_seq, change in changes:
+            by_shard.setdefault(sharding.shard_for_shopcart(change["id"]), []).append((change_seq, change))
+        # take turns between the shards so that none of them falls behind
+        page = [change for changes_at in zip_longest(*by_shard.values()) for change in changes_at if change][:limit]
+        after = [list(keys) for keys in after]
+        for change_seq, change in page:
+            after[sharding.shard_for_shopcart(change["id"])] = [change_seq, change["id"]]
+        more = len(changes) > len(page) or any(more for _, more in results)
+        return [change for _, change in page], after, more
+
+    @classmethod
+    def _changes_on_shard(cls, after, limit, with_items):
+        """Returns [(changes, more)]: up to limit (change_seq, change) of one shard in the order they were made
+
+        Only transactions that ended before the query show up, so one that
+        commits late cannot land behind a cursor that was already handed out.
+        more comes from the rows read, before the carts deleted since are
+        dropped, so a dropped cart cannot hide the changes after it.
+        """
+        tombstones = shopcart_tombstone.c
+        keys = union_all(
+            select(cls.change_seq, cls.id, cls.customer_id, cls.updated_at.label("changed_at"), false().label("deleted"))
+            .where(tuple_(cls.change_seq, cls.id) > after, cls.change_seq < VISIBLE_XACT_ID)
+            .order_by(cls.change_seq, cls.id)
+            .limit(limit + 1),
+            select(
+                tombstones.change_seq, tombstones.shopcart_id, tombstones.customer_id, tombstones.deleted_at, true()
+            )
+            .where(tuple_(tombstones.change_seq, tombstones.shopcart_id) > after, tombstones.change_seq < VISIBLE_XACT_ID)
+            .order_by(tombstones.change_seq, tombstones.shopcart_id)
+            .limit(limit + 1),
+        ).subquery()
+        rows = db.session.execute(select(keys).order_by(keys.c.change_seq, keys.c.id).limit(limit + 1)).all()
+        live = [row.id for row in rows if not row.deleted]
+        carts = {}
+        if live:
+            query = cls.query.filter(cls.id.in_(live)).options(cls.items_loader(with_items))
+            carts = {cart.id: cart.serialize() for cart in query}
+        changes = []
+        for row in rows:
+            if row.deleted or row.id in carts:  # a cart deleted since shows up later as a tombstone
+                change = {
+                    "id": row.id,
+                    "customer_id": row.customer_id,
+                    "deleted": row.deleted,
+                    "changed_at": row.changed_at,
+                    "shopcart": carts.get(row.id),
+                }
+                changes.append((row.change_seq, change))
+        return [(changes[:limit], len(rows) > limit)]
+
     def clear_items(self) -> None:
         """
         Deletes all CartItems in the shopcart
@@ -267,32 +847,175 @@ class Shopcart(db.Model, PersistentBase):
             item.delete()
 
     @classmethod
-    def find_shopcart_by_customer_id(cls, customer_id):
+    @traced
+    def find_shopcart_by_customer_id(cls, customer_id, with_items=True):
         """Returns shopcart with the given customer_id
 
         Args:
             customer_id (Integer): the id of the customer you want to match
+            with_items (bool): False to skip loading the items
         """
         logger.info("Processing customer id query for %s ...", customer_id)
-        return cls.query.filter(cls.customer_id == customer_id).all()
+        sharding.use_shard(sharding.shard_for_customer(customer_id))
+        query = cls.query.filter(cls.customer_id == customer_id)
+        return query.options(cls.items_loader(with_items)).all()
+
+    @classmethod
+    @traced
+    def find_by_customer_id(cls, customer_id, with_items=True):
+        """Returns the shopcart of a customer or None, remembering the answer
+
+        Args:
+            customer_id (Integer): the id of the customer you want to match
+            with_items (bool): False to skip loading the items
+        """
+        if customer_id in cls.customers_without_cart:
+            return None
+        shopcart_id = cls.customer_cart_ids.get(customer_id)
+        if shopcart_id is not None:
+            shopcart = cls.find(shopcart_id, with_items)
+            # another worker may have deleted or reassigned the cart
+            if shopcart and shopcart.customer_id == customer_id:
+                return shopcart
+        shopcarts = cls.find_shopcart_by_customer_id(customer_id, with_items)
+        if not shopcarts:
+            cls.customer_cart_ids.discard(customer_id)
+            cls.customers_without_cart.add(customer_id)
+            return None
+        cls.customer_cart_ids.put(customer_id, shopcarts[0].id)
+        return shopcarts[0]
+
+    @classmethod
+    @traced
+    def find_by_ids(cls, ids, with_items=True):
+        """Returns the Shopcarts with the given ids with one query per shard
+
+        Args:
+            ids (list): the ids of the shopcarts you want to match
+            with_items (bool): False to skip loading the items
+        """
+        logger.info("Processing lookup for %d shopcart ids ...", len(ids))
+        return sharding.fan_out_by(
+            ids, sharding.shard_for_shopcart, cls._find_in(cls.id, with_items)
+        )
+
+    @classmethod
+    @traced
+    def find_by_customer_ids(cls, customer_ids, with_items=True):
+        """Returns the Shopcarts of the given customers with one query per shard
+
+        Args:
+            customer_ids (list): the ids of the customers you want to match
+            with_items (bool): False to skip loading the items
+        """
+        logger.info("Processing lookup for %d customer ids ...", len(customer_ids))
+        return sharding.fan_out_by(
+            customer_ids,
+            sharding.shard_for_customer,
+            cls._find_in(cls.customer_id, with_items),
+        )
+
+    @classmethod
+    def _find_in(cls, column, with_items):
+        """Returns a query of the Shopcarts whose column is in a list"""
+        loader = cls.items_loader(with_items)
+        return lambda keys: cls.query.filter(column.in_(keys)).options(loader).all()
+
+    @classmethod
+    def items_loader(cls, with_items):
+        """Returns the loader option that loads the items with one query, or never"""
+        return selectinload(cls.items) if with_items else noload(cls.items)
+
+    @classmethod
+    def forget_customer(cls, customer_id):
+        """Drops a customer from the customer caches"""
+        cls.customer_cart_ids.discard(customer_id)
+        cls.customers_without_cart.discard(customer_id)
+
+    @classmethod
+    @traced
+    def find_for_update(cls, by_id):
+        """Finds a Shopcart and its items, locking the cart until the transaction ends"""
+        logger.info("Processing lookup for id %s for update ...", by_id)
+        sharding.use_shard(sharding.shard_for_shopcart(by_id))
+        query = cls.query.options(selectinload(cls.items)).filter(cls.id == by_id)
+        return query.with_for_update(of=cls).first()
+
+    @traced
+    def apply_operations(self, operations) -> list:
+        """Applies item operations in order and commits them all in one transaction
+
+        Args:
+            operations (list): (op, data) pairs with op add, update or delete and
+            data a validated item body; add adds to the quantity of an item
+            already in the cart, and update sets new_quantity and/or new_price
+        Returns the serialized item after each operation, or None when there is none
+        """
+        logger.info("Applying %d operations to shopcart %s", len(operations), self.id)
+        items = {item.product_id: item for item in self.items}
+        results = []
+        try:
+            for operation, data in operations:
+                item = items.get(data["product_id"])
+                if operation == "add" and item:
+                    item.quantity += data["quantity"]
+                elif operation == "add":
+                    item = CartItem().deserialize(dict(data, shopcart_id=self.id, price=float(data["price"])))
+                    self.items.append(item)
+                    items[item.product_id] = item
+                elif operation == "update" and item:
+                    item.quantity = data.get("new_quantity", item.quantity)
+                    item.price = float(data.get("new_price", item.price))
+                elif operation == "delete" and item:
+                    self.items.remove(item)
+                    if inspect(item).pending:  # added earlier in this batch
+                        db.session.expunge(item)
+                    else:
+                        db.session.delete(item)
+                    del items[item.product_id]
+                    item = None
+                results.append(item.serialize() if item else None)
+            db.session.commit()
+        except (IntegrityError, DataError) as error:
+            db.session.rollback()
+            raise DataValidationError("Invalid CartItem: " + error.args[0]) from error
+        return results
 
     @classmethod
-    def find_shopcarts_with_product_id(cls, product_id):
+    def find(cls, by_id, with_items=True):
+        """Finds a Shopcart by it's ID on the shard that created it"""
+        sharding.use_shard(sharding.shard_for_shopcart(by_id))
+        if with_items:
+            return super().find(by_id)
+        logger.info("Processing lookup for id %s without items ...", by_id)
+        return cls.query.options(noload(cls.items)).filter(cls.id == by_id).first()
+
+    @classmethod
+    @traced
+    def all(cls, with_items=True):
+        """Returns all of the Shopcarts on every shard"""
+        logger.info("Processing all records")
+        loader = cls.items_loader(with_items)
+        shopcarts = sharding.fan_out(lambda: cls.query.options(loader).all())
+        return sorted(shopcarts, key=lambda shopcart: shopcart.id)
+
+    @classmethod
+    @traced
+    def find_shopcarts_with_product_id(cls, product_id, with_items=True):
         """
         Returns a list of Shopcarts that contain a specific product_id
 
         Args:
         product_id (int): The product ID to search for
+        with_items (bool): False to skip loading the items
         """
         logger.info(
             "Processing query for shopcarts containing product %s ...", product_id
         )
-        # Query the CartItem table for all items with the given product_id
-        cart_items = CartItem.query.filter(CartItem.product_id == product_id).all()
-
-        # Extract shopcart_ids from the CartItems
-        shopcart_ids = [item.shopcart_id for item in cart_items]
-
-        # Query the Shopcart table for all shopcarts with the extracted shopcart_ids
-        shopcarts = cls.query.filter(cls.id.in_(shopcart_ids)).all()
-        return shopcarts
+        # Every shard looks for the shopcarts holding an item with the product_id
+        shopcarts = sharding.fan_out(
+            lambda: cls.query.filter(cls.items.any(CartItem.product_id == product_id))
+            .options(cls.items_loader(with_items))
+            .all()
+        )
+        return sorted(shopcarts, key=lambda shopcart: shopcart.id)
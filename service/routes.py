@@ -1,11 +1,17 @@
 """
 Shopcart API Service with Swagger
 """
+# pylint: disable=too-many-lines
 
+import json
+import base64
+import binascii
 from flask import jsonify, request, abort
-from flask_restx import Resource, fields, reqparse
-from service.models import CartItem, Shopcart
-from service.common import status  # HTTP Status Codes
+from flask_restx import Resource, fields, inputs, reqparse
+from service.models import CartItem, Shopcart, DataValidationError
+from service.common import (  # HTTP Status Codes
+    status, tracing, profiling, compression, validation, messagepack, routing
+)
 from . import app, api  # Import Flask application
 
 
@@ -19,13 +25,21 @@ cartItem_model = api.model(
         "shopcart_id": fields.Integer(
             required=True, description="The id of the shopcart that contains the item"
         ),
-        "price": fields.Float(required=True, description="The price of the item"),
+        "price": fields.Float(required=True, min=0, description="The price of the item"),
         "quantity": fields.Integer(
-            required=True, description="The quantity of the item"
+            required=True, min=1, description="The quantity of the item"
         ),
     },
 )
 
+update_item_model = api.model(
+    "CartItemUpdate",
+    {
+        "new_quantity": fields.Integer(min=1, description="The new quantity of the item"),
+        "new_price": fields.Float(min=0, description="The new price of the item"),
+    },
+)
+
 create_shopcart_model = api.model(
     "Shopcart",
     {
@@ -50,7 +64,174 @@ shopcart_model = api.inherit(
     },
 )
 
-shopcart_args = reqparse.RequestParser()
+lookup_model = api.model(
+    "ShopcartLookup",
+    {
+        "ids": fields.List(fields.Integer, description="The shopcart ids to fetch"),
+        "customer_ids": fields.List(
+            fields.Integer, description="The customer ids whose shopcarts to fetch"
+        ),
+    },
+)
+
+lookup_result_model = api.model(
+    "ShopcartLookupResult",
+    {
+        "shopcarts": fields.List(
+            fields.Nested(shopcart_model), description="The shopcarts found, in request order"
+        ),
+        "missing": fields.List(
+            fields.Integer, description="The requested ids that have no shopcart"
+        ),
+    },
+)
+
+delete_items_model = api.model(
+    "CartItemDelete",
+    {
+        "product_ids": fields.List(fields.Integer, description="The ids of the products to delete"),
+    },
+)
+
+operation_key_model = api.model(
+    "CartItemOperationKey",
+    {
+        "op": fields.String(
+            required=True, enum=["add", "update", "delete"], description="What to do with the item"
+        ),
+        "product_id": fields.Integer(required=True, description="The id of the item"),
+    },
+)
+
+operation_model = api.inherit(
+    "CartItemOperation",
+    operation_key_model,
+    {
+        "quantity": fields.Integer(min=1, description="add: the quantity to add, 1 by default"),
+        "price": fields.Float(min=0, description="add: the price of the item"),
+        "new_quantity": fields.Integer(min=1, description="update: the new quantity of the item"),
+        "new_price": fields.Float(min=0, description="update: the new price of the item"),
+    },
+)
+
+operation_result_model = api.model(
+    "CartItemOperationResult",
+    {
+        "index": fields.Integer(description="The position of the operation in the request"),
+        "op": fields.String(description="The operation"),
+        "status": fields.Integer(description="The status the single item endpoint would answer"),
+        "item": fields.Nested(cartItem_model, allow_null=True, description="The item afterwards"),
+    },
+)
+
+operations_result_model = api.model(
+    "CartItemOperationsResult",
+    {
+        "shopcart": fields.Nested(shopcart_model, description="The shopcart after the operations"),
+        "results": fields.List(fields.Nested(operation_result_model), description="In request order"),
+    },
+)
+
+product_price_model = api.model(
+    "ProductPrice",
+    {
+        "price": fields.Float(required=True, min=0, description="The new price of the product"),
+    },
+)
+
+product_price_result_model = api.inherit(
+    "ProductPriceResult",
+    product_price_model,
+    {
+        "product_id": fields.Integer(description="The id of the repriced product"),
+        "shopcarts": fields.Integer(description="How many shopcarts had their price changed"),
+    },
+)
+
+bulk_element_model = api.model(
+    "ShopcartBulkElement",
+    {
+        "index": fields.Integer(description="The position of the shopcart in the request"),
+        "status": fields.Integer(description="201 when created, 409 when the customer has a shopcart"),
+        "shopcart": fields.Nested(shopcart_model, description="The created shopcart"),
+        "message": fields.String(description="Why the shopcart was not created"),
+    },
+)
+
+bulk_result_model = api.model(
+    "ShopcartBulkResult",
+    {
+        "created": fields.Integer(description="How many shopcarts were created"),
+        "conflicts": fields.Integer(description="How many customers already had a shopcart"),
+        "results": fields.List(
+            fields.Nested(bulk_element_model), description="The outcome of each shopcart, in request order"
+        ),
+    },
+)
+
+change_model = api.model(
+    "ShopcartChange",
+    {
+        "id": fields.Integer(description="The id of the changed shopcart"),
+        "customer_id": fields.Integer(description="The customer of the shopcart"),
+        "deleted": fields.Boolean(description="True when the shopcart was deleted"),
+        "changed_at": fields.DateTime(description="When the shopcart last changed or was deleted"),
+        "shopcart": fields.Nested(
+            shopcart_model, allow_null=True, description="The shopcart as it is now, null once deleted"
+        ),
+    },
+)
+
+changes_model = api.model(
+    "ShopcartChanges",
+    {
+        "changes": fields.List(fields.Nested(change_model), description="The changes after the cursor"),
+        "cursor": fields.String(description="Pass as ?since= to get the changes after these"),
+        "more": fields.Boolean(description="True when more changes are waiting"),
+    },
+)
+
+
+def id_list(value):
+    """Parses a comma separated list of ids"""
+    try:
+        return [int(number) for number in value.split(",") if number.strip()]
+    except ValueError as error:
+        raise ValueError("must be a comma separated list of integers") from error
+
+
+shopcart_fields_args = reqparse.RequestParser()
+shopcart_fields_args.add_argument(
+    "fields",
+    type=str,
+    location="args",
+    required=False,
+    help="Comma separated Shopcart fields to return (id, customer_id, items)",
+)
+shopcart_fields_args.add_argument(
+    "include_items",
+    type=inputs.boolean,
+    location="args",
+    required=False,
+    default=True,
+    help="Set to false to leave out the items",
+)
+
+shopcart_args = shopcart_fields_args.copy()
+shopcart_args.add_argument(
+    "ids",
+    type=id_list,
+    location="args",
+    required=False,
+    help="Fetch Shopcarts by a comma separated list of ids",
+)
+shopcart_args.add_argument(
+    "customer_ids",
+    type=id_list,
+    location="args",
+    required=False,
+    help="Fetch Shopcarts by a comma separated list of customer ids",
+)
 shopcart_args.add_argument(
     "product_id",
     type=int,
@@ -74,6 +255,127 @@ cartItem_args.add_argument(
     required=False,
     help="Filter items by product_id",
 )
+cartItem_args.add_argument(
+    "product_ids",
+    type=id_list,
+    location="args",
+    required=False,
+    help="Filter items by a comma separated list of product ids",
+)
+cartItem_args.add_argument(
+    "min_price",
+    type=float,
+    location="args",
+    required=False,
+    help="Filter items with at least this price",
+)
+cartItem_args.add_argument(
+    "max_price",
+    type=float,
+    location="args",
+    required=False,
+    help="Filter items with at most this price",
+)
+cartItem_args.add_argument(
+    "min_quantity",
+    type=int,
+    location="args",
+    required=False,
+    help="Filter items with at least this quantity",
+)
+cartItem_args.add_argument(
+    "max_quantity",
+    type=int,
+    location="args",
+    required=False,
+    help="Filter items with at most this quantity",
+)
+cartItem_args.add_argument(
+    "sort",
+    type=str,
+    location="args",
+    required=False,
+    default="product_id",
+    choices=("product_id", "-product_id", "price", "-price", "quantity", "-quantity"),
+    help="Sort items by product_id, price or quantity; prefix with - for descending",
+)
+cartItem_args.add_argument(
+    "limit",
+    type=inputs.int_range(1, 1000),
+    location="args",
+    required=False,
+    help="Return at most this many items and an X-Next-Cursor header for the rest",
+)
+cartItem_args.add_argument(
+    "cursor",
+    type=str,
+    location="args",
+    required=False,
+    help="The X-Next-Cursor of the previous page",
+)
+
+changes_args = reqparse.RequestParser()
+changes_args.add_argument(
+    "since",
+    type=str,
+    location="args",
+    required=False,
+    help="The cursor of the last page seen; leave out to start from the beginning",
+)
+changes_args.add_argument(
+    "limit",
+    type=inputs.int_range(1, 1000),
+    location="args",
+    required=False,
+    default=100,
+    help="Return at most this many changes",
+)
+changes_args.add_argument(
+    "include_items",
+    type=inputs.boolean,
+    location="args",
+    required=False,
+    default=True,
+    help="Set to false to leave out the items",
+)
+
+delete_items_args = reqparse.RequestParser()
+delete_items_args.add_argument(
+    "product_ids",
+    type=id_list,
+    location="args",
+    required=False,
+    help="Delete the products of a comma separated list of product ids",
+)
+
+# Compiled from the parsers and models above, these check every request
+shopcart_fields_query = validation.QueryValidator(shopcart_fields_args)
+shopcart_query = validation.QueryValidator(shopcart_args)
+cartItem_query = validation.QueryValidator(cartItem_args)
+changes_query = validation.QueryValidator(changes_args)
+shopcart_body = validation.BodyValidator(create_shopcart_model, required=("customer_id",))
+cartItem_body = validation.BodyValidator(
+    cartItem_model, required=("product_id", "price"), defaults={"quantity": 1}
+)
+update_item_body = validation.BodyValidator(
+    update_item_model,
+    messages={
+        "new_quantity": "Quantity must be a positive integer.",
+        "new_price": "Price must be a non-negative number.",
+    },
+    coerce=True,
+)
+lookup_body = validation.BodyValidator(lookup_model)
+delete_items_query = validation.QueryValidator(delete_items_args)
+delete_items_body = validation.BodyValidator(delete_items_model)
+product_price_body = validation.BodyValidator(product_price_model)
+operation_body = validation.BodyValidator(operation_key_model)
+# Rows of bulk import files, whose numbers may be strings and "" is missing;
+# items are checked one by one, so import_cart_row only ever sees customer_id
+import_cart_row = validation.BodyValidator(create_shopcart_model, required=("customer_id",), coerce=True)
+import_item_row = validation.BodyValidator(
+    cartItem_model, required=("product_id", "price"), defaults={"quantity": 1}, coerce=True
+)
 
 
 ############################################################
@@ -85,13 +387,83 @@ def health():
     return jsonify(status="OK"), status.HTTP_200_OK
 
 
+############################################################
+# Debug Endpoints
+############################################################
+@app.route("/debug/traces")
+def list_traces():
+    """Returns the recent spans held by the in-memory trace exporter"""
+    check_debug_enabled()
+    exporter = tracing.get_exporter()
+    if not isinstance(exporter, tracing.MemoryExporter):
+        abort(status.HTTP_404_NOT_FOUND, "The in-memory trace exporter is not enabled.")
+
+    trace_id = request.args.get("trace_id")
+    limit = request.args.get("limit", type=int)
+    return jsonify(exporter.find(trace_id, limit)), status.HTTP_200_OK
+
+
+@app.route("/debug/memory/start", methods=["POST"])
+def start_memory_profiling():
+    """Starts tracing allocations on this worker with tracemalloc"""
+    check_debug_enabled()
+    frames = request.args.get("frames", 1, type=int)
+    profiling.start(frames)
+    app.logger.info("Started tracemalloc with %d frames", frames)
+    return jsonify(profiling.worker_stats()), status.HTTP_200_OK
+
+
+@app.route("/debug/memory/stop", methods=["POST"])
+def stop_memory_profiling():
+    """Stops tracing allocations on this worker"""
+    check_debug_enabled()
+    profiling.stop()
+    app.logger.info("Stopped tracemalloc")
+    return jsonify(profiling.worker_stats()), status.HTTP_200_OK
+
+
+@app.route("/debug/memory/snapshot")
+def take_memory_snapshot():
+    """Returns the top allocation sites and the diff to the previous snapshot"""
+    check_debug_enabled()
+    if not profiling.is_tracing():
+        abort(
+            status.HTTP_409_CONFLICT,
+            "Memory profiling is not running. POST /debug/memory/start first.",
+        )
+    limit = request.args.get("limit", 20, type=int)
+    key_type = request.args.get("key_type", "lineno")
+    try:
+        snapshot = profiling.take_snapshot(limit, key_type)
+    except ValueError as error:
+        abort(status.HTTP_400_BAD_REQUEST, str(error))
+    return jsonify(snapshot), status.HTTP_200_OK
+
+
+############################################################
+# Metrics Endpoint
+############################################################
+@app.route("/metrics")
+def metrics():
+    """Returns the memory, replica and cache stats of the worker"""
+    replicas = app.extensions["replica_router"].stats()
+    caches = {
+        "customer_cart_ids": Shopcart.customer_cart_ids.stats(),
+        "customers_without_cart": Shopcart.customers_without_cart.stats(),
+    }
+    return (
+        jsonify(worker=profiling.worker_stats(), replicas=replicas, caches=caches),
+        status.HTTP_200_OK,
+    )
+
+
 ######################################################################
 # GET INDEX
 ######################################################################
 @app.route("/")
 def index():
     """Root URL response"""
-    return app.send_static_file("index.html")
+    return compression.send_static("index.html")
 
 
 ######################################################################
@@ -118,7 +490,7 @@ class ShopcartCollection(Resource):
         check_content_type("application/json")
 
         shopcart = Shopcart()
-        shopcart.deserialize(api.payload)
+        shopcart.deserialize(shopcart_body.validate(messagepack.request_payload()))
         shopcart.create()
 
         # Create a message to return
@@ -134,8 +506,8 @@ class ShopcartCollection(Resource):
     ######################################################################
     @api.doc("list_shopcarts")
     @api.expect(shopcart_args, validate=True)
+    @api.response(200, "Success", [shopcart_model])
     @api.response(404, "No shopcart found")
-    @api.marshal_list_with(shopcart_model)
     def get(self):
         """
         If there is shopcart query, return the queried shopcart
@@ -148,21 +520,173 @@ class ShopcartCollection(Resource):
         shopcarts = []
 
         # process the query string if any
-        args = shopcart_args.parse_args()
+        args = shopcart_query.parse()
         customer_id = args["customer_id"]
         product_id = args["product_id"]
+        mask, with_items = requested_fields(args)
+
+        # Fetch many carts at once, listing the ids that were not found
+        lookup = lookup_args(args)
+        if lookup:
+            results, missing = lookup_shopcarts(*lookup, with_items)
+            headers = {"X-Missing-Ids": ",".join(map(str, missing))}
+            return api.marshal(results, shopcart_model, mask=mask), status.HTTP_200_OK, headers
 
         # The customer is unique
         if customer_id:
-            shopcarts = Shopcart.find_shopcart_by_customer_id(customer_id)
+            shopcarts = Shopcart.find_shopcart_by_customer_id(customer_id, with_items)
         elif product_id:
-            shopcarts = Shopcart.find_shopcarts_with_product_id(product_id)
+            shopcarts = Shopcart.find_shopcarts_with_product_id(product_id, with_items)
         else:
-            shopcarts = Shopcart.all()
+            shopcarts = Shopcart.all(with_items)
 
         results = [shopcart.serialize() for shopcart in shopcarts]
         app.logger.info("Return %d shopcart in total.", len(results))
-        return results, status.HTTP_200_OK
+        return api.marshal(results, shopcart_model, mask=mask), status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /api/shopcarts/lookup
+######################################################################
+@api.route("/shopcarts/lookup", strict_slashes=False)
+class ShopcartLookup(Resource):
+    """
+    Allows fetching many shopcarts with one request
+    """
+
+    ######################################################################
+    #  FETCH SHOPCARTS BY IDS OR CUSTOMER IDS
+    ######################################################################
+    @api.doc("lookup_shopcarts")
+    @api.response(200, "Success", lookup_result_model)
+    @api.response(400, "The posted data was not valid")
+    @api.expect(lookup_model, shopcart_fields_args)
+    def post(self):
+        """
+        Fetch the shopcarts with the posted ids or customer ids
+
+        The body holds either a list of ids or a list of customer_ids, which
+        may be too long for a query string
+        """
+        app.logger.info("Request to look up many shopcarts")
+        check_content_type("application/json")
+
+        data = lookup_body.validate(messagepack.request_payload())
+        if ("ids" in data) == ("customer_ids" in data):
+            abort(status.HTTP_400_BAD_REQUEST, "Provide either ids or customer_ids.")
+        by_customer = "customer_ids" in data
+        keys = data["customer_ids"] if by_customer else data["ids"]
+
+        mask, with_items = requested_fields()
+        results, missing = lookup_shopcarts(keys, by_customer, with_items)
+        result = {
+            "shopcarts": api.marshal(results, shopcart_model, mask=mask),
+            "missing": missing,
+        }
+        return result, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /api/shopcarts/changes
+######################################################################
+@api.route("/shopcarts/changes", strict_slashes=False)
+class ShopcartChanges(Resource):
+    """
+    Allows following the changes made to the shopcarts
+    """
+
+    ######################################################################
+    #  LIST THE CHANGES AFTER A CURSOR
+    ######################################################################
+    @api.doc("list_shopcart_changes")
+    @api.expect(changes_args, validate=True)
+    @api.response(400, "The cursor was not valid")
+    @api.marshal_with(changes_model)
+    def get(self):
+        """
+        Return the shopcarts changed or deleted after a cursor
+
+        Each page lists the carts changed since the last one, in the order
+        the changes were made, and a cursor to pass as ?since= for the next
+        page. Syncing costs as much as the changes, not the whole table.
+        Deleted carts show up as tombstones for CHANGE_TOMBSTONE_DAYS.
+        """
+        app.logger.info("Request for the shopcart changes")
+        args = changes_query.parse()
+        shards = app.extensions["shard_map"].count
+        after = [[0, 0]] * shards
+        if args["since"]:
+            keys = decode_cursor(args["since"])
+            if len(keys) != 2 * shards:
+                abort(status.HTTP_400_BAD_REQUEST, "The cursor is not valid.")
+            after = [keys[shard * 2:shard * 2 + 2] for shard in range(shards)]
+
+        # the keys of a page and the carts must come from the same database
+        routing.use_primary()
+        changes, after, more = Shopcart.changes_since(after, args["limit"], args["include_items"])
+        app.logger.info("Return %d shopcart changes.", len(changes))
+        cursor = encode_cursor([key for keys in after for key in keys])
+        return {"changes": changes, "cursor": cursor, "more": more}, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /api/shopcarts/bulk
+######################################################################
+@api.route("/shopcarts/bulk", strict_slashes=False)
+class ShopcartBulk(Resource):
+    """
+    Allows creating many shopcarts with one request
+    """
+
+    ######################################################################
+    #  CREATE MANY SHOPCARTS
+    ######################################################################
+    @api.doc("create_shopcarts_in_bulk")
+    @api.response(200, "Success", bulk_result_model)
+    @api.response(400, "The posted data was not valid")
+    @api.response(415, "Invalid header content-type")
+    @api.expect([create_shopcart_model])
+    def post(self):
+        """
+        Creates the shopcarts of many customers
+
+        The carts and their items are inserted with multi-row inserts in one
+        transaction per shard. A customer who already has a shopcart, or
+        appears earlier in the list, is reported with status 409 in the
+        results instead of failing the whole request.
+        """
+        app.logger.info("Request to create shopcarts in bulk")
+        check_content_type("application/json")
+
+        data = messagepack.request_payload()
+        if not isinstance(data, list):
+            abort(status.HTTP_400_BAD_REQUEST, "The body must be a list of shopcarts.")
+        if len(data) > app.config["BULK_MAX_SHOPCARTS"]:
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                f"At most {app.config['BULK_MAX_SHOPCARTS']} shopcarts can be created at once.",
+            )
+        carts = [shopcart_body.validate(cart, f"[{position}].") for position, cart in enumerate(data)]
+        for cart in carts:
+            cart.setdefault("items", [])
+
+        results = []
+        for position, shopcart in enumerate(Shopcart.create_many(carts)):
+            if shopcart is None:
+                results.append({
+                    "index": position,
+                    "status": status.HTTP_409_CONFLICT,
+                    "message": "Duplicate Shopcart: Shopcart for customer already exists",
+                })
+            else:
+                results.append({"index": position, "status": status.HTTP_201_CREATED, "shopcart": shopcart})
+        created = sum(result["status"] == status.HTTP_201_CREATED for result in results)
+        app.logger.info("Created %d of %d shopcarts", created, len(results))
+        return {
+            "created": created,
+            "conflicts": len(results) - created,
+            "results": results,
+        }, status.HTTP_200_OK
 
 
 ######################################################################
@@ -179,29 +703,32 @@ class ShopcartResource(Resource):
     #  GET A SHOPCART BY ID
     ######################################################################
     @api.doc("get_shopcarts")
+    @api.expect(shopcart_fields_args, validate=True)
+    @api.response(200, "Success", shopcart_model)
     @api.response(404, "Shopcart not found")
-    @api.marshal_with(shopcart_model)
     def get(self, shopcart_id):
         """
         Retrieve a shopcart given a shopcart id
         """
         app.logger.info("Request for Shopcart with id: %s", shopcart_id)
+        mask, with_items = requested_fields()
 
         # See if the shopcart exists and abort if it doesn't
-        shopcart = Shopcart.find(shopcart_id)
+        shopcart = Shopcart.find(shopcart_id, with_items)
         if not shopcart:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"404 Not Found. Shopcart with id '{shopcart_id}' could not be found.",
             )
 
-        return shopcart.serialize(), status.HTTP_200_OK
+        return api.marshal(shopcart.serialize(), shopcart_model, mask=mask), status.HTTP_200_OK
 
     ######################################################################
     #  UPDATE AN EXISTING SHOPCART
     ######################################################################
     @api.doc("update_shopcarts")
     @api.response(404, "Shopcart not found")
+    @api.response(409, "The new customer's carts live on another shard")
     @api.expect(shopcart_model)
     @api.marshal_with(shopcart_model)
     def put(self, shopcart_id):
@@ -211,7 +738,7 @@ class ShopcartResource(Resource):
         app.logger.info("Request to edit a shopcart")
         check_content_type("application/json")
 
-        data = api.payload
+        data = shopcart_body.validate(messagepack.request_payload())
         shopcart = Shopcart.find(shopcart_id)
 
         if not shopcart:
@@ -220,6 +747,7 @@ class ShopcartResource(Resource):
                 f"Shopcart with id '{shopcart_id}' could not be found.",
             )
 
+        shopcart.check_customer(data["customer_id"])
         shopcart.clear_items()
         shopcart.deserialize(data)
         shopcart.update()
@@ -284,17 +812,8 @@ class ItemCollection(Resource):
                 f"Shopcart with id '{shopcart_id}' could not be found.",
             )
 
-        data = api.payload
-
-        if "product_id" not in data:
-            abort(
-                status.HTTP_400_BAD_REQUEST,
-                "Field `product_id` missing from request. Could not add item to cart.",
-            )
-
-        # Check if 'quantity' is in the data
-        if "quantity" not in data:
-            data["quantity"] = 1
+        # product_id and price are required, quantity defaults to 1
+        data = cartItem_body.validate(messagepack.request_payload())
 
         # Check if the item already exits in the shopcart
         product_id = data["product_id"]
@@ -334,86 +853,68 @@ class ItemCollection(Resource):
     ######################################################################
     @api.doc("list_cart_items")
     @api.response(404, "items not found")
-    @api.expect(cartItem_args)
+    @api.expect(cartItem_args, validate=True)
     @api.marshal_list_with(cartItem_model)
     def get(self, shopcart_id):
         """
-        If there is a product_id query parameter,
-        return the queried items for the specified shopcart.
-        Else return all items for the specified shopcart.
+        Return the items of the specified shopcart, filtered by the
+        product_id(s), price and quantity ranges in the query, sorted and
+        optionally paginated with limit and cursor.
 
         return: a list of items in the specified shopcart
         """
         app.logger.info("Request for cart items for Shopcart with id: %s", shopcart_id)
 
         # See if the shopcart exists and abort if it doesn't
-        shopcart = Shopcart.find(shopcart_id)
+        shopcart = Shopcart.find(shopcart_id, with_items=False)
         if not shopcart:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"Shopcart with id '{shopcart_id}' could not be found.",
             )
 
-        # Get the list of items from the shopcart
-        items = shopcart.items
-
-        # Process query parameters if any
-        args = cartItem_args.parse_args()
-        product_id = args.get("product_id")
-
-        if product_id:
-            # If any product_id does not exist, return a 404
-            if not any(item.product_id == int(product_id) for item in items):
-                abort(
-                    status.HTTP_404_NOT_FOUND,
-                    f"Item with product_id '{product_id}' is not found "
-                    + f"in Shopcart with shopcart_id '{shopcart_id}'.",
-                )
-            # Filter items based on the queried product_ids
-            items = [item for item in items if item.product_id == int(product_id)]
+        # Process query parameters if any, filtering and sorting in the database
+        args = cartItem_query.parse()
+        filters, after = item_filters(args)
+        items, next_after = CartItem.find_by_shopcart_id(
+            shopcart_id, filters, args["sort"], args["limit"], after
+        )
+        check_item_found(shopcart_id, args, items)
 
-        # Serialize the filtered items
+        # Serialize the page, with a cursor to the next one if there is more
         results = [item.serialize() for item in items]
+        headers = {"X-Next-Cursor": encode_cursor(next_after)} if next_after else {}
 
         app.logger.info("Return %d items in the shopcart.", len(results))
-        return results, status.HTTP_200_OK
+        return results, status.HTTP_200_OK, headers
 
     ######################################################################
     #  DELETE ITEMS FROM A SHOPCART
     ######################################################################
     @api.doc("delete_cart_items")
-    @api.response(204, "Products deleted successfully")
-    @api.response(404, "Item not found for deletion")
-    @api.expect(cartItem_args)
+    @api.response(204, "Products deleted, X-Missing-Ids lists those that were not in the shopcart")
+    @api.response(400, "The product ids were not valid")
+    @api.expect(delete_items_model, delete_items_args)
     def delete(self, shopcart_id):
         """
         Delete multiple products from a customer shopcart
 
-        This endpoint will delete multiple products based on the list of
-        product IDs provided in the request body
+        The product ids come from ?product_ids= or a {"product_ids": [...]}
+        body, and are deleted with one statement. The X-Missing-Ids header
+        lists the product ids that were not in the shopcart.
         """
         app.logger.info("Request to delete products for shopcart_id: %s", shopcart_id)
 
-        # Parse the request JSON using the defined parser
-        args = cartItem_args.parse_args()
-        product_ids = args.get("product_ids", [])
+        payload = None
+        if request.content_length:
+            check_content_type("application/json")
+            payload = messagepack.request_payload()
+        product_ids = product_ids_to_delete(delete_items_query.parse(), payload)
 
-        # Iterate through the list of product IDs and delete each product
-        for product_id in product_ids:
-            product = CartItem.find_by_shopcart_id_and_product_id(
-                shopcart_id, product_id
-            )
-            if product:
-                product.delete()
-            else:
-                # If any product_id does not exist, return a 404
-                abort(
-                    status.HTTP_404_NOT_FOUND,
-                    f"Item with product_id '{product_id}' is not found "
-                    + f"in Shopcart with shopcart_id '{shopcart_id}'.",
-                )
-
-        return "", status.HTTP_204_NO_CONTENT
+        deleted = set(CartItem.delete_many(shopcart_id, product_ids)) if product_ids else set()
+        missing = [product_id for product_id in product_ids if product_id not in deleted]
+        app.logger.info("Deleted %d products, %d were missing", len(deleted), len(missing))
+        return "", status.HTTP_204_NO_CONTENT, {"X-Missing-Ids": ",".join(map(str, missing))}
 
 
 ######################################################################
@@ -473,7 +974,7 @@ class ItemResource(Resource):
     @api.response(404, "Shopcart not found")
     @api.response(204, "Item not found in the shopcart")
     @api.response(400, "The posted Item data was not valid")
-    @api.expect(cartItem_model)
+    @api.expect(update_item_model)
     @api.marshal_with(cartItem_model)
     def put(self, shopcart_id, product_id):
         """
@@ -499,28 +1000,8 @@ class ItemResource(Resource):
             # Return a 204 response if the product is not found in the shopcart
             return "", status.HTTP_204_NO_CONTENT
 
-        # Parse the request data using the defined parser
-        data = api.payload
-        new_quantity = data.get("new_quantity", None)
-        new_price = data.get("new_price", None)
-        # If no information is provided, return 400
-        if new_quantity is None and new_price is None:
-            abort(
-                status.HTTP_400_BAD_REQUEST,
-                "Either quantity or price must be provided.",
-            )
-
-        # If only new quantity is provided,
-        if new_quantity is not None and new_quantity != "":
-            # Update the quantity and provide message
-            new_quantity = validate_quantity(new_quantity)
-            cart_item.quantity = new_quantity
-
-        # If only new price is provided,
-        if new_price is not None and new_price != "":
-            # Update the price and provide message
-            new_price = validate_price(new_price)
-            cart_item.price = new_price
+        # Apply the new quantity and/or price from the request data
+        apply_item_changes(cart_item, messagepack.request_payload())
 
         # Update the item information and return
         cart_item.update()
@@ -556,6 +1037,103 @@ class ItemResource(Resource):
         return "", status.HTTP_204_NO_CONTENT
 
 
+######################################################################
+#  PATH: /api/shopcarts/<int:shopcart_id>/operations
+######################################################################
+@api.route("/shopcarts/<int:shopcart_id>/operations", strict_slashes=False)
+@api.param("shopcart_id", "The Shopcart identifier")
+class ItemOperations(Resource):
+    """
+    Allows several item changes to a shopcart in one transaction
+    """
+
+    ######################################################################
+    #  APPLY ITEM OPERATIONS TO A SHOPCART
+    ######################################################################
+    @api.doc("apply_cart_item_operations")
+    @api.response(200, "Success", operations_result_model)
+    @api.response(400, "The posted data was not valid, nothing was changed")
+    @api.response(404, "Shopcart not found")
+    @api.expect([operation_model])
+    def post(self, shopcart_id):
+        """
+        Add, update and delete items of a shopcart in one transaction
+
+        The operations run in order, like POST /items, PUT /items/<product_id>
+        and DELETE /items/<product_id> would, and are committed together. If
+        any operation is invalid, none is applied.
+        """
+        app.logger.info("Request to apply item operations to shopcart_id: %s", shopcart_id)
+        check_content_type("application/json")
+
+        data = messagepack.request_payload()
+        if not isinstance(data, list):
+            abort(status.HTTP_400_BAD_REQUEST, "The body must be a list of operations.")
+        if len(data) > app.config["BATCH_MAX_OPERATIONS"]:
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                f"At most {app.config['BATCH_MAX_OPERATIONS']} operations can be applied at once.",
+            )
+        operations = [validate_operation(position, operation) for position, operation in enumerate(data)]
+
+        shopcart = Shopcart.find_for_update(shopcart_id)
+        if not shopcart:
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                f"Shopcart with id '{shopcart_id}' could not be found.",
+            )
+        items = shopcart.apply_operations(operations)
+
+        results = []
+        for position, ((operation, _), item) in enumerate(zip(operations, items)):
+            code = OPERATION_STATUS[operation] if item else status.HTTP_204_NO_CONTENT
+            results.append({"index": position, "op": operation, "status": code, "item": item})
+        app.logger.info("Applied %d operations to shopcart [%s]", len(results), shopcart_id)
+        return {"shopcart": shopcart.serialize(), "results": results}, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /api/shopcarts/<int:shopcart_id>/merge/<int:source_id>
+######################################################################
+@api.route("/shopcarts/<int:shopcart_id>/merge/<int:source_id>", strict_slashes=False)
+@api.param("shopcart_id", "The Shopcart identifier")
+@api.param("source_id", "The identifier of the Shopcart to merge and delete")
+class ShopcartMerge(Resource):
+    """
+    Allows merging a shopcart into another one
+    """
+
+    ######################################################################
+    #  MERGE A SHOPCART INTO ANOTHER
+    ######################################################################
+    @api.doc("merge_shopcarts")
+    @api.response(400, "A shopcart cannot be merged into itself")
+    @api.response(404, "Shopcart not found")
+    @api.marshal_with(shopcart_model)
+    def post(self, shopcart_id, source_id):
+        """
+        Move the items of a shopcart into another and delete it
+
+        Used when a guest logs in. Items in both carts add up their
+        quantities and keep the price of the target cart.
+        """
+        app.logger.info("Request to merge shopcart %s into %s", source_id, shopcart_id)
+        if shopcart_id == source_id:
+            abort(status.HTTP_400_BAD_REQUEST, "A shopcart cannot be merged into itself.")
+        # the items of the target are only loaded once the merge is done
+        shopcarts = [Shopcart.find(shopcart_id), Shopcart.find(source_id, with_items=False)]
+        for cart_id, shopcart in zip((shopcart_id, source_id), shopcarts):
+            if not shopcart:
+                abort(
+                    status.HTTP_404_NOT_FOUND,
+                    f"Shopcart with id '{cart_id}' could not be found.",
+                )
+        shopcarts[0].merge(shopcarts[1])
+
+        app.logger.info("Shopcart [%s] has been merged into [%s]", source_id, shopcart_id)
+        return shopcarts[0].serialize(), status.HTTP_200_OK
+
+
 ######################################################################
 #  PATH: /api/shopcarts/<int:shopcart_id>/clear
 ######################################################################
@@ -594,43 +1172,236 @@ class ClearItemsInCart(Resource):
         return shopcart.serialize(), status.HTTP_200_OK
 
 
+######################################################################
+#  PATH: /api/customers/<int:customer_id>/shopcart
+######################################################################
+@api.route("/customers/<int:customer_id>/shopcart", strict_slashes=False)
+@api.param("customer_id", "The Customer identifier")
+class CustomerShopcartResource(Resource):
+    """
+    Allows the retrieval of the shopcart of a customer
+    """
+
+    ######################################################################
+    #  GET THE SHOPCART OF A CUSTOMER
+    ######################################################################
+    @api.doc("get_customer_shopcart")
+    @api.expect(shopcart_fields_args, validate=True)
+    @api.response(200, "Success", shopcart_model)
+    @api.response(404, "Shopcart not found")
+    def get(self, customer_id):
+        """
+        Retrieve the shopcart of a customer in one call
+        """
+        app.logger.info("Request for the shopcart of customer: %s", customer_id)
+        mask, with_items = requested_fields()
+
+        shopcart = Shopcart.find_by_customer_id(customer_id, with_items)
+        if not shopcart:
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                f"Customer '{customer_id}' does not have a shopcart.",
+            )
+
+        return api.marshal(shopcart.serialize(), shopcart_model, mask=mask), status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /api/admin/products/<int:product_id>/price
+######################################################################
+@api.route("/admin/products/<int:product_id>/price", strict_slashes=False)
+@api.param("product_id", "The Product identifier")
+class ProductPriceResource(Resource):
+    """
+    Allows repricing a product in every shopcart
+    """
+
+    ######################################################################
+    #  SET THE PRICE OF A PRODUCT IN EVERY SHOPCART
+    ######################################################################
+    @api.doc("set_product_price")
+    @api.response(200, "Success", product_price_result_model)
+    @api.response(400, "The posted data was not valid")
+    @api.response(404, "Admin endpoints are not enabled")
+    @api.expect(product_price_model)
+    def put(self, product_id):
+        """
+        Set the price of a product in every shopcart that holds it
+
+        The carts are updated with set-based UPDATEs of PRICE_UPDATE_BATCH_SIZE
+        carts each, committed one at a time so no lock is held for long.
+        """
+        check_admin_enabled()
+        app.logger.info("Request to set the price of product %s in every shopcart", product_id)
+        check_content_type("application/json")
+
+        price = product_price_body.validate(messagepack.request_payload())["price"]
+        shopcarts = CartItem.set_price(product_id, price, app.config["PRICE_UPDATE_BATCH_SIZE"])
+        app.logger.info("Repriced product %s in %d shopcarts", product_id, shopcarts)
+        return {"product_id": product_id, "price": price, "shopcarts": shopcarts}, status.HTTP_200_OK
+
+
 ######################################################################
 #  U T I L I T Y   F U N C T I O N S
 ######################################################################
 
 
 def check_content_type(media_type):
-    """Checks that the media type is correct"""
+    """Checks that the media type is correct, MessagePack is accepted in place of JSON"""
     content_type = request.headers.get("Content-Type")
-    if content_type and content_type == media_type:
+    media_types = messagepack.body_types(media_type)
+    if content_type and content_type in media_types:
         return
     app.logger.error("Invalid Content-Type: %s", content_type)
     abort(
         status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
-        f"Content-Type must be {media_type}",
+        f"Content-Type must be {' or '.join(media_types)}",
     )
 
 
-def validate_quantity(new_quantity):
-    """Check if quantity is a positive integer"""
-    try:
-        new_quantity = int(new_quantity)
-        if new_quantity <= 0:
-            raise ValueError
-    except ValueError:
+def lookup_args(args):
+    """Returns the keys of ?ids= or ?customer_ids= and whether they are customer ids, None without either"""
+    if args["ids"] is None and args["customer_ids"] is None:
+        return None
+    if args["ids"] is not None and args["customer_ids"] is not None:
+        abort(status.HTTP_400_BAD_REQUEST, "Provide either ids or customer_ids.")
+    by_customer = args["ids"] is None
+    return (args["customer_ids"] if by_customer else args["ids"]), by_customer
+
+
+def lookup_keys(keys):
+    """Returns the keys of a lookup without duplicates, in request order, or aborts when there are too many"""
+    keys = list(dict.fromkeys(keys))
+    if len(keys) > app.config["LOOKUP_MAX_IDS"]:
         abort(
             status.HTTP_400_BAD_REQUEST,
-            "Quantity must be a positive integer.",
+            f"At most {app.config['LOOKUP_MAX_IDS']} ids can be fetched at once.",
         )
-    return new_quantity
+    return keys
+
+
+def lookup_results(keys, found):
+    """Returns the serialized shopcarts found for the keys in request order and the missing keys"""
+    results = [found[key].serialize() for key in keys if key in found]
+    missing = [key for key in keys if key not in found]
+    return results, missing
+
+
+def lookup_shopcarts(keys, by_customer, with_items=True):
+    """Returns the shopcarts of many ids or customer ids in request order and the missing keys"""
+    keys = lookup_keys(keys)
+    if by_customer:
+        found = {cart.customer_id: cart for cart in Shopcart.find_by_customer_ids(keys, with_items)}
+    else:
+        found = {cart.id: cart for cart in Shopcart.find_by_ids(keys, with_items)}
+    return lookup_results(keys, found)
+
+
+def item_filters(args):
+    """Returns the filters and the cursor keys of a parsed cartItem_query"""
+    filters = {key: args[key] for key in CartItem.FILTERS if args[key] is not None}
+    if args["product_id"]:
+        filters["product_ids"] = [args["product_id"], *filters.get("product_ids", [])]
+    after = decode_cursor(args["cursor"]) if args["cursor"] else None
+    return filters, after
+
+
+def check_item_found(shopcart_id, args, items):
+    """Aborts with 404 when the first page of items filtered by ?product_id= is empty"""
+    product_id = args["product_id"]
+    if product_id and not items and not args["cursor"]:
+        message = f"Item with product_id '{product_id}' is not found in Shopcart with shopcart_id '{shopcart_id}'."
+        abort(status.HTTP_404_NOT_FOUND, message)
+
+
+def product_ids_to_delete(args, payload=None):
+    """Returns the product ids of ?product_ids= and of a {"product_ids": [...]} body, without duplicates"""
+    product_ids = list(args["product_ids"] or [])
+    if payload is not None:
+        product_ids += delete_items_body.validate(payload).get("product_ids") or []
+    return list(dict.fromkeys(product_ids))
+
+
+def requested_fields(args=None):
+    """Returns the marshalling mask for ?fields= and ?include_items= and whether items are needed"""
+    args = args or shopcart_fields_query.parse()
+    names = shopcart_model.resolved.keys()
+    if args["fields"]:
+        names = [name.strip() for name in args["fields"].split(",") if name.strip()]
+        unknown = set(names) - set(shopcart_model.resolved)
+        if unknown:
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                f"Unknown shopcart fields: {', '.join(sorted(unknown))}",
+            )
+    names = [name for name in names if name != "items" or args["include_items"]]
+    if not names:
+        abort(status.HTTP_400_BAD_REQUEST, "At least one shopcart field must be returned.")
+    return "{" + ",".join(names) + "}", "items" in names
+
+
+def encode_cursor(after):
+    """Returns the opaque cursor for the sort keys of the last item of a page"""
+    return base64.urlsafe_b64encode(json.dumps(after).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Returns the sort keys stored in a cursor, or aborts with 400 for a bad one"""
+    try:
+        after = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, binascii.Error):
+        after = None
+    if not isinstance(after, list) or not all(isinstance(key, (int, float)) for key in after):
+        abort(status.HTTP_400_BAD_REQUEST, "The cursor is not valid.")
+    return after
 
 
-def validate_price(new_price):
-    """Check if price is a non-negative number"""
+def check_debug_enabled():
+    """Hides the debug endpoints unless they are enabled in the config"""
+    if not app.config.get("DEBUG_ENDPOINTS"):
+        abort(status.HTTP_404_NOT_FOUND, "Debug endpoints are not enabled.")
+
+
+def check_admin_enabled():
+    """Hides the admin endpoints unless they are enabled in the config"""
+    if not app.config.get("ADMIN_ENDPOINTS"):
+        abort(status.HTTP_404_NOT_FOUND, "Admin endpoints are not enabled.")
+
+
+# The status of an operation that leaves an item, like the single item endpoints
+OPERATION_STATUS = {"add": status.HTTP_201_CREATED, "update": status.HTTP_200_OK}
+
+
+def validate_operation(position, operation):
+    """Returns (op, data) of an item operation, checked like the single item endpoints"""
     try:
-        new_price = float(new_price)
-        if new_price < 0:
-            raise ValueError
-    except ValueError:
-        abort(status.HTTP_400_BAD_REQUEST, "Price must be a non-negative number.")
-    return new_price
+        data = operation_body.validate(operation)
+        kind = data["op"]
+        if kind == "add":
+            data = cartItem_body.validate(operation)
+        elif kind == "update":
+            data = update_item_body.validate(operation)
+            if not data:
+                raise DataValidationError("Either quantity or price must be provided.")
+            data["product_id"] = operation["product_id"]
+        elif kind != "delete":
+            validation.fail("field", "op", "must be one of add, delete, update")
+    except DataValidationError as error:
+        raise DataValidationError(f"Operation {position}: {error}") from error
+    return kind, data
+
+
+def apply_item_changes(cart_item, data):
+    """Validates new_quantity / new_price from a request body and sets them"""
+    data = update_item_body.validate(data)
+    # If no information is provided, return 400
+    if not data:
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            "Either quantity or price must be provided.",
+        )
+
+    if "new_quantity" in data:
+        cart_item.quantity = data["new_quantity"]
+    if "new_price" in data:
+        cart_item.price = data["new_price"]
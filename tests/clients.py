@@ -0,0 +1,44 @@
+"""
+A base test case for suites that call the API through the Flask test client
+"""
+import logging
+from unittest import TestCase
+from service import app
+from service.models import db, Shopcart
+
+
+class ApiTestCase(TestCase):
+    """Configures the app for testing and starts each test with no shopcarts
+
+    Suites that use the models directly set push_context to run each test
+    inside an app context; the others leave it off so that every request
+    gets an app context, and a g, of its own.
+    """
+
+    push_context = False
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        app.config["TESTING"] = True
+        app.config["DEBUG"] = False
+        app.logger.setLevel(logging.CRITICAL)
+
+    def setUp(self):
+        """This runs before each test"""
+        self.client = app.test_client()
+        if self.push_context:
+            self.app_context = app.app_context()
+            self.app_context.push()
+            db.session.query(Shopcart).delete()  # clean up the last tests
+            db.session.commit()
+            return
+        with app.app_context():
+            db.session.query(Shopcart).delete()  # clean up the last tests
+            db.session.commit()
+
+    def tearDown(self):
+        """This runs after each test"""
+        if self.push_context:
+            db.session.remove()
+            self.app_context.pop()
@@ -0,0 +1,243 @@
+"""
+Async API Service Test Suite
+
+Exercises the ASGI app in service.asgi through Starlette's TestClient to
+check that it keeps the JSON contract of the Flask routes.
+"""
+import logging
+from unittest import TestCase
+from starlette.testclient import TestClient
+from service import app as flask_app
+from service.asgi import app
+from service.models import db, Shopcart
+from service.common import status
+
+BASE_URL = "/api/shopcarts"
+
+
+######################################################################
+#  T E S T   C A S E S
+######################################################################
+class TestAsyncServer(TestCase):
+    """Async REST API Server Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        flask_app.logger.setLevel(logging.CRITICAL)
+
+    def setUp(self):
+        """This runs before each test"""
+        with flask_app.app_context():
+            db.session.query(Shopcart).delete()  # clean up the last tests
+            db.session.commit()
+        self.client = TestClient(app)
+        self.client.__enter__()  # pylint: disable=unnecessary-dunder-call
+
+    def tearDown(self):
+        """This runs after each test"""
+        self.client.__exit__(None, None, None)
+
+    def _create_shopcart(self, customer_id, items=None):
+        """Creates a shopcart and returns its JSON"""
+        resp = self.client.post(
+            BASE_URL, json={"customer_id": customer_id, "items": items or []}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        return resp.json()
+
+    def test_health(self):
+        """It should answer the health check"""
+        resp = self.client.get("/health")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.json(), {"status": "OK"})
+
+    def test_refuses_shards(self):
+        """It should not start when the database is sharded"""
+        shard_map = flask_app.extensions["shard_map"]
+        shard_map.set_shards([None, "shard_1"])
+        try:
+            with self.assertRaises(RuntimeError):
+                with TestClient(app):
+                    pass
+        finally:
+            shard_map.set_shards([None])
+
+    def test_create_and_get_shopcart(self):
+        """It should create a shopcart with items and read it back"""
+        items = [{"shopcart_id": 0, "product_id": 7, "quantity": 2, "price": 1.5}]
+        shopcart = self._create_shopcart(11, items)
+        self.assertEqual(shopcart["items"][0]["shopcart_id"], shopcart["id"])
+
+        resp = self.client.get(f"{BASE_URL}/{shopcart['id']}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.json(), shopcart)
+
+    def test_create_shopcart_errors(self):
+        """It should return 400, 409 and 415 like the Flask routes"""
+        resp = self.client.post(BASE_URL, json={})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(resp.json()["error"], "Bad Request")
+
+        self._create_shopcart(12)
+        resp = self.client.post(BASE_URL, json={"customer_id": 12})
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+
+        resp = self.client.post(BASE_URL, content="{}", headers={"Content-Type": "text/html"})
+        self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        self.assertEqual(resp.json()["message"], "Content-Type must be application/json")
+
+    def test_list_shopcarts(self):
+        """It should list shopcarts filtered by customer_id and product_id"""
+        first = self._create_shopcart(21)
+        self._create_shopcart(22)
+        self.client.post(f"{BASE_URL}/{first['id']}/items", json={"product_id": 5, "price": 2.0})
+
+        self.assertEqual(len(self.client.get(BASE_URL).json()), 2)
+        data = self.client.get(BASE_URL, params={"customer_id": 22}).json()
+        self.assertEqual([cart["customer_id"] for cart in data], [22])
+        data = self.client.get(BASE_URL, params={"product_id": 5}).json()
+        self.assertEqual([cart["id"] for cart in data], [first["id"]])
+
+        resp = self.client.get(BASE_URL, params={"product_id": "x"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(resp.json(), flask_app.test_client().get(BASE_URL, query_string={"product_id": "x"}).get_json())
+
+    def test_list_shopcarts_by_ids(self):
+        """It should fetch shopcarts by ids or customer_ids like the Flask route"""
+        first = self._create_shopcart(23)
+        second = self._create_shopcart(24)
+        resp = self.client.get(BASE_URL, params={"ids": f"{second['id']},0,{first['id']}"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([cart["id"] for cart in resp.json()], [second["id"], first["id"]])
+        self.assertEqual(resp.headers["X-Missing-Ids"], "0")
+
+        resp = self.client.get(BASE_URL, params={"customer_ids": "24"})
+        self.assertEqual(resp.json(), [second])
+        self.assertEqual(resp.headers["X-Missing-Ids"], "")
+
+        resp = self.client.get(BASE_URL, params={"ids": str(first["id"]), "customer_ids": "24"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(BASE_URL, params={"ids": "1,x"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_shopcart_fields(self):
+        """It should return only the requested fields, without loading the items when they are left out"""
+        items = [{"shopcart_id": 0, "product_id": 1, "quantity": 1, "price": 1.0}]
+        shopcart = self._create_shopcart(25, items)
+        flask_client = flask_app.test_client()
+        for url, query in (
+            (BASE_URL, {"include_items": "false", "fields": "id"}),
+            (BASE_URL, {"ids": str(shopcart["id"]), "fields": "customer_id,items"}),
+            (f"{BASE_URL}/{shopcart['id']}", {"include_items": "false"}),
+            (f"{BASE_URL}/{shopcart['id']}", {"fields": "bogus"}),
+        ):
+            resp = self.client.get(url, params=query)
+            expected = flask_client.get(url, query_string=query)
+            self.assertEqual((resp.status_code, resp.json()), (expected.status_code, expected.get_json()))
+        resp = self.client.get(f"{BASE_URL}/{shopcart['id']}", params={"include_items": "false"})
+        self.assertEqual(resp.json(), {"id": shopcart["id"], "customer_id": 25})
+
+    def test_update_and_delete_shopcart(self):
+        """It should replace the items of a shopcart and then delete it"""
+        items = [{"shopcart_id": 0, "product_id": 1, "quantity": 1, "price": 1.0}]
+        shopcart = self._create_shopcart(31, items)
+        url = f"{BASE_URL}/{shopcart['id']}"
+        new_items = [{"shopcart_id": shopcart["id"], "product_id": 2, "quantity": 3, "price": 4.0}]
+        resp = self.client.put(url, json={"customer_id": 31, "items": new_items})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([item["product_id"] for item in resp.json()["items"]], [2])
+
+        resp = self.client.put(f"{BASE_URL}/0", json={"customer_id": 1})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cart_items(self):
+        """It should add, increment, read, update and delete items"""
+        shopcart = self._create_shopcart(41)
+        url = f"{BASE_URL}/{shopcart['id']}/items"
+        resp = self.client.post(url, json={"product_id": 9, "quantity": 2, "price": 3.5})
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        resp = self.client.post(url, json={"product_id": 9, "price": 3.5})
+        self.assertEqual(resp.json()["quantity"], 3)
+
+        resp = self.client.post(url, json={"price": 3.5})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.post(f"{BASE_URL}/0/items", json={"product_id": 1, "price": 1.0})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+        self.assertEqual(len(self.client.get(url).json()), 1)
+        resp = self.client.get(url, params={"product_id": 8})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+        resp = self.client.get(f"{url}/9")
+        self.assertEqual(resp.json()["quantity"], 3)
+        resp = self.client.get(f"{url}/8")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+        resp = self.client.put(f"{url}/9", json={"new_quantity": 5, "new_price": 1.25})
+        self.assertEqual(resp.json()["quantity"], 5)
+        self.assertEqual(resp.json()["price"], 1.25)
+        resp = self.client.put(f"{url}/9", json={"new_quantity": -1})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(resp.json()["message"], "Quantity must be a positive integer.")
+        resp = self.client.put(f"{url}/9", json={})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.put(f"{url}/8", json={"new_quantity": 1})
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+
+        self.assertEqual(self.client.delete(f"{url}/9").status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get(url).json(), [])
+
+    def test_list_cart_items(self):
+        """It should filter, sort and page the items like the Flask route"""
+        items = [
+            {"shopcart_id": 0, "product_id": n, "quantity": n + 1, "price": 10.0 - n} for n in range(5)
+        ]
+        shopcart = self._create_shopcart(43, items)
+        url = f"{BASE_URL}/{shopcart['id']}/items"
+        resp = self.client.get(url, params={"sort": "price", "min_quantity": 2, "limit": 2})
+        self.assertEqual([item["product_id"] for item in resp.json()], [4, 3])
+        resp = self.client.get(url, params={"sort": "price", "min_quantity": 2, "cursor": resp.headers["X-Next-Cursor"]})
+        self.assertEqual([item["product_id"] for item in resp.json()], [2, 1])
+        self.assertNotIn("X-Next-Cursor", resp.headers)
+
+        resp = self.client.get(url, params={"product_id": 3})
+        self.assertEqual([item["product_id"] for item in resp.json()], [3])
+        resp = self.client.get(url, params={"product_id": 9})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        for params in ({"sort": "color"}, {"limit": 0}, {"cursor": "x"}, {"max_price": "cheap"}):
+            resp = self.client.get(url, params=params)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_delete_cart_items(self):
+        """It should delete many items with one request"""
+        items = [{"shopcart_id": 0, "product_id": n, "quantity": 1, "price": 1.0} for n in range(3)]
+        shopcart = self._create_shopcart(42, items)
+        url = f"{BASE_URL}/{shopcart['id']}/items"
+        resp = self.client.request("DELETE", url, params={"product_ids": "0,7"}, json={"product_ids": [1]})
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(resp.headers["X-Missing-Ids"], "7")
+        self.assertEqual([item["product_id"] for item in self.client.get(url).json()], [2])
+
+    def test_clear_cart_items(self):
+        """It should clear all items in a shopcart"""
+        items = [
+            {"shopcart_id": 0, "product_id": n, "quantity": 1, "price": 1.0} for n in range(3)
+        ]
+        shopcart = self._create_shopcart(51, items)
+        resp = self.client.put(f"{BASE_URL}/{shopcart['id']}/clear")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.json()["items"], [])
+        resp = self.client.put(f"{BASE_URL}/0/clear")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_unknown_route(self):
+        """It should return JSON errors for unknown URLs and methods"""
+        resp = self.client.get("/api/nothing")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.client.patch(BASE_URL)
+        self.assertEqual(resp.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        self.assertEqual(resp.json()["status"], status.HTTP_405_METHOD_NOT_ALLOWED)
@@ -0,0 +1,41 @@
+"""
+Cache Test Suite
+"""
+import time
+from unittest import TestCase
+from service.common.cache import LRUCache, NegativeCache
+
+
+######################################################################
+#  C A C H E   T E S T   C A S E S
+######################################################################
+class TestCaches(TestCase):
+    """In-process Cache Tests"""
+
+    def test_lru_cache(self):
+        """It should evict the least recently used key when full"""
+        lru = LRUCache(maxsize=2)
+        lru.put(1, "a")
+        lru.put(2, "b")
+        self.assertEqual(lru.get(1), "a")  # 2 is now the oldest
+        lru.put(3, "c")
+        self.assertIsNone(lru.get(2))
+        self.assertEqual(lru.get(3), "c")
+        self.assertEqual(len(lru), 2)
+        self.assertEqual(lru.stats(), {"size": 2, "hits": 2, "misses": 1})
+
+        lru.discard(1)
+        lru.discard(99)
+        self.assertEqual(len(lru), 1)
+        lru.clear()
+        self.assertEqual(len(lru), 0)
+
+    def test_negative_cache(self):
+        """It should remember missing keys until they expire"""
+        misses = NegativeCache(maxsize=10, ttl=0.05)
+        misses.add(1)
+        self.assertIn(1, misses)
+        self.assertNotIn(2, misses)
+        time.sleep(0.06)
+        self.assertNotIn(1, misses)
+        self.assertEqual(len(misses), 0)
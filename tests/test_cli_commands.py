@@ -2,17 +2,25 @@
 CLI Command Extensions for Flask
 """
 import os
+import gzip
+import json
+import shutil
+import tempfile
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
-from click.testing import CliRunner
-from service.common.cli_commands import db_create
+from sqlalchemy import text
+from service import app
+from service.models import db, Shopcart
+from service.common.cli_commands import (
+    db_create, import_carts, export_carts, set_price, purge_carts, dispatch_events
+)
 
 
 class TestFlaskCLI(TestCase):
     """Test Flask CLI Commands"""
 
     def setUp(self):
-        self.runner = CliRunner()
+        self.runner = app.test_cli_runner()
 
     @patch('service.common.cli_commands.db')
     def test_db_create(self, db_mock):
@@ -21,3 +29,197 @@ class TestFlaskCLI(TestCase):
         with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+
+
+class TestBulkCommands(TestCase):
+    """Test the bulk import, export, repricing and purge commands"""
+
+    def setUp(self):
+        self.runner = app.test_cli_runner()
+        self.folder = tempfile.mkdtemp()
+        with app.app_context():
+            db.session.query(Shopcart).delete()  # clean up the last tests
+            db.session.commit()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def _write(self, name, lines):
+        """Writes a file to import"""
+        path = os.path.join(self.folder, name)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write("\n".join(lines) + "\n")
+        return path
+
+    def _carts(self):
+        """Returns the carts in the database by customer id"""
+        with app.app_context():
+            return {cart.customer_id: cart.serialize() for cart in Shopcart.all()}
+
+    def test_import_ndjson(self):
+        """It should import carts from NDJSON, adding up repeated items"""
+        path = self._write("carts.ndjson", [
+            json.dumps({"customer_id": 1, "items": [
+                {"product_id": 7, "quantity": 2, "price": 1.5},
+                {"product_id": 7, "quantity": 1, "price": 2.0},
+            ]}),
+            "",
+            json.dumps({"customer_id": 2}),
+        ])
+        result = self.runner.invoke(import_carts, [path, "--batch-size", "1"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Imported 2 shopcarts with 1 items from 3 rows", result.output)
+        carts = self._carts()
+        self.assertEqual(carts[2]["items"], [])
+        item = carts[1]["items"][0]
+        self.assertEqual((item["product_id"], item["quantity"], item["price"]), (7, 3, 2.0))
+
+    def test_import_csv(self):
+        """It should import items from CSV, with empty carts and default quantities"""
+        path = self._write("items.csv", [
+            "customer_id,product_id,quantity,price", "3,1,,9.5", "3,2,4,1", "4,,,",
+        ])
+        result = self.runner.invoke(import_carts, [path])
+        self.assertEqual(result.exit_code, 0, result.output)
+        carts = self._carts()
+        self.assertEqual([(item["product_id"], item["quantity"]) for item in carts[3]["items"]], [(1, 1), (2, 4)])
+        self.assertEqual(carts[4]["items"], [])
+
+    def test_import_conflicts(self):
+        """It should skip customers that have a cart, or import nothing when strict"""
+        path = self._write("carts.csv", ["customer_id,product_id,quantity,price", "5,1,1,1", "6,1,1,1"])
+        self.runner.invoke(import_carts, [path])
+        path = self._write("more.csv", ["customer_id,product_id,quantity,price", "6,2,1,1", "7,1,1,1"])
+        result = self.runner.invoke(import_carts, [path, "--strict"])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("Duplicate Shopcart: 1 customers already have a shopcart", result.output)
+        self.assertEqual(sorted(self._carts()), [5, 6])
+
+        result = self.runner.invoke(import_carts, [path])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Skipped 1 customers that already have a shopcart: 6", result.output)
+        carts = self._carts()
+        self.assertEqual(sorted(carts), [5, 6, 7])
+        self.assertEqual([item["product_id"] for item in carts[6]["items"]], [1])
+
+    def test_import_duplicate_customers(self):
+        """It should reject two NDJSON carts of one customer but add up the CSV rows of one"""
+        path = self._write("carts.ndjson", [json.dumps({"customer_id": 12}), json.dumps({"customer_id": 12})])
+        result = self.runner.invoke(import_carts, [path])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("Line 2: Duplicate Shopcart: customer 12 already has the cart of line 1", result.output)
+        self.assertEqual(self._carts(), {})
+
+        path = self._write("items.csv", ["customer_id,product_id,price", "12,1,1", "12,2,1"])
+        result = self.runner.invoke(import_carts, [path])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual([item["product_id"] for item in self._carts()[12]["items"]], [1, 2])
+
+    def test_import_invalid_rows(self):
+        """It should import nothing and name the line of an invalid row"""
+        path = self._write("carts.ndjson", [json.dumps({"customer_id": 8}), "[1]"])
+        result = self.runner.invoke(import_carts, [path])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("Line 2: A cart must be a JSON object.", result.output)
+        path = self._write("items.csv", ["customer_id,product_id,price", "9,1,-1"])
+        result = self.runner.invoke(import_carts, [path])
+        self.assertIn("Line 2: Invalid field 'price'", result.output)
+        path = self._write("items.csv", ["product_id,price", "1,1"])
+        result = self.runner.invoke(import_carts, [path, "--format", "csv"])
+        self.assertIn("must name a customer_id column", result.output)
+        self.assertEqual(self._carts(), {})
+
+    def test_export_and_import_back(self):
+        """It should export every cart to NDJSON and CSV files that import back"""
+        path = self._write("items.csv", [
+            "customer_id,product_id,quantity,price", "10,2,1,2.5", "10,1,3,1", "11,,,",
+        ])
+        self.runner.invoke(import_carts, [path])
+        carts = self._carts()
+        for name in ("carts.ndjson", "items.csv"):
+            path = os.path.join(self.folder, "export-" + name)
+            result = self.runner.invoke(export_carts, [path])
+            self.assertEqual(result.exit_code, 0, result.output)
+            with app.app_context():
+                db.session.query(Shopcart).delete()
+                db.session.commit()
+            result = self.runner.invoke(import_carts, [path])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertEqual(
+                {key: [(item["product_id"], item["quantity"], item["price"]) for item in cart["items"]]
+                 for key, cart in self._carts().items()},
+                {key: [(item["product_id"], item["quantity"], item["price"]) for item in cart["items"]]
+                 for key, cart in carts.items()},
+            )
+
+        with open(os.path.join(self.folder, "export-carts.ndjson"), encoding="utf-8") as file:
+            lines = [json.loads(line) for line in file]
+        self.assertEqual([cart["customer_id"] for cart in lines], [10, 11])
+        self.assertEqual([item["product_id"] for item in lines[0]["items"]], [1, 2])
+
+    def test_export_split(self):
+        """It should split the export into numbered gzipped files"""
+        path = self._write("items.csv", ["customer_id,product_id,quantity,price"] + [f"{n},1,1,1" for n in range(5)])
+        self.runner.invoke(import_carts, [path])
+        result = self.runner.invoke(export_carts, [os.path.join(self.folder, "out.csv.gz"), "--split-rows", "2"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Exported 5 rows to 3 files", result.output)
+        rows = []
+        for number in range(3):
+            with gzip.open(os.path.join(self.folder, f"out-{number:05d}.csv.gz"), "rt") as file:
+                lines = file.read().splitlines()
+            self.assertEqual(lines[0], "shopcart_id,customer_id,product_id,quantity,price")
+            rows += lines[1:]
+        self.assertEqual(len(rows), 5)
+
+        result = self.runner.invoke(export_carts, ["-", "--format", "ndjson"])
+        self.assertEqual(len([line for line in result.output.splitlines() if line.startswith("{")]), 5)
+
+    def test_set_price(self):
+        """It should reprice a product in every cart, a batch at a time"""
+        path = self._write("items.csv", ["customer_id,product_id,quantity,price"] + [f"{n},{n % 2},1,1" for n in range(7)])
+        self.runner.invoke(import_carts, [path])
+        result = self.runner.invoke(set_price, ["1", "2.5", "--batch-size", "2"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("in 3 shopcarts", result.output)
+        prices = [cart["items"][0]["price"] for _, cart in sorted(self._carts().items())]
+        self.assertEqual(prices, [1, 2.5, 1, 2.5, 1, 2.5, 1])
+
+        result = self.runner.invoke(set_price, ["1", "-1"])
+        self.assertNotEqual(result.exit_code, 0)
+
+    def test_purge_carts(self):
+        """It should purge the carts unchanged for the TTL and report the throughput and lag"""
+        path = self._write("items.csv", ["customer_id,product_id,quantity,price"] + [f"{n},1,1,1" for n in range(4)])
+        self.runner.invoke(import_carts, [path])
+        with app.app_context():
+            db.session.execute(text("UPDATE shopcart SET updated_at = now() - interval '40 days' WHERE customer_id < 3"))
+            db.session.commit()
+        result = self.runner.invoke(purge_carts, ["--ttl-days", "30", "--batch-size", "2", "--pause", "0"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Purged 3 shopcarts unchanged for 30 days", result.output)
+        self.assertIn("lag 864000s", result.output)
+        self.assertEqual(list(self._carts()), [3])
+
+    def test_dispatch_events(self):
+        """It should send the cart events to the sink and report the throughput"""
+        with app.app_context():
+            db.session.execute(text("DELETE FROM cart_event"))
+            db.session.commit()
+        path = self._write("items.csv", ["customer_id,product_id,quantity,price"] + [f"{n},1,1,1" for n in range(4)])
+        self.runner.invoke(import_carts, [path])
+        result = self.runner.invoke(dispatch_events, ["--sink", "http://127.0.0.1:1/"])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("The event sink failed", result.output)
+
+        events = os.path.join(self.folder, "events.jsonl")
+        result = self.runner.invoke(dispatch_events, ["--sink", f"file:{events}", "--batch-size", "3"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Dispatched 4 events in", result.output)
+        with open(events, encoding="utf-8") as file:
+            created = [json.loads(line) for line in file]
+        self.assertEqual(
+            [(event["type"], event["customer_id"]) for event in created], [("shopcart.created", n) for n in range(4)]
+        )
+        result = self.runner.invoke(dispatch_events, ["--sink", "kafka://localhost"])
+        self.assertEqual(result.exit_code, 2)
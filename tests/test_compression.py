@@ -0,0 +1,159 @@
+"""
+Response Compression Test Suite
+"""
+import os
+import gzip
+import shutil
+import tempfile
+from unittest import TestCase, skipUnless
+from flask import Response
+from werkzeug.exceptions import NotFound
+from tests.clients import ApiTestCase
+from service import app
+from service.common import status, compression
+
+BASE_URL = "/api/shopcarts"
+
+
+######################################################################
+#  C O M P R E S S I O N   T E S T   C A S E S
+######################################################################
+class TestCompression(ApiTestCase):
+    """Response Compression Tests"""
+
+    def _create_shopcarts(self, count):
+        """Creates shopcarts with a few items each"""
+        items = [{"shopcart_id": 0, "product_id": n, "quantity": 1, "price": 1.5} for n in range(5)]
+        for customer_id in range(count):
+            resp = self.client.post(BASE_URL, json={"customer_id": customer_id, "items": items})
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+
+    def test_choose_encoding(self):
+        """It should negotiate the encoding from Accept-Encoding"""
+        encodings = ("br", "gzip")
+        self.assertEqual(compression.choose_encoding("gzip, deflate, br", encodings), "br")
+        self.assertEqual(compression.choose_encoding("gzip;q=1.0, br;q=0.5", encodings), "gzip")
+        self.assertEqual(compression.choose_encoding("br;q=0, *", encodings), "gzip")
+        self.assertEqual(compression.choose_encoding("gzip;q=bad", encodings), None)
+        self.assertIsNone(compression.choose_encoding("identity", encodings))
+        self.assertIsNone(compression.choose_encoding(None, encodings))
+
+    def test_compress_list_response(self):
+        """It should gzip large JSON responses for clients that accept it"""
+        self._create_shopcarts(10)
+        plain = self.client.get(BASE_URL)
+        self.assertNotIn("Content-Encoding", plain.headers)
+        self.assertIn("Accept-Encoding", plain.headers["Vary"])
+
+        resp = self.client.get(BASE_URL, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertLess(int(resp.headers["Content-Length"]), len(plain.data))
+        self.assertEqual(gzip.decompress(resp.data), plain.data)
+
+    @skipUnless(compression.brotli, "brotli is not installed")
+    def test_compress_brotli(self):
+        """It should prefer brotli when the client accepts it"""
+        self._create_shopcarts(10)
+        plain = self.client.get(BASE_URL)
+        resp = self.client.get(BASE_URL, headers={"Accept-Encoding": "gzip, br"})
+        self.assertEqual(resp.headers["Content-Encoding"], "br")
+        self.assertEqual(compression.brotli.decompress(resp.data), plain.data)
+
+    def test_small_responses_are_not_compressed(self):
+        """It should leave responses under the size threshold alone"""
+        resp = self.client.get("/health", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertEqual(resp.get_json(), {"status": "OK"})
+
+    def test_compress_stream(self):
+        """It should compress streamed responses chunk by chunk"""
+        chunks = [f"line {n}\n" for n in range(1000)]
+        with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+            response = Response(iter(chunks), mimetype="text/plain")
+            response = app.process_response(response)
+            self.assertEqual(response.headers["Content-Encoding"], "gzip")
+            self.assertNotIn("Content-Length", response.headers)
+            body = b"".join(response.response)
+        self.assertEqual(gzip.decompress(body).decode(), "".join(chunks))
+
+    def test_compress_level(self):
+        """It should use GZIP_LEVEL for buffered and streamed responses alike"""
+        chunks = [f"line {n}\n" for n in range(1000)]
+        flags = []
+        try:
+            for level in (1, 9):
+                app.config["GZIP_LEVEL"] = level
+                with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+                    buffered = app.process_response(Response("".join(chunks), mimetype="text/plain"))
+                    streamed = app.process_response(Response(iter(chunks), mimetype="text/plain"))
+                    self.assertEqual(buffered.get_data(), gzip.compress("".join(chunks).encode(), level, mtime=0))
+                    flags.append(b"".join(streamed.response)[8])  # the gzip XFL byte: 4 fastest, 2 best
+        finally:
+            app.config["GZIP_LEVEL"] = 6
+        self.assertEqual(flags, [4, 2])
+
+
+######################################################################
+#  S T A T I C   F I L E   T E S T   C A S E S
+######################################################################
+class TestStaticFiles(TestCase):
+    """Precompressed Static File Tests"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.folder = tempfile.mkdtemp()
+        with open(os.path.join(self.folder, "app.js"), "w", encoding="utf-8") as file:
+            file.write("console.log('shopcarts');\n" * 200)
+        with open(os.path.join(self.folder, "logo.png"), "wb") as file:
+            file.write(b"\x89PNG")
+        self.static = compression.StaticFiles(self.folder, 3600)
+
+    def tearDown(self):
+        """This runs after each test"""
+        shutil.rmtree(self.folder)
+
+    def _get(self, filename, **headers):
+        """Returns the response of the static view for a file"""
+        with app.test_request_context(headers=headers):
+            response = self.static.send(filename)
+            response.direct_passthrough = False
+            return response
+
+    def test_compress_directory(self):
+        """It should write precompressed copies of text files only"""
+        written = compression.compress_directory(self.folder, encodings=("gzip",))
+        self.assertEqual(written, [os.path.join(self.folder, "app.js.gz")])
+
+    def test_send_precompressed(self):
+        """It should serve the precompressed copy with cache headers and an ETag"""
+        compression.compress_directory(self.folder, encodings=("gzip",))
+        plain = self._get("app.js")
+        self.assertNotIn("Content-Encoding", plain.headers)
+        self.assertEqual(plain.cache_control.max_age, 3600)
+        self.assertTrue(plain.cache_control.public)
+
+        resp = self._get("app.js", **{"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(resp.mimetype, plain.mimetype)
+        self.assertEqual(gzip.decompress(resp.get_data()), plain.get_data())
+        self.assertEqual(resp.get_etag()[0], plain.get_etag()[0] + "-gzip")
+
+        resp = self._get("app.js", **{"Accept-Encoding": "gzip", "If-None-Match": resp.headers["ETag"]})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_send_uncompressed(self):
+        """It should serve files without a current precompressed copy as they are"""
+        resp = self._get("logo.png", **{"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertEqual(resp.get_data(), b"\x89PNG")
+        with app.test_request_context():
+            self.assertRaises(NotFound, self.static.send, "../secret")
+
+    def test_served_by_the_app(self):
+        """It should serve the UI through the static view"""
+        client = app.test_client()
+        resp = client.get("/static/js/rest_api.js")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertIsNotNone(resp.headers.get("ETag"))
+        self.assertEqual(client.get("/").status_code, status.HTTP_200_OK)
@@ -0,0 +1,73 @@
+"""
+Concurrency Test Suite
+
+Runs many simultaneous requests through one app the way a threaded
+gunicorn worker does, to verify that every request gets its own session.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import has_app_context
+from service import app
+from service.models import db
+from service.common import status
+from tests.clients import ApiTestCase
+
+BASE_URL = "/api/shopcarts"
+THREADS = 16
+REQUESTS_PER_THREAD = 10
+
+
+######################################################################
+#  C O N C U R R E N C Y   T E S T   C A S E S
+######################################################################
+class TestConcurrentRequests(ApiTestCase):
+    """Concurrent Request Tests"""
+
+    def test_no_global_app_context(self):
+        """It should not leave an app context pushed after initialization"""
+        self.assertFalse(has_app_context())
+
+    def test_sessions_are_scoped_to_app_context(self):
+        """It should give each thread's app context its own session"""
+
+        barrier = threading.Barrier(4)
+
+        def get_session(_):
+            with app.app_context():
+                barrier.wait(timeout=5)  # all four contexts are alive at once
+                return db.session()
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            sessions = list(pool.map(get_session, range(4)))
+        self.assertEqual(len({id(session) for session in sessions}), 4)
+
+    def test_concurrent_requests(self):
+        """It should handle many simultaneous requests without mixing up carts"""
+
+        def customer(number):
+            client = app.test_client()
+            resp = client.post(BASE_URL, json={"customer_id": number, "items": []})
+            assert resp.status_code == status.HTTP_201_CREATED, resp.data
+            shopcart_id = resp.get_json()["id"]
+            for product_id in range(REQUESTS_PER_THREAD):
+                resp = client.post(
+                    f"{BASE_URL}/{shopcart_id}/items",
+                    json={"product_id": product_id, "quantity": number + 1, "price": 1.5},
+                )
+                assert resp.status_code == status.HTTP_201_CREATED, resp.data
+                resp = client.get(f"{BASE_URL}/{shopcart_id}")
+                assert resp.status_code == status.HTTP_200_OK, resp.data
+            return number, client.get(f"{BASE_URL}/{shopcart_id}").get_json()
+
+        with ThreadPoolExecutor(max_workers=THREADS) as pool:
+            results = list(pool.map(customer, range(THREADS)))
+
+        for number, shopcart in results:
+            self.assertEqual(shopcart["customer_id"], number)
+            self.assertEqual(len(shopcart["items"]), REQUESTS_PER_THREAD)
+            for item in shopcart["items"]:
+                self.assertEqual(item["shopcart_id"], shopcart["id"])
+                self.assertEqual(item["quantity"], number + 1)
+
+        resp = app.test_client().get(BASE_URL)
+        self.assertEqual(len(resp.get_json()), THREADS)
@@ -0,0 +1,54 @@
+"""
+API Documentation Test Suite
+"""
+import json
+import gzip
+from service import app, api
+from service.common import status, docs
+from tests.clients import ApiTestCase
+
+SPEC_URL = "/api/swagger.json"
+
+
+######################################################################
+#  A P I   D O C S   T E S T   C A S E S
+######################################################################
+class TestDocs(ApiTestCase):
+    """Swagger Spec Cache Tests"""
+
+    def test_spec_is_cached(self):
+        """It should serve the spec flask-restx generates with an ETag"""
+        resp = self.client.get(SPEC_URL)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["info"]["title"], "Shopcart REST API Service")
+        with app.test_request_context():
+            self.assertEqual(resp.get_json(), json.loads(json.dumps(api.__schema__)))
+        self.assertIsNotNone(resp.headers.get("ETag"))
+        self.assertTrue(resp.cache_control.no_cache)
+
+        resp = self.client.get(SPEC_URL, headers={"If-None-Match": resp.headers["ETag"]})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.data, b"")
+
+    def test_spec_is_precompressed(self):
+        """It should serve the precompressed spec to clients that accept it"""
+        plain = self.client.get(SPEC_URL)
+        resp = self.client.get(SPEC_URL, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(resp.data), plain.data)
+        self.assertEqual(resp.get_etag()[0], plain.get_etag()[0] + "-gzip")
+
+    def test_spec_built_on_first_request(self):
+        """It should build the spec lazily when the docs are disabled"""
+        cache = docs.SpecCache(api)
+        self.assertIsNone(cache.body)
+        with app.test_request_context(SPEC_URL):
+            resp = cache.response()
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_data(), app.extensions["spec_cache"].body)
+
+    def test_docs_ui(self):
+        """It should serve the Swagger UI when the docs are enabled"""
+        resp = self.client.get("/apidocs")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertIn(b"swagger", resp.data.lower())
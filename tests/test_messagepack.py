@@ -0,0 +1,63 @@
+"""
+MessagePack Test Suite
+"""
+from unittest import skipUnless
+from tests.clients import ApiTestCase
+from service.common import status, messagepack
+from service.common.messagepack import msgpack, MEDIA_TYPE
+
+BASE_URL = "/api/shopcarts"
+
+
+######################################################################
+#  M E S S A G E P A C K   T E S T   C A S E S
+######################################################################
+@skipUnless(msgpack, "msgpack is not installed")
+class TestMessagePack(ApiTestCase):
+    """MessagePack Content Negotiation Tests"""
+
+    def _post(self, url, data, method="post"):
+        """Sends a MessagePack body and asks for a MessagePack response"""
+        return getattr(self.client, method)(
+            url, data=msgpack.packb(data), content_type=MEDIA_TYPE, headers={"Accept": MEDIA_TYPE}
+        )
+
+    def test_create_and_get_shopcart(self):
+        """It should accept and return MessagePack bodies"""
+        items = [{"shopcart_id": 0, "product_id": 1, "quantity": 2, "price": 2.5}]
+        resp = self._post(BASE_URL, {"customer_id": 7, "items": items})
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(resp.mimetype, MEDIA_TYPE)
+        shopcart = msgpack.unpackb(resp.data)
+        self.assertEqual(shopcart["customer_id"], 7)
+        self.assertEqual(shopcart["items"][0]["price"], 2.5)
+
+        resp = self.client.get(f"{BASE_URL}/{shopcart['id']}", headers={"Accept": MEDIA_TYPE})
+        self.assertEqual(msgpack.unpackb(resp.data), shopcart)
+        resp = self.client.get(f"{BASE_URL}/{shopcart['id']}")
+        self.assertEqual(resp.mimetype, "application/json")
+        self.assertEqual(resp.get_json(), shopcart)
+
+    def test_items(self):
+        """It should add and update items with MessagePack bodies"""
+        shopcart = msgpack.unpackb(self._post(BASE_URL, {"customer_id": 8}).data)
+        url = f"{BASE_URL}/{shopcart['id']}/items"
+        resp = self._post(url, {"product_id": 3, "price": 1.0})
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        resp = self._post(f"{url}/3", {"new_quantity": 4}, method="put")
+        self.assertEqual(msgpack.unpackb(resp.data)["quantity"], 4)
+        resp = self.client.get(url, headers={"Accept": f"{MEDIA_TYPE}, application/json;q=0.5"})
+        self.assertEqual([item["product_id"] for item in msgpack.unpackb(resp.data)], [3])
+
+    def test_bad_requests(self):
+        """It should answer bad MessagePack bodies with a MessagePack 400"""
+        resp = self.client.post(BASE_URL, data=b"\xc1", content_type=MEDIA_TYPE, headers={"Accept": MEDIA_TYPE})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(msgpack.unpackb(resp.data)["message"], "The request body is not valid MessagePack.")
+        resp = self._post(BASE_URL, {"customer_id": "x"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+        resp = self.client.post(BASE_URL, data=b"", content_type="text/plain")
+        self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        self.assertIn(MEDIA_TYPE, resp.get_json()["message"])
+        self.assertEqual(messagepack.body_types("text/csv"), ("text/csv",))
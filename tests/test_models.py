@@ -5,6 +5,9 @@ Test cases for YourResourceModel Model
 import os
 import logging
 import unittest
+from datetime import timedelta
+from unittest.mock import patch
+from sqlalchemy import text
 from service import app
 from service.models import (
     PersistentBase,
@@ -40,10 +43,11 @@ class TestShopcart(unittest.TestCase):
     @classmethod
     def tearDownClass(cls):
         """This runs once after the entire test suite"""
-        db.session.close()
 
     def setUp(self):
         """This runs before each test"""
+        self.app_context = app.app_context()
+        self.app_context.push()
         db.session.query(Shopcart).delete()  # clean up the last tests
         db.session.query(CartItem).delete()  # clean up the last tests
         db.session.commit()
@@ -51,6 +55,7 @@ class TestShopcart(unittest.TestCase):
     def tearDown(self):
         """This runs after each test"""
         db.session.remove()
+        self.app_context.pop()
 
     ######################################################################
     #  T E S T   C A S E S
@@ -355,3 +360,79 @@ class TestShopcart(unittest.TestCase):
         # Fetch it back again
         shopcart = Shopcart.find(shopcart.id)
         self.assertEqual(len(shopcart.items), 0)
+
+    def test_item_changes_touch_the_shopcart(self):
+        """It should bump updated_at of a Shopcart whenever its items change"""
+        shopcart = ShopcartFactory()
+        CartItemFactory(shopcart=shopcart)
+        shopcart.create()
+        db.session.execute(text("UPDATE shopcart SET updated_at = now() - interval '1 day'"))
+        db.session.commit()
+        old = Shopcart.find(shopcart.id).updated_at
+
+        CartItem.delete_many(shopcart.id, [shopcart.items[0].product_id])
+        shopcart = Shopcart.find(shopcart.id)
+        self.assertGreater(shopcart.updated_at, old)
+        self.assertLess(shopcart.created_at, shopcart.updated_at + timedelta(seconds=1))
+
+    def test_purge_expired(self):
+        """It should delete the Shopcarts unchanged for the TTL and their items, in batches"""
+        db.session.execute(text("DELETE FROM shopcart_tombstone"))
+        for _ in range(5):
+            shopcart = ShopcartFactory()
+            CartItemFactory(shopcart=shopcart)
+            shopcart.create()
+        expire = text("UPDATE shopcart SET updated_at = now() - interval '3 days' WHERE id <> :id")
+        db.session.execute(expire, {"id": shopcart.id})
+        db.session.commit()
+
+        batches = []
+        result = Shopcart.purge_expired(timedelta(days=2), batch_size=3, progress=batches.append)
+        self.assertEqual(result["carts"], 4)
+        self.assertEqual(batches, [3, 1])
+        self.assertAlmostEqual(result["lag"], 24 * 3600, delta=60)
+        self.assertEqual([cart.id for cart in Shopcart.all()], [shopcart.id])
+        self.assertEqual(db.session.execute(text("SELECT COUNT(*) FROM cart_item")).scalar(), 1)
+
+        db.session.execute(text("UPDATE shopcart_tombstone SET deleted_at = now() - interval '3 days'"))
+        db.session.commit()
+        result = Shopcart.purge_expired(timedelta(days=2), tombstone_ttl=timedelta(days=1))
+        self.assertEqual((result["carts"], result["tombstones"]), (0, 4))
+
+    def test_changes_wait_for_open_transactions(self):
+        """It should not list changes made after a transaction that is still open"""
+        db.session.execute(text("DELETE FROM shopcart_tombstone"))
+        db.session.commit()
+        with db.engine.connect() as connection:
+            connection.execute(text("INSERT INTO shopcart (customer_id) VALUES (1001)"))
+            ShopcartFactory(customer_id=1002).create()
+            changes, after, more = Shopcart.changes_since([[0, 0]], 10)
+            self.assertEqual((changes, after, more), ([], [[0, 0]], False))
+            connection.commit()
+        changes, after, more = Shopcart.changes_since(after, 10, with_items=False)
+        self.assertEqual([change["customer_id"] for change in changes], [1001, 1002])
+        self.assertEqual(after[0][1], changes[-1]["id"])
+
+    def test_changes_page_with_a_cart_deleted_meanwhile(self):
+        """It should report more changes when a cart in the page was deleted while it was read"""
+        db.session.execute(text("DELETE FROM shopcart_tombstone"))
+        db.session.commit()
+        shopcarts = [ShopcartFactory(customer_id=customer_id) for customer_id in (1011, 1012, 1013)]
+        for shopcart in shopcarts:
+            shopcart.create()
+        read_keys = db.session.execute
+
+        def delete_after_keys(*args, **kwargs):
+            """Deletes the middle cart once the change keys were read"""
+            rows = read_keys(*args, **kwargs)
+            with db.engine.begin() as connection:
+                connection.execute(text("DELETE FROM shopcart WHERE id = :id"), {"id": shopcarts[1].id})
+            return rows
+
+        with patch.object(db.session, "execute", side_effect=delete_after_keys):
+            changes, after, more = Shopcart.changes_since([[0, 0]], 2, with_items=False)
+        self.assertEqual([change["id"] for change in changes], [shopcarts[0].id, shopcarts[2].id])
+        self.assertTrue(more)
+        changes, after, more = Shopcart.changes_since(after, 2)
+        self.assertEqual([(change["id"], change["deleted"]) for change in changes], [(shopcarts[1].id, True)])
+        self.assertFalse(more)
@@ -0,0 +1,131 @@
+"""
+Cart Events Test Suite
+"""
+import os
+import json
+import tempfile
+import threading
+from sqlalchemy import select, text
+from service.models import db, Shopcart, cart_event
+from service.common import outbox
+from tests.clients import ApiTestCase
+from tests.factories import ShopcartFactory, CartItemFactory
+
+
+class ListSink:  # pylint: disable=too-few-public-methods
+    """Keeps the batches it was sent, or fails them"""
+
+    def __init__(self, error=None):
+        self.batches = []
+        self.error = error
+
+    def send(self, events):
+        """Takes a batch of events"""
+        if self.error:
+            raise self.error
+        self.batches.append(events)
+
+
+######################################################################
+#  C A R T   E V E N T S   T E S T   C A S E S
+######################################################################
+class TestOutbox(ApiTestCase):
+    """Transactional Outbox Tests"""
+
+    push_context = True
+
+    def setUp(self):
+        """This runs before each test"""
+        super().setUp()
+        db.session.execute(cart_event.delete())
+        db.session.commit()
+
+    def _events(self):
+        """Returns the (type, shopcart_id) of the events in the outbox"""
+        rows = db.session.execute(select(cart_event).order_by(cart_event.c.id)).all()
+        db.session.commit()
+        return [(row.type, row.shopcart_id) for row in rows]
+
+    def _create_shopcarts(self, count):
+        """Creates shopcarts holding one item and returns their ids"""
+        ids = []
+        for _ in range(count):
+            shopcart = ShopcartFactory()
+            CartItemFactory(shopcart=shopcart)
+            shopcart.create()
+            ids.append(shopcart.id)
+        return ids
+
+    def test_changes_write_events(self):
+        """It should write one event per cart and transaction, with the change"""
+        shopcart = ShopcartFactory()
+        CartItemFactory(shopcart=shopcart)
+        shopcart.create()
+        cart_id = shopcart.id
+        self.assertEqual(self._events(), [("shopcart.created", cart_id)])
+
+        # many changes in one transaction make one event
+        insert = "INSERT INTO cart_item (shopcart_id, product_id, quantity, price) VALUES (:id, 99999, 1, 1.0)"
+        db.session.execute(text(insert), {"id": cart_id})
+        db.session.execute(text("UPDATE cart_item SET quantity = quantity + 1 WHERE shopcart_id = :id"), {"id": cart_id})
+        db.session.execute(text("DELETE FROM cart_item WHERE product_id = 99999"))
+        db.session.commit()
+        Shopcart.find(cart_id).delete()
+        self.assertEqual(
+            self._events(),
+            [("shopcart.created", cart_id), ("shopcart.updated", cart_id), ("shopcart.deleted", cart_id)],
+        )
+
+    def test_dispatch_to_a_file(self):
+        """It should drain the outbox to a file in batches, oldest event first"""
+        ids = self._create_shopcarts(3)
+        path = os.path.join(tempfile.mkdtemp(), "events.jsonl")
+        result = outbox.dispatch(outbox.make_sink(f"file:{path}"), batch_size=2)
+        self.assertEqual(result["events"], 3)
+        with open(path, encoding="utf-8") as file:
+            events = [json.loads(line) for line in file]
+        self.assertEqual([(event["type"], event["shopcart_id"]) for event in events], [("shopcart.created", id) for id in ids])
+        self.assertEqual(len({event["id"] for event in events}), 3)
+        self.assertEqual(self._events(), [])
+        self.assertEqual(outbox.dispatch(outbox.make_sink(f"file:{path}"))["events"], 0)
+
+    def test_failed_batches_are_sent_again(self):
+        """It should keep the events of a batch the sink did not take"""
+        ids = self._create_shopcarts(3)
+        with self.assertRaises(OSError):
+            outbox.dispatch(ListSink(OSError("unreachable")), batch_size=2)
+        self.assertEqual(len(self._events()), 3)
+        sink = ListSink()
+        self.assertEqual(outbox.dispatch(sink, batch_size=2)["events"], 3)
+        self.assertEqual([[event["shopcart_id"] for event in batch] for batch in sink.batches], [ids[:2], ids[2:]])
+
+    def test_one_dispatcher_per_shard(self):
+        """It should leave a shard alone while another dispatcher drains it"""
+        self._create_shopcarts(1)
+        with db.engine.connect() as connection:
+            connection.execute(select(db.func.pg_advisory_xact_lock(outbox.DISPATCH_LOCK)))
+            self.assertEqual(outbox.dispatch(ListSink())["events"], 0)
+        self.assertEqual(outbox.dispatch(ListSink())["events"], 1)
+
+    def test_dispatch_over_http(self):
+        """It should POST the batches to the local stand-in of an event bus"""
+        self._create_shopcarts(2)
+        received = ListSink()
+        receiver = outbox.EventReceiver(("127.0.0.1", 0), received)
+        threading.Thread(target=receiver.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{receiver.server_address[1]}/events"
+        try:
+            self.assertEqual(outbox.dispatch(outbox.make_sink(url))["events"], 2)
+            self.assertEqual(len(received.batches[0]), 2)
+            with self.assertRaises(OSError):
+                outbox.HttpSink(url).send({"not": "a list"})
+        finally:
+            receiver.shutdown()
+            receiver.server_close()
+
+    def test_make_sink(self):
+        """It should pick the sink by the scheme of its URL"""
+        self.assertEqual(outbox.make_sink("file:events.jsonl").path, "events.jsonl")
+        self.assertEqual(outbox.make_sink("file:///tmp/events.jsonl").path, "/tmp/events.jsonl")
+        self.assertEqual(outbox.make_sink("http://localhost:9100/").url, "http://localhost:9100/")
+        self.assertRaises(ValueError, outbox.make_sink, "kafka://localhost")
@@ -0,0 +1,79 @@
+"""
+Test cases for Memory Profiling
+"""
+from service import app
+from service.common import status, profiling
+from tests.clients import ApiTestCase
+
+
+######################################################################
+#  P R O F I L I N G   T E S T   C A S E S
+######################################################################
+class TestProfiling(ApiTestCase):
+    """Memory Profiling Tests"""
+
+    @classmethod
+    def tearDownClass(cls):
+        """This runs once after the entire test suite"""
+        app.config["DEBUG_ENDPOINTS"] = False
+
+    def setUp(self):
+        """This runs before each test"""
+        super().setUp()
+        app.config["DEBUG_ENDPOINTS"] = True
+
+    def tearDown(self):
+        """This runs after each test"""
+        profiling.stop()
+        super().tearDown()
+
+    def test_metrics(self):
+        """It should report the RSS and gc stats of the worker"""
+        resp = self.client.get("/metrics")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        worker = resp.get_json()["worker"]
+        self.assertGreater(worker["rss_bytes"], 0)
+        self.assertGreaterEqual(worker["max_rss_bytes"], worker["rss_bytes"])
+        self.assertEqual(len(worker["gc"]["counts"]), 3)
+        self.assertIsNone(worker["tracemalloc"])
+
+    def test_memory_snapshots(self):
+        """It should start tracemalloc and return top sites and diffs"""
+        resp = self.client.post("/debug/memory/start?frames=2")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertIsNotNone(resp.get_json()["tracemalloc"])
+
+        resp = self.client.get("/debug/memory/snapshot?limit=5")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertLessEqual(len(data["top"]), 5)
+        self.assertEqual(data["diff"], [])
+
+        buffers = [bytearray(1024) for _ in range(100)]
+        resp = self.client.get("/debug/memory/snapshot?key_type=traceback")
+        data = resp.get_json()
+        self.assertEqual(len(buffers), 100)
+        self.assertTrue(len(data["diff"]) > 0)
+        self.assertIn("size_diff", data["diff"][0])
+
+        resp = self.client.post("/debug/memory/stop")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertFalse(profiling.is_tracing())
+
+    def test_memory_snapshot_not_running(self):
+        """It should return 409 when tracemalloc has not been started"""
+        resp = self.client.get("/debug/memory/snapshot")
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+
+    def test_memory_snapshot_bad_key_type(self):
+        """It should return 400 for an unknown key type"""
+        self.client.post("/debug/memory/start")
+        resp = self.client.get("/debug/memory/snapshot?key_type=bogus")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_memory_endpoints_disabled(self):
+        """It should hide the memory endpoints unless they are enabled"""
+        app.config["DEBUG_ENDPOINTS"] = False
+        resp = self.client.post("/debug/memory/start")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(profiling.is_tracing())
@@ -8,9 +8,11 @@ Test cases can be run with the following:
 import random
 import logging
 from unittest import TestCase
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from tests.factories import ShopcartFactory, CartItemFactory
 from service import app
-from service.models import db, Shopcart, CartItem, init_db
+from service.models import db, Shopcart, CartItem, init_db, shopcart_tombstone
 from service.common import status  # HTTP Status Codes
 
 # DATABASE_URI = os.getenv(
@@ -23,7 +25,7 @@ BASE_URL = "/api/shopcarts"
 ######################################################################
 #  T E S T   C A S E S
 ######################################################################
-class TestYourResourceServer(TestCase):  # pylint: disable=too-many-public-methods
+class TestYourResourceServer(TestCase):  # pylint: disable=too-many-public-methods, too-many-lines
     """REST API Server Tests"""
 
     @classmethod
@@ -41,6 +43,8 @@ class TestYourResourceServer(TestCase):  # pylint: disable=too-many-public-metho
 
     def setUp(self):
         """This runs before each test"""
+        self.app_context = app.app_context()
+        self.app_context.push()
         self.client = app.test_client()
         db.session.query(Shopcart).delete()  # clean up the last tests
         db.session.commit()
@@ -48,6 +52,7 @@ class TestYourResourceServer(TestCase):  # pylint: disable=too-many-public-metho
     def tearDown(self):
         """This runs after each test"""
         db.session.remove()
+        self.app_context.pop()
 
     ######################################################################
     #  P L A C E   T E S T   C A S E S   H E R E
@@ -518,6 +523,128 @@ class TestYourResourceServer(TestCase):  # pylint: disable=too-many-public-metho
         # Check that the response status code is 204 (No Content)
         self.assertEqual(response.status_code, 204)
 
+    def test_delete_items_reports_missing(self):
+        """It should delete the products of the query and the body and report the missing ones"""
+        shopcart = self._create_shopcarts(1)[0]
+        url = f"{BASE_URL}/{shopcart.id}/items"
+        for product_id in (1, 2, 3):
+            self.client.post(url, json={"shopcart_id": shopcart.id, "product_id": product_id, "price": 1.0})
+
+        resp = self.client.delete(url, query_string={"product_ids": "1,9"}, json={"product_ids": [2, 1]})
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(resp.headers["X-Missing-Ids"], "9")
+        self.assertEqual([item["product_id"] for item in self.client.get(url).get_json()], [3])
+
+        resp = self.client.delete(url, json={"product_ids": [1, "a"]})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.delete(url, data="1", content_type="text/plain")
+        self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    def test_apply_item_operations(self):
+        """It should add, update and delete items in order in one request"""
+        shopcart = self._create_shopcarts(1)[0]
+        url = f"{BASE_URL}/{shopcart.id}/operations"
+        self.client.post(f"{BASE_URL}/{shopcart.id}/items", json={"shopcart_id": 0, "product_id": 1, "price": 1.0})
+        operations = [
+            {"op": "add", "product_id": 2, "price": 2.0},
+            {"op": "add", "product_id": 1, "price": 9.0, "quantity": 2},
+            {"op": "update", "product_id": 2, "new_quantity": 5, "new_price": 1.5},
+            {"op": "delete", "product_id": 1},
+            {"op": "update", "product_id": 7, "new_price": 1.0},
+        ]
+        resp = self.client.post(url, json=operations)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual([result["status"] for result in data["results"]], [201, 201, 200, 204, 204])
+        self.assertEqual(data["results"][1]["item"]["quantity"], 3)
+        self.assertIsNone(data["results"][3]["item"])
+        items = [{"shopcart_id": shopcart.id, "product_id": 2, "quantity": 5, "price": 1.5}]
+        self.assertEqual(data["shopcart"]["items"], items)
+        self.assertEqual(self.client.get(f"{BASE_URL}/{shopcart.id}/items").get_json(), items)
+
+        operations = [{"op": "add", "product_id": 3, "price": 1.0}, {"op": "delete", "product_id": 3}]
+        resp = self.client.post(url, json=operations)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([result["status"] for result in resp.get_json()["results"]], [201, 204])
+        self.assertEqual(self.client.get(f"{BASE_URL}/{shopcart.id}/items").get_json(), items)
+
+    def test_item_operations_are_atomic(self):
+        """It should apply no operation when one of them is invalid"""
+        shopcart = self._create_shopcarts(1)[0]
+        url = f"{BASE_URL}/{shopcart.id}/operations"
+        operations = [{"op": "add", "product_id": 2, "price": 2.0}, {"op": "update", "product_id": 2, "new_quantity": 0}]
+        resp = self.client.post(url, json=operations)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(resp.get_json()["message"], "Operation 1: Quantity must be a positive integer.")
+        self.assertEqual(self.client.get(f"{BASE_URL}/{shopcart.id}/items").get_json(), [])
+
+        for body in ({"op": "add"}, [{"op": "move", "product_id": 1}], [{"op": "update", "product_id": 1}]):
+            self.assertEqual(self.client.post(url, json=body).status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.post(f"{BASE_URL}/0/operations", json=[{"op": "delete", "product_id": 1}])
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_merge_shopcarts(self):
+        """It should move the items of a shopcart into another and delete it"""
+        shopcarts = self._create_shopcarts(2)
+        target, source = shopcarts[0], shopcarts[1]
+        lines = ((target, 1, 1, 1.0), (target, 2, 2, 2.0), (source, 2, 3, 9.0), (source, 3, 1, 3.0))
+        for shopcart, product_id, quantity, price in lines:
+            item = {"shopcart_id": 0, "product_id": product_id, "quantity": quantity, "price": price}
+            self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=item)
+
+        resp = self.client.post(f"{BASE_URL}/{target.id}/merge/{source.id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        items = [(item["product_id"], item["quantity"], item["price"]) for item in resp.get_json()["items"]]
+        self.assertEqual(items, [(1, 1, 1.0), (2, 5, 2.0), (3, 1, 3.0)])
+        self.assertEqual(self.client.get(f"{BASE_URL}/{source.id}").status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.client.get(f"/api/customers/{source.customer_id}/shopcart")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+        resp = self.client.post(f"{BASE_URL}/{target.id}/merge/{source.id}")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.client.post(f"{BASE_URL}/{target.id}/merge/{target.id}")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_shopcart_changes(self):
+        """It should list the shopcarts changed or deleted after a cursor"""
+        db.session.execute(shopcart_tombstone.delete())
+        db.session.commit()
+        shopcarts = self._create_shopcarts(3)
+        resp = self.client.get(f"{BASE_URL}/changes", query_string={"limit": 2})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual([change["id"] for change in data["changes"]], [shopcarts[0].id, shopcarts[1].id])
+        self.assertTrue(data["more"])
+        data = self.client.get(f"{BASE_URL}/changes", query_string={"since": data["cursor"]}).get_json()
+        self.assertEqual([change["id"] for change in data["changes"]], [shopcarts[2].id])
+        self.assertFalse(data["more"])
+        cursor = data["cursor"]
+        data = self.client.get(f"{BASE_URL}/changes", query_string={"since": cursor}).get_json()
+        self.assertEqual((data["changes"], data["cursor"], data["more"]), ([], cursor, False))
+
+        # only the cart whose item changed and the deleted cart come after the cursor
+        item = {"shopcart_id": 0, "product_id": 5, "quantity": 1, "price": 2.0}
+        self.client.post(f"{BASE_URL}/{shopcarts[2].id}/items", json=item)
+        self.client.delete(f"{BASE_URL}/{shopcarts[0].id}")
+        data = self.client.get(f"{BASE_URL}/changes", query_string={"since": cursor}).get_json()
+        changed, deleted = data["changes"]
+        self.assertEqual((changed["id"], changed["deleted"]), (shopcarts[2].id, False))
+        self.assertEqual([item["product_id"] for item in changed["shopcart"]["items"]], [5])
+        self.assertEqual((deleted["id"], deleted["customer_id"]), (shopcarts[0].id, shopcarts[0].customer_id))
+        self.assertEqual((deleted["deleted"], deleted["shopcart"]), (True, None))
+
+        query = {"since": cursor, "include_items": "false"}
+        data = self.client.get(f"{BASE_URL}/changes", query_string=query).get_json()
+        self.assertEqual(data["changes"][0]["shopcart"]["items"], [])
+
+    def test_list_shopcart_changes_bad_cursor(self):
+        """It should not list the changes after a cursor that is not valid"""
+        for cursor in ("not-a-cursor", "WzFd", "WzEsICJhIl0="):  # not base64, [1] and [1, "a"]
+            resp = self.client.get(f"{BASE_URL}/changes", query_string={"since": cursor})
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(f"{BASE_URL}/changes", query_string={"limit": 0})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_update_item_shopcart_not_found(self):
         """It should return a 204 NO CONTENT error if updating an item in a missing shopcart"""
         # Create a cart and an item in it
@@ -826,3 +953,293 @@ class TestYourResourceServer(TestCase):  # pylint: disable=too-many-public-metho
             f"{BASE_URL}/{non_existent_shopcart_id}/items/{non_existing_product_id}"
         )
         self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    ######################################################################
+    #  C U S T O M E R   S H O P C A R T   T E S T S
+    ######################################################################
+
+    def test_get_customer_shopcart(self):
+        """It should return the shopcart of a customer and cache its id"""
+        shopcart = self._create_shopcarts(1)[0]
+        url = f"/api/customers/{shopcart.customer_id}/shopcart"
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["id"], shopcart.id)
+
+        hits = Shopcart.customer_cart_ids.stats()["hits"]
+        resp = self.client.get(url)
+        self.assertEqual(resp.get_json()["id"], shopcart.id)
+        self.assertEqual(Shopcart.customer_cart_ids.stats()["hits"], hits + 1)
+
+    def test_get_customer_shopcart_not_found(self):
+        """It should remember customers without a shopcart until they create one"""
+        customer_id = 987654
+        resp = self.client.get(f"/api/customers/{customer_id}/shopcart")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIn(customer_id, Shopcart.customers_without_cart)
+
+        resp = self.client.post(BASE_URL, json={"customer_id": customer_id, "items": []})
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn(customer_id, Shopcart.customers_without_cart)
+        resp = self.client.get(f"/api/customers/{customer_id}/shopcart")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_customer_shopcart_is_invalidated(self):
+        """It should forget the cached shopcart when it is reassigned or deleted"""
+        shopcart = self._create_shopcarts(1)[0]
+        old_url = f"/api/customers/{shopcart.customer_id}/shopcart"
+        new_url = f"/api/customers/{shopcart.customer_id + 1000}/shopcart"
+        self.assertEqual(self.client.get(old_url).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(new_url).status_code, status.HTTP_404_NOT_FOUND)
+
+        resp = self.client.put(
+            f"{BASE_URL}/{shopcart.id}",
+            json={"customer_id": shopcart.customer_id + 1000, "items": []},
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(old_url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(new_url).status_code, status.HTTP_200_OK)
+
+        self.client.delete(f"{BASE_URL}/{shopcart.id}")
+        self.assertEqual(self.client.get(new_url).status_code, status.HTTP_404_NOT_FOUND)
+
+    ######################################################################
+    #  M U L T I - G E T   T E S T S
+    ######################################################################
+
+    def test_get_shopcarts_by_ids(self):
+        """It should fetch many shopcarts by id in request order and list the missing ids"""
+        shopcarts = self._create_shopcarts(3)
+        ids = [shopcarts[2].id, 0, shopcarts[0].id, shopcarts[2].id]
+        resp = self.client.get(BASE_URL, query_string={"ids": ",".join(map(str, ids))})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([cart["id"] for cart in resp.get_json()], [shopcarts[2].id, shopcarts[0].id])
+        self.assertEqual(resp.headers["X-Missing-Ids"], "0")
+
+        resp = self.client.get(BASE_URL, query_string={"ids": "1,x"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_shopcarts_by_customer_ids(self):
+        """It should fetch many shopcarts by customer id with their items"""
+        shopcarts = self._create_shopcarts(2)
+        item = CartItemFactory(shopcart_id=shopcarts[1].id)
+        self.client.post(f"{BASE_URL}/{shopcarts[1].id}/items", json=item.serialize())
+        customer_ids = f"{shopcarts[1].customer_id},{shopcarts[0].customer_id}"
+        resp = self.client.get(BASE_URL, query_string={"customer_ids": customer_ids})
+        data = resp.get_json()
+        self.assertEqual([cart["id"] for cart in data], [shopcarts[1].id, shopcarts[0].id])
+        self.assertEqual(len(data[0]["items"]), 1)
+        self.assertEqual(resp.headers["X-Missing-Ids"], "")
+
+        resp = self.client.get(BASE_URL, query_string={"ids": str(shopcarts[0].id), "customer_ids": customer_ids})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Provide either ids or customer_ids", resp.get_json()["message"])
+
+    def test_lookup_shopcarts(self):
+        """It should fetch many shopcarts from a posted list of ids"""
+        shopcarts = self._create_shopcarts(2)
+        resp = self.client.post(f"{BASE_URL}/lookup", json={"ids": [shopcarts[1].id, 0]})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual([cart["id"] for cart in data["shopcarts"]], [shopcarts[1].id])
+        self.assertEqual(data["missing"], [0])
+
+        customer_ids = [shopcarts[0].customer_id]
+        resp = self.client.post(f"{BASE_URL}/lookup", json={"customer_ids": customer_ids})
+        self.assertEqual(resp.get_json()["shopcarts"][0]["id"], shopcarts[0].id)
+
+    def test_lookup_shopcarts_bad_requests(self):
+        """It should reject lookups without exactly one list of integer ids"""
+        for body in ({}, {"ids": [1], "customer_ids": [2]}, {"ids": "1,2"}, {"ids": [1, "a"]}):
+            resp = self.client.post(f"{BASE_URL}/lookup", json=body)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+        app.config["LOOKUP_MAX_IDS"] = 2
+        try:
+            resp = self.client.post(f"{BASE_URL}/lookup", json={"ids": [1, 2, 3]})
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        finally:
+            app.config["LOOKUP_MAX_IDS"] = 1000
+
+    def test_bulk_create_shopcarts(self):
+        """It should create many shopcarts and report a conflict per duplicate customer"""
+        existing = self._create_shopcarts(1)[0]
+        line = {"shopcart_id": 0, "product_id": 7, "quantity": 2, "price": 3.5}
+        body = [
+            {"customer_id": 900001, "items": [line, dict(line, quantity=1, price=4.0)]},
+            {"customer_id": existing.customer_id, "items": []},
+            {"customer_id": 900002},
+            {"customer_id": 900001, "items": []},
+        ]
+        resp = self.client.post(f"{BASE_URL}/bulk", json=body)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual((data["created"], data["conflicts"]), (2, 2))
+        self.assertEqual([result["status"] for result in data["results"]], [201, 409, 201, 409])
+        shopcart = data["results"][0]["shopcart"]
+        self.assertEqual(shopcart["items"], [{"shopcart_id": shopcart["id"], "product_id": 7, "quantity": 3, "price": 4.0}])
+
+        resp = self.client.get(f"{BASE_URL}/{shopcart['id']}")
+        self.assertEqual(resp.get_json(), shopcart)
+        resp = self.client.get("/api/customers/900002/shopcart")
+        self.assertEqual(resp.get_json()["id"], data["results"][2]["shopcart"]["id"])
+
+    def test_bulk_create_bad_requests(self):
+        """It should reject a bulk create that is not a list of valid shopcarts"""
+        resp = self.client.post(f"{BASE_URL}/bulk", json={"customer_id": 1})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.post(f"{BASE_URL}/bulk", json=[{"customer_id": 1}, {"customer_id": "a"}])
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("'[1].customer_id'", resp.get_json()["message"])
+        resp = self.client.post(f"{BASE_URL}/bulk", data="[]", content_type="text/plain")
+        self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+        app.config["BULK_MAX_SHOPCARTS"] = 1
+        try:
+            resp = self.client.post(f"{BASE_URL}/bulk", json=[{"customer_id": 1}, {"customer_id": 2}])
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        finally:
+            app.config["BULK_MAX_SHOPCARTS"] = 10000
+        with app.app_context():
+            self.assertEqual(len(Shopcart.all()), 0)
+
+    def test_set_product_price(self):
+        """It should reprice a product in every shopcart through the admin endpoint"""
+        shopcarts = self._create_shopcarts(3)
+        for shopcart in shopcarts[:2]:
+            self.client.post(f"{BASE_URL}/{shopcart.id}/items", json={"shopcart_id": 0, "product_id": 42, "price": 1.0})
+        url = "/api/admin/products/42/price"
+        resp = self.client.put(url, json={"price": 3.0})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+        app.config["ADMIN_ENDPOINTS"] = True
+        try:
+            resp = self.client.put(url, json={"price": 3.0})
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp.get_json(), {"product_id": 42, "price": 3.0, "shopcarts": 2})
+            resp = self.client.put(url, json={"price": -3.0})
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        finally:
+            app.config["ADMIN_ENDPOINTS"] = False
+        resp = self.client.get(f"{BASE_URL}/{shopcarts[0].id}/items/42")
+        self.assertEqual(resp.get_json()["price"], 3.0)
+
+    ######################################################################
+    #  S P A R S E   F I E L D S E T   T E S T S
+    ######################################################################
+
+    def _statements(self, url, **kwargs):
+        """Returns the response of a GET and the SQL statements it ran"""
+        statements = []
+
+        def record(conn, cursor, statement, *args):  # pylint: disable=unused-argument
+            statements.append(statement)
+
+        event.listen(Engine, "before_cursor_execute", record)
+        try:
+            resp = self.client.get(url, **kwargs)
+        finally:
+            event.remove(Engine, "before_cursor_execute", record)
+        return resp, statements
+
+    def test_list_shopcarts_without_items(self):
+        """It should list shopcarts without ever querying their items"""
+        shopcart = self._create_shopcarts(1)[0]
+        item = CartItemFactory(shopcart_id=shopcart.id)
+        self.client.post(f"{BASE_URL}/{shopcart.id}/items", json=item.serialize())
+
+        for query_string in ({"include_items": "false"}, {"fields": "id,customer_id"}):
+            resp, statements = self._statements(BASE_URL, query_string=query_string)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp.get_json(), [{"id": shopcart.id, "customer_id": shopcart.customer_id}])
+            self.assertFalse([sql for sql in statements if "cart_item" in sql])
+
+        resp, statements = self._statements(BASE_URL)
+        self.assertEqual(len(resp.get_json()[0]["items"]), 1)
+        self.assertTrue([sql for sql in statements if "cart_item" in sql])
+
+    def test_get_shopcart_fields(self):
+        """It should return only the requested fields of one shopcart"""
+        shopcart = self._create_shopcarts(1)[0]
+        resp, statements = self._statements(f"{BASE_URL}/{shopcart.id}", query_string={"fields": "customer_id"})
+        self.assertEqual(resp.get_json(), {"customer_id": shopcart.customer_id})
+        self.assertFalse([sql for sql in statements if "cart_item" in sql])
+
+        url = f"/api/customers/{shopcart.customer_id}/shopcart"
+        resp = self.client.get(url, query_string={"fields": "id,items", "include_items": "false"})
+        self.assertEqual(resp.get_json(), {"id": shopcart.id})
+
+        resp = self.client.post(f"{BASE_URL}/lookup?fields=id", json={"ids": [shopcart.id]})
+        self.assertEqual(resp.get_json()["shopcarts"], [{"id": shopcart.id}])
+
+    def test_bad_fields(self):
+        """It should reject unknown or empty field lists"""
+        shopcart = self._create_shopcarts(1)[0]
+        for query_string in ({"fields": "id,secret"}, {"fields": "items", "include_items": "false"}):
+            resp = self.client.get(f"{BASE_URL}/{shopcart.id}", query_string=query_string)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(BASE_URL, query_string={"include_items": "maybe"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    ######################################################################
+    #  I T E M   L I S T I N G   T E S T S
+    ######################################################################
+
+    def _create_items(self, shopcart_id, rows):
+        """Adds items from (product_id, quantity, price) rows to a shopcart"""
+        for product_id, quantity, price in rows:
+            resp = self.client.post(
+                f"{BASE_URL}/{shopcart_id}/items",
+                json={"product_id": product_id, "quantity": quantity, "price": price},
+            )
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+
+    def test_filter_and_sort_items(self):
+        """It should filter items by product ids, price and quantity and sort them"""
+        shopcart = self._create_shopcarts(1)[0]
+        self._create_items(shopcart.id, [(1, 5, 9.5), (2, 1, 2.0), (3, 3, 4.0), (4, 2, 4.0)])
+        url = f"{BASE_URL}/{shopcart.id}/items"
+
+        resp = self.client.get(url, query_string={"product_ids": "1,3,4", "max_price": 5})
+        self.assertEqual([item["product_id"] for item in resp.get_json()], [3, 4])
+        resp = self.client.get(url, query_string={"min_quantity": 2, "max_quantity": 3})
+        self.assertEqual([item["product_id"] for item in resp.get_json()], [3, 4])
+        resp = self.client.get(url, query_string={"sort": "-price"})
+        self.assertEqual([item["product_id"] for item in resp.get_json()], [1, 4, 3, 2])
+        resp = self.client.get(url, query_string={"sort": "quantity", "min_price": 3})
+        self.assertEqual([item["product_id"] for item in resp.get_json()], [4, 3, 1])
+        resp = self.client.get(url, query_string={"sort": "name"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_paginate_items(self):
+        """It should page through the items with limit and X-Next-Cursor"""
+        shopcart = self._create_shopcarts(1)[0]
+        self._create_items(shopcart.id, [(n, 1, float(n % 3)) for n in range(1, 8)])
+        url = f"{BASE_URL}/{shopcart.id}/items"
+
+        for sort, expected in (("product_id", list(range(1, 8))), ("-price", [5, 2, 7, 4, 1, 6, 3])):
+            seen = []
+            query_string = {"sort": sort, "limit": 3}
+            while True:
+                resp = self.client.get(url, query_string=query_string)
+                self.assertEqual(resp.status_code, status.HTTP_200_OK)
+                self.assertLessEqual(len(resp.get_json()), 3)
+                seen += [item["product_id"] for item in resp.get_json()]
+                if "X-Next-Cursor" not in resp.headers:
+                    break
+                query_string["cursor"] = resp.headers["X-Next-Cursor"]
+            self.assertEqual(seen, expected)
+
+    def test_paginate_items_bad_cursor(self):
+        """It should reject cursors that are invalid or belong to another sort order"""
+        shopcart = self._create_shopcarts(1)[0]
+        self._create_items(shopcart.id, [(1, 1, 1.0), (2, 1, 2.0)])
+        url = f"{BASE_URL}/{shopcart.id}/items"
+        resp = self.client.get(url, query_string={"limit": 1, "cursor": "not-a-cursor"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+        cursor = self.client.get(url, query_string={"limit": 1}).headers["X-Next-Cursor"]
+        resp = self.client.get(url, query_string={"limit": 1, "cursor": cursor, "sort": "price"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.client.get(url, query_string={"limit": 0})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,140 @@
+"""
+Replica Routing Test Suite
+
+Uses a second database as a stand-in read replica. Since nothing is
+replicated into it, a read that returns 404 proves it went to the replica.
+"""
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from service import app
+from service.models import db, Shopcart
+from service.common import status
+from service.common.routing import RoutingSession, STICKY_COOKIE
+from tests.clients import ApiTestCase
+from tests.databases import DATABASE_URI, create_test_database
+
+BASE_URL = "/api/shopcarts"
+
+
+######################################################################
+#  R O U T I N G   T E S T   C A S E S
+######################################################################
+class TestReplicaRouting(ApiTestCase):
+    """Read Replica Routing Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        super().setUpClass()
+        app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URI
+        cls.replica = create_test_database("replica_testdb")
+        cls.router = app.extensions["replica_router"]
+        with app.app_context():
+            db.engines["replica_0"] = cls.replica
+
+    @classmethod
+    def tearDownClass(cls):
+        """This runs once after the entire test suite"""
+        cls.router.set_replicas([])
+        with app.app_context():
+            del db.engines["replica_0"]
+        cls.replica.dispose()
+
+    def setUp(self):
+        """This runs before each test"""
+        super().setUp()
+        self.router.set_replicas(["replica_0"])
+
+    def _create_shopcart(self):
+        """Creates a shopcart on the primary and returns its URL"""
+        resp = self.client.post(BASE_URL, json={"customer_id": 1, "items": []})
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        return f"{BASE_URL}/{resp.get_json()['id']}"
+
+    def test_session_class(self):
+        """It should use the routing session for db.session"""
+        with app.app_context():
+            self.assertIsInstance(db.session(), RoutingSession)
+
+    def test_reads_go_to_replica(self):
+        """It should serve GET requests from the replica"""
+        url = self._create_shopcart()
+        self.client.delete_cookie(STICKY_COOKIE)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(BASE_URL).get_json(), [])
+        self.assertGreater(self.router.stats()["replica_0"]["reads"], 0)
+
+    def test_writes_go_to_primary(self):
+        """It should send writes and the reads made by writes to the primary"""
+        url = self._create_shopcart()
+        self.client.delete_cookie(STICKY_COOKIE)
+        resp = self.client.post(f"{url}/items", json={"product_id": 3, "price": 1.0})
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        with app.app_context():
+            self.assertEqual(len(Shopcart.all()), 1)
+
+    def test_read_your_writes(self):
+        """It should read from the primary for a while after a write"""
+        url = self._create_shopcart()
+        self.assertIsNotNone(self.client.get_cookie(STICKY_COOKIE))
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+        self.client.set_cookie(STICKY_COOKIE, "0")  # the window has passed
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_failed_write_is_not_sticky(self):
+        """It should not pin a client to the primary after a failed write"""
+        resp = self.client.post(BASE_URL, json={})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIsNone(self.client.get_cookie(STICKY_COOKIE))
+
+    def test_unhealthy_replica(self):
+        """It should fall back to the primary when a replica is down"""
+        broken = create_engine(make_url(DATABASE_URI).set(port=1))
+        with app.app_context():
+            db.engines["replica_1"] = broken
+        try:
+            self.router.set_replicas(["replica_1"])
+            url = self._create_shopcart()
+            self.client.delete_cookie(STICKY_COOKIE)
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+            self.assertFalse(self.router.stats()["replica_1"]["healthy"])
+        finally:
+            with app.app_context():
+                del db.engines["replica_1"]
+            broken.dispose()
+
+    def test_one_replica_per_request(self):
+        """It should read a cart and its items from the same replica"""
+        other = create_test_database("replica_testdb_2")
+        with app.app_context():
+            db.engines["replica_1"] = other
+        try:
+            for engine, customer_id in ((self.replica, 100), (other, 200)):
+                with engine.begin() as connection:
+                    connection.execute(text("DELETE FROM shopcart"))
+                    cart = text("INSERT INTO shopcart (id, customer_id) VALUES (999999, :id)")
+                    connection.execute(cart, {"id": customer_id})
+                    connection.execute(
+                        text("INSERT INTO cart_item (shopcart_id, product_id, quantity, price) VALUES (999999, :id, 1, 1)"),
+                        {"id": customer_id},
+                    )
+            self.router.set_replicas(["replica_0", "replica_1"])
+            for _ in range(4):
+                cart = self.client.get(f"{BASE_URL}/999999").get_json()
+                self.assertEqual([item["product_id"] for item in cart["items"]], [cart["customer_id"]])
+            self.assertEqual([stats["reads"] > 0 for stats in self.router.stats().values()], [True, True])
+        finally:
+            for engine in (self.replica, other):
+                with engine.begin() as connection:
+                    connection.execute(text("DELETE FROM shopcart"))
+            with app.app_context():
+                del db.engines["replica_1"]
+            other.dispose()
+
+    def test_no_replicas(self):
+        """It should use the primary when no replicas are configured"""
+        self.router.set_replicas([])
+        url = self._create_shopcart()
+        self.assertIsNone(self.client.get_cookie(STICKY_COOKIE))
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
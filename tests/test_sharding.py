@@ -0,0 +1,181 @@
+"""
+Sharding Test Suite
+
+Splits the shopcarts over the test database (shard 0) and a second local
+database (shard 1) and checks that every route finds them.
+"""
+from unittest.mock import patch
+from sqlalchemy import text
+from sqlalchemy.exc import DataError
+from service import app
+from service.models import db, Shopcart
+from service.common import status, sharding
+from tests.clients import ApiTestCase
+from tests.databases import create_test_database
+
+BASE_URL = "/api/shopcarts"
+
+
+######################################################################
+#  S H A R D I N G   T E S T   C A S E S
+######################################################################
+class TestSharding(ApiTestCase):
+    """Sharded Database Tests"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        super().setUpClass()
+        cls.shard = create_test_database("shard_testdb_1")
+        with app.app_context():
+            db.engines["shard_1"] = cls.shard
+            cls.primary = db.engines[None]
+        app.extensions["shard_map"].set_shards([None, "shard_1"])
+        sharding.prepare_shard(cls.primary, db.metadata, 0, 2)
+        sharding.prepare_shard(cls.shard, db.metadata, 1, 2)
+
+    @classmethod
+    def tearDownClass(cls):
+        """This runs once after the entire test suite"""
+        sharding.prepare_shard(cls.primary, db.metadata, 0, 1)
+        app.extensions["shard_map"].set_shards([None])
+        with app.app_context():
+            del db.engines["shard_1"]
+        cls.shard.dispose()
+
+    def setUp(self):
+        """This runs before each test"""
+        super().setUp()
+        for engine in (self.primary, self.shard):
+            with engine.begin() as connection:
+                connection.execute(text("DELETE FROM shopcart"))  # clean up the last tests
+                connection.execute(text("DELETE FROM shopcart_tombstone"))
+
+    def _create_shopcart(self, customer_id, product_id=1):
+        """Creates a shopcart holding one item and returns its id"""
+        item = {"shopcart_id": 0, "product_id": product_id, "quantity": 1, "price": 2.0}
+        resp = self.client.post(BASE_URL, json={"customer_id": customer_id, "items": [item]})
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        return resp.get_json()["id"]
+
+    def _customers_on(self, engine):
+        """Returns the customer ids stored on a shard"""
+        with engine.connect() as connection:
+            rows = connection.execute(text("SELECT customer_id FROM shopcart"))
+            return sorted(row.customer_id for row in rows)
+
+    def test_carts_are_placed_by_customer(self):
+        """It should store a cart on the shard of its customer with an id naming that shard"""
+        even = self._create_shopcart(10)
+        odd = self._create_shopcart(11)
+        self.assertEqual(even % 2, 0)
+        self.assertEqual(odd % 2, 1)
+        self.assertEqual(self._customers_on(self.primary), [10])
+        self.assertEqual(self._customers_on(self.shard), [11])
+
+    def test_single_cart_routes(self):
+        """It should read, change and delete carts on either shard"""
+        for customer_id in (20, 21):
+            shopcart_id = self._create_shopcart(customer_id)
+            url = f"{BASE_URL}/{shopcart_id}"
+            self.assertEqual(self.client.get(url).get_json()["customer_id"], customer_id)
+
+            resp = self.client.post(f"{url}/items", json={"product_id": 5, "price": 1.5})
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+            resp = self.client.put(f"{url}/items/5", json={"new_quantity": 4})
+            self.assertEqual(resp.get_json()["quantity"], 4)
+            self.assertEqual(len(self.client.get(f"{url}/items").get_json()), 2)
+            self.assertEqual(self.client.delete(f"{url}/items/5").status_code, status.HTTP_204_NO_CONTENT)
+
+            resp = self.client.get(BASE_URL, query_string={"customer_id": customer_id})
+            self.assertEqual([cart["id"] for cart in resp.get_json()], [shopcart_id])
+
+            self.assertEqual(self.client.delete(url).status_code, status.HTTP_204_NO_CONTENT)
+            self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_collections_fan_out(self):
+        """It should merge the carts of every shard in id order"""
+        ids = [self._create_shopcart(customer_id, customer_id % 3 + 1) for customer_id in range(30, 36)]
+        data = self.client.get(BASE_URL).get_json()
+        self.assertEqual([cart["id"] for cart in data], sorted(ids))
+        self.assertTrue(all(len(cart["items"]) == 1 for cart in data))
+
+        data = self.client.get(BASE_URL, query_string={"product_id": 1}).get_json()
+        self.assertEqual(sorted(cart["customer_id"] for cart in data), [30, 33])
+        with app.app_context():
+            self.assertEqual(len(Shopcart.all()), 6)
+
+    def test_duplicate_customer(self):
+        """It should still reject a second cart for a customer on another shard"""
+        self._create_shopcart(41)
+        resp = self.client.post(BASE_URL, json={"customer_id": 41, "items": []})
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+
+    def test_bulk_create_splits_by_shard(self):
+        """It should insert a bulk create on the shards of the customers"""
+        self._create_shopcart(61)
+        body = [{"customer_id": customer_id, "items": []} for customer_id in (60, 61, 62, 63)]
+        data = self.client.post(f"{BASE_URL}/bulk", json=body).get_json()
+        self.assertEqual([result["status"] for result in data["results"]], [201, 409, 201, 201])
+        self.assertEqual([result["shopcart"]["id"] % 2 for result in data["results"] if "shopcart" in result], [0, 0, 1])
+        self.assertEqual(self._customers_on(self.primary), [60, 62])
+        self.assertEqual(self._customers_on(self.shard), [61, 63])
+
+    def test_merge_across_shards(self):
+        """It should merge a cart into a cart on another shard, committing the target first"""
+        target = self._create_shopcart(70, product_id=1)
+        source = self._create_shopcart(71, product_id=1)
+        resp = self.client.post(f"{BASE_URL}/{target}/merge/{source}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["items"][0]["quantity"], 2)
+        self.assertEqual(self._customers_on(self.shard), [])
+
+        source = self._create_shopcart(73, product_id=1)
+        with patch.object(db.session, "commit", side_effect=DataError("DELETE", {}, Exception("lost"))):
+            resp = self.client.post(f"{BASE_URL}/{target}/merge/{source}")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(f"{BASE_URL}/{target}").get_json()["items"][0]["quantity"], 3)
+        self.assertEqual(self.client.get(f"{BASE_URL}/{source}").status_code, status.HTTP_200_OK)
+
+    def test_changes_of_both_shards(self):
+        """It should page through the changes of both shards with one cursor"""
+        ids = [self._create_shopcart(customer_id) for customer_id in (80, 81, 82, 83)]
+        seen, cursor, more = [], None, True
+        while more:
+            query = {"limit": 1, "since": cursor} if cursor else {"limit": 1}
+            data = self.client.get(f"{BASE_URL}/changes", query_string=query).get_json()
+            seen += [change["id"] for change in data["changes"]]
+            cursor, more = data["cursor"], data["more"]
+        self.assertEqual(sorted(seen), sorted(ids))
+
+        self.client.delete(f"{BASE_URL}/{ids[1]}")
+        data = self.client.get(f"{BASE_URL}/changes", query_string={"since": cursor}).get_json()
+        self.assertEqual([(change["id"], change["deleted"]) for change in data["changes"]], [(ids[1], True)])
+
+    def test_customer_change_stays_on_the_shard(self):
+        """It should not give a cart to a customer whose carts live on another shard"""
+        shopcart_id = self._create_shopcart(10)
+        item = {"shopcart_id": shopcart_id, "product_id": 1, "quantity": 1, "price": 2.0}
+        resp = self.client.put(f"{BASE_URL}/{shopcart_id}", json={"customer_id": 11, "items": [item]})
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        cart = self.client.get(f"{BASE_URL}/{shopcart_id}").get_json()
+        self.assertEqual((cart["customer_id"], len(cart["items"])), (10, 1))
+        self.assertEqual(self.client.get("/api/customers/11/shopcart").status_code, status.HTTP_404_NOT_FOUND)
+
+        resp = self.client.put(f"{BASE_URL}/{shopcart_id}", json={"customer_id": 12, "items": [item]})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.client.get("/api/customers/12/shopcart")
+        self.assertEqual(resp.get_json()["id"], shopcart_id)
+        self.assertEqual(self.client.get(BASE_URL, query_string={"customer_id": 12}).get_json()[0]["id"], shopcart_id)
+
+    def test_multi_get_groups_by_shard(self):
+        """It should fetch carts of both shards in request order"""
+        ids = [self._create_shopcart(customer_id) for customer_id in (50, 51, 52)]
+        resp = self.client.get(BASE_URL, query_string={"ids": f"{ids[1]},{ids[0]},1,{ids[2]}"})
+        self.assertEqual([cart["id"] for cart in resp.get_json()], [ids[1], ids[0], ids[2]])
+        self.assertEqual(resp.headers["X-Missing-Ids"], "1")
+
+        resp = self.client.post(f"{BASE_URL}/lookup", json={"customer_ids": [52, 53, 51]})
+        data = resp.get_json()
+        self.assertEqual([cart["customer_id"] for cart in data["shopcarts"]], [52, 51])
+        self.assertEqual(data["missing"], [53])
@@ -0,0 +1,156 @@
+"""
+Test cases for Request Tracing
+"""
+import os
+import json
+import tempfile
+from service import app
+from service.models import Shopcart
+from service.common import status, tracing, sharding
+from tests.clients import ApiTestCase
+
+BASE_URL = "/api/shopcarts"
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_ID = "00f067aa0ba902b7"
+
+
+######################################################################
+#  T R A C I N G   T E S T   C A S E S
+######################################################################
+class TestTracing(ApiTestCase):
+    """Request Tracing Tests"""
+
+    push_context = True
+
+    @classmethod
+    def tearDownClass(cls):
+        """This runs once after the entire test suite"""
+        tracing.set_exporter(None)
+        app.config["DEBUG_ENDPOINTS"] = False
+
+    def setUp(self):
+        """This runs before each test"""
+        super().setUp()
+        self.exporter = tracing.MemoryExporter(100)
+        tracing.set_exporter(self.exporter)
+        app.config["DEBUG_ENDPOINTS"] = True
+
+    def test_parse_traceparent(self):
+        """It should parse valid traceparent headers and reject bad ones"""
+        header = f"00-{TRACE_ID}-{PARENT_ID}-01"
+        self.assertEqual(tracing.parse_traceparent(header), (TRACE_ID, PARENT_ID))
+        self.assertIsNone(tracing.parse_traceparent(None))
+        self.assertIsNone(tracing.parse_traceparent("garbage"))
+        self.assertIsNone(tracing.parse_traceparent(f"00-{'0' * 32}-{PARENT_ID}-01"))
+
+    def test_request_span(self):
+        """It should record a server span per request and echo the traceparent"""
+        resp = self.client.get("/health")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        spans = self.exporter.find()
+        self.assertEqual(len(spans), 1)
+        self.assertEqual(spans[0]["name"], "GET /health")
+        self.assertEqual(spans[0]["kind"], "server")
+        self.assertEqual(spans[0]["attributes"]["status_code"], 200)
+        self.assertIn(spans[0]["span_id"], resp.headers["traceparent"])
+
+    def test_propagated_trace_id(self):
+        """It should continue the trace from an incoming traceparent header"""
+        header = f"00-{TRACE_ID}-{PARENT_ID}-01"
+        self.client.get(BASE_URL, headers={"traceparent": header})
+        spans = self.exporter.find(TRACE_ID)
+        self.assertTrue(len(spans) > 1)
+        server = [span for span in spans if span["kind"] == "server"][0]
+        self.assertEqual(server["parent_id"], PARENT_ID)
+
+    def test_model_and_sql_spans(self):
+        """It should record child spans for model calls and SQL statements"""
+        resp = self.client.post(BASE_URL, json={"customer_id": 1, "items": []})
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        spans = self.exporter.find()
+        server = spans[-1]
+        self.assertEqual(server["kind"], "server")
+        model = [span for span in spans if span["name"] == "Shopcart.create"][0]
+        self.assertEqual(model["parent_id"], server["span_id"])
+        sql = [span for span in spans if span["parent_id"] == model["span_id"]]
+        self.assertTrue(any("INSERT" in span["attributes"]["statement"] for span in sql))
+
+    def test_no_spans_outside_requests(self):
+        """It should not record model spans without an active trace"""
+        Shopcart.all()
+        self.assertEqual(self.exporter.find(), [])
+
+    def test_list_traces(self):
+        """It should return buffered spans from the debug endpoint"""
+        self.client.get("/health")
+        resp = self.client.get("/debug/traces")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data[0]["name"], "GET /health")
+
+    def test_list_traces_disabled(self):
+        """It should hide the debug endpoint unless it is enabled"""
+        app.config["DEBUG_ENDPOINTS"] = False
+        resp = self.client.get("/debug/traces")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_list_traces_without_memory_exporter(self):
+        """It should return 404 when spans are not kept in memory"""
+        tracing.set_exporter(None)
+        resp = self.client.get("/debug/traces")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_file_exporter(self):
+        """It should append finished spans to a JSONL file"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "traces.jsonl")
+            exporter = tracing.create_exporter("file", path)
+            tracing.set_exporter(exporter)
+            self.client.get("/health")
+            self.assertFalse(os.path.exists(path))  # buffered until the next flush
+            exporter.flush()
+            self.client.get("/health")
+            exporter.close()
+            with open(path, encoding="utf-8") as trace_file:
+                spans = [json.loads(line) for line in trace_file]
+        self.assertEqual([item["name"] for item in spans], ["GET /health", "GET /health"])
+
+    def test_file_exporter_batches(self):
+        """It should write the buffered spans once a batch is full"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "traces.jsonl")
+            exporter = tracing.FileExporter(path, flush_size=3, flush_interval=60)
+            for name in ("a", "b", "c", "d"):
+                exporter.export(tracing.Span(name, "internal", TRACE_ID))
+            with open(path, encoding="utf-8") as trace_file:
+                self.assertEqual([json.loads(line)["name"] for line in trace_file], ["a", "b", "c"])
+            exporter.close()
+
+    def test_file_exporter_after_fork(self):
+        """It should drop the spans a forked worker inherited but keep its own"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "traces.jsonl")
+            exporter = tracing.FileExporter(path, flush_size=2, flush_interval=60)
+            exporter.export(tracing.Span("parent", "internal", TRACE_ID))
+            exporter.pid = -1  # as seen from a worker forked now
+            exporter.export(tracing.Span("worker", "internal", TRACE_ID))
+            exporter.close()
+            with open(path, encoding="utf-8") as trace_file:
+                self.assertEqual([json.loads(line)["name"] for line in trace_file], ["worker"])
+
+    def test_fan_out_spans_keep_their_parent(self):
+        """It should record the spans of fan-out threads in the trace of the request"""
+        app.extensions["shard_map"].set_shards([None, None])
+        try:
+            root = tracing.start_span("root")
+            parents = sharding.run_on_shards(lambda: [tracing.current_span()], {0: (), 1: ()})
+            root.finish()
+        finally:
+            app.extensions["shard_map"].set_shards([None])
+        self.assertEqual(parents, [root, root])
+
+    def test_create_exporter(self):
+        """It should create exporters from their configured names"""
+        self.assertIsInstance(tracing.create_exporter("memory"), tracing.MemoryExporter)
+        self.assertIsNone(tracing.create_exporter("none"))
+        self.assertIsNone(tracing.create_exporter(None))
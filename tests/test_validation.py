@@ -0,0 +1,106 @@
+"""
+Request Validation Test Suite
+"""
+from werkzeug.datastructures import MultiDict
+from service import app
+from service.models import DataValidationError
+from service.common import status
+from service.routes import (
+    shopcart_query, cartItem_query, shopcart_body, cartItem_body, update_item_body, lookup_body
+)
+from tests.clients import ApiTestCase
+
+BASE_URL = "/api/shopcarts"
+
+
+######################################################################
+#  V A L I D A T I O N   T E S T   C A S E S
+######################################################################
+class TestValidation(ApiTestCase):
+    """Compiled Validator Tests"""
+
+    def assert_invalid(self, validate, data, message):
+        """Asserts that validating data fails with a message"""
+        with self.assertRaises(DataValidationError) as context:
+            validate(data)
+        self.assertEqual(str(context.exception), message)
+
+    def test_parse_query(self):
+        """It should convert query arguments and apply their defaults"""
+        args = cartItem_query.parse(MultiDict({"product_ids": "1,2", "min_price": "1.5", "limit": "10"}))
+        self.assertEqual(args["product_ids"], [1, 2])
+        self.assertEqual(args["min_price"], 1.5)
+        self.assertEqual(args["limit"], 10)
+        self.assertEqual(args["sort"], "product_id")
+        self.assertIsNone(args["cursor"])
+        args = shopcart_query.parse(MultiDict({"include_items": "false"}))
+        self.assertFalse(args["include_items"])
+        self.assertIsNone(args["customer_id"])
+
+    def test_bad_query(self):
+        """It should reject query arguments that do not convert or are not a choice"""
+        self.assert_invalid(
+            cartItem_query.parse, MultiDict({"min_quantity": "two"}),
+            "Invalid query parameter 'min_quantity': must be an integer.",
+        )
+        self.assert_invalid(
+            cartItem_query.parse, MultiDict({"limit": "0"}),
+            "Invalid query parameter 'limit': must be an integer from 1 to 1000.",
+        )
+        self.assert_invalid(
+            cartItem_query.parse, MultiDict({"sort": "name"}),
+            "Invalid query parameter 'sort': must be one of -price, -product_id, -quantity, price, product_id, quantity.",
+        )
+        self.assert_invalid(
+            shopcart_query.parse, MultiDict({"ids": "1,x"}),
+            "Invalid query parameter 'ids': must be a comma separated list of integers.",
+        )
+
+    def test_validate_body(self):
+        """It should return the known fields of a body with the defaults applied"""
+        data = cartItem_body.validate({"product_id": 1, "price": 2, "color": "red"})
+        self.assertEqual(data, {"product_id": 1, "price": 2, "quantity": 1})
+        data = shopcart_body.validate({"customer_id": 3})
+        self.assertEqual(data, {"customer_id": 3})
+        data = update_item_body.validate({"new_quantity": "4", "new_price": ""})
+        self.assertEqual(data, {"new_quantity": 4})
+
+    def test_bad_body(self):
+        """It should reject bodies with missing, mistyped or out of range fields"""
+        self.assert_invalid(cartItem_body.validate, {"price": 1.0}, "Invalid field 'product_id': is required.")
+        self.assert_invalid(
+            cartItem_body.validate, {"product_id": True, "price": 1.0}, "Invalid field 'product_id': must be an integer."
+        )
+        self.assert_invalid(
+            cartItem_body.validate, {"product_id": 1, "price": -1}, "Invalid field 'price': must be a number of at least 0."
+        )
+        self.assert_invalid(
+            shopcart_body.validate, {"customer_id": 1, "items": [{"product_id": 1}]},
+            "Invalid field 'items[0].shopcart_id': is required.",
+        )
+        self.assert_invalid(shopcart_body.validate, [], "Invalid field 'body': must be a JSON object.")
+        self.assert_invalid(lookup_body.validate, {"ids": [1, "2"]}, "Invalid field 'ids[1]': must be an integer.")
+        self.assert_invalid(update_item_body.validate, {"new_quantity": "1.5"}, "Quantity must be a positive integer.")
+
+    def test_error_body(self):
+        """It should answer invalid requests with the usual 400 body"""
+        client = app.test_client()
+        resp = client.post(BASE_URL, json={"customer_id": "1"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            resp.get_json(),
+            {"status": 400, "error": "Bad Request", "message": "Invalid field 'customer_id': must be an integer."},
+        )
+        resp = client.get(BASE_URL, query_string={"customer_id": "x"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(resp.get_json()["error"], "Bad Request")
+
+    def test_errors_without_propagation(self):
+        """It should not turn bad data into 500s when exceptions do not propagate"""
+        app.config["TESTING"] = False
+        try:
+            resp = app.test_client().post(BASE_URL, json={})
+        finally:
+            app.config["TESTING"] = True
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(resp.get_json()["message"], "Invalid field 'customer_id': is required.")